@@ -1,16 +1,26 @@
 import os
+import asyncio
 from dotenv import load_dotenv
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Request, status
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from contextlib import asynccontextmanager
 
 from utils.firebase import init_firebase, get_db
+from utils.ai_utils import AI_MODEL, AIConcurrencyLimit
+from utils.context_builder import warm_encoding
+from utils.session_actor import SESSION_ACTORS, session_actors
+from utils.search_index import (
+    NOVEL_INDEX_REFRESH_SECONDS,
+    rebuild_novel_indexes,
+    refresh_novel_indexes_forever,
+)
 
 from routes.auth_routes import router as auth_router
 from routes.novel_routes import router as novel_router
 from routes.ai_routes import router as ai_router
-from routes.multiplayer_routes  import router as multiplayer_router
+from routes.multiplayer_routes  import router as multiplayer_router, round_timers
 from routes.friend_routes import router as friends_router
 
 # Завантажуємо змінні оточення
@@ -19,7 +29,22 @@ load_dotenv()
 @asynccontextmanager
 async def lifespan(_app: FastAPI):
     init_firebase()
+    # токенізатор може завантажуватись з мережі - не в event loop запиту
+    await warm_encoding(AI_MODEL)
+    # Індекси пошуку (назви, жанри) будуємо один раз на старті воркера
+    await rebuild_novel_indexes(get_db())
+    background = []
+    if NOVEL_INDEX_REFRESH_SECONDS > 0:
+        background.append(asyncio.create_task(refresh_novel_indexes_forever(get_db())))
+    if SESSION_ACTORS:
+        background.append(asyncio.create_task(session_actors.evict_idle_forever()))
+    # дедлайни раундів голосування
+    background.append(asyncio.create_task(round_timers.run()))
     yield
+    for task in background:
+        task.cancel()
+    # незаписані зміни живих сесій
+    await session_actors.flush_all()
 
 app = FastAPI(
   title="Interactive Novel API",
@@ -27,6 +52,13 @@ app = FastAPI(
   dependencies=[Depends(get_db)]
 )
 
+@app.exception_handler(AIConcurrencyLimit)
+async def ai_concurrency_limit_handler(_request: Request, _exc: AIConcurrencyLimit):
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": "Too many AI requests in progress, try again shortly"},
+    )
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://127.0.0.1:3000"],  # Nuxt/Vue dev server
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Literal, Dict
+from typing import List, Optional, Literal, Dict, Generic, TypeVar
 from datetime import datetime, timezone
 import uuid
 from enum import Enum
@@ -32,6 +32,16 @@ class Genre(str, Enum):
     young_adult = "young_adult"
     biography = "biography"
 
+# Кожен жанр - окремий біт, тож набір жанрів новели вміщується в одне ціле число
+GENRE_BITS: Dict[str, int] = {g.value: 1 << i for i, g in enumerate(Genre)}
+
+def genre_mask(genres) -> int:
+    """Бітова маска набору жанрів (Genre або рядків)."""
+    mask = 0
+    for g in genres:
+        mask |= GENRE_BITS[Genre(g).value]
+    return mask
+
 class NovelCreate(BaseModel):
     genres:      List[Genre]
     title:       Optional[str] = None
@@ -102,7 +112,7 @@ class Multiplayer(BaseModel):
     host_id:       str                 # user_id хост сесії
     novel_id:      str                 # до якої новели прив'язана сесія
     players: Dict[str, str] = Field(default_factory=dict)
-    chat_messages: List[Dict[str, str]] = Field(default_factory=list) # [{"user_id":..., "msg":..., "time":...}, …]
+    # чат - у підколекції sessions/{sid}/chat, див. ChatMessage
     started_at:    datetime                = Field(default_factory=now_utc)
     ended_at:      Optional[datetime]  = None
 
@@ -120,13 +130,31 @@ class MultiplayerSession(BaseModel):
 
     invited:     List[str]           = Field(default_factory=list)
     players:     Dict[str, Optional[str]] = Field(default_factory=dict)
-    votes:       Dict[str, str]      = Field(default_factory=dict) #######
-    chat:        List[Dict[str, str]]= Field(default_factory=list)
+    votes:       Dict[str, str]      = Field(default_factory=dict) # user_id -> choice_id
+    tally:       Dict[str, int]      = Field(default_factory=dict) # choice_id -> кількість голосів
+    round:       int                 = 0  # номер раунду голосування, finalize збільшує його
+    # чат - у підколекції sessions/{sid}/chat, див. ChatMessage
     choices:     Dict[str, Choice]   = Field(default_factory=dict)
 
     started_at:  datetime            = Field(default_factory=now_utc)
     ended_at:    Optional[datetime]  = None
 
+def chat_message_id(ts: datetime, tail: Optional[str] = None) -> str:
+    """Id, що сортується за часом: мікросекунди від епохи + випадковий (або заданий) хвіст."""
+    micros = int(ts.timestamp() * 1_000_000)
+    return f"{micros:017d}-{tail or uuid.uuid4().hex[:8]}"
+
+# Повідомлення чату сесії: sessions/{sid}/chat/{message_id}
+class ChatMessage(BaseModel):
+    message_id: str = ""
+    user_id:    Optional[str] = None  # None - системне повідомлення
+    msg:        str
+    ts:         datetime = Field(default_factory=now_utc)
+
+    def model_post_init(self, _context) -> None:
+        if not self.message_id:
+            self.message_id = chat_message_id(self.ts)
+
 class TextSegment(BaseModel):
     segment_id: str
     author_id:  Optional[str] = None
@@ -134,4 +162,11 @@ class TextSegment(BaseModel):
     created_at: datetime
 
 class TextEdit(BaseModel):
-    content: str
\ No newline at end of file
+    content: str
+
+T = TypeVar("T")
+
+# Сторінка результатів для курсорної пагінації
+class Page(BaseModel, Generic[T]):
+    items:       List[T]
+    next_cursor: Optional[str] = None  # None - це остання сторінка
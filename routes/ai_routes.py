@@ -1,6 +1,9 @@
-from fastapi import APIRouter, HTTPException, Depends, status
-from pydantic import BaseModel
-from typing import List, Literal, Dict, Optional
+import json
+import logging
+from fastapi import APIRouter, HTTPException, Depends, Query, Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import AsyncGenerator, List, Literal, Dict, Optional
 from datetime import datetime, timezone
 
 from utils.ai_utils import (
@@ -9,23 +12,53 @@ from utils.ai_utils import (
     generate_novel_description,
     generate_novel_setting,
     generate_character,
+    generate_characters,
     generate_prologue,
     generate_continuation,
+    stream_prologue,
+    stream_continuation,
     generate_three_plot_options,
-    load_novel_context
+    load_novel_context,
+    original_context_cache,
+    prompt_usage,
+    model_router,
+    plot_options_cache,
+    PLOT_OPTIONS_PROMPT_VERSION,
+    current_ai_user,
 )
 from utils.firebase import get_db
-from google.cloud.firestore import Client as FirestoreClient
+from utils.llm_cache import response_cache
+from utils.single_flight import SingleFlight
+from utils.task_graph import run_graph
+from utils import speculation
+from utils.session_events import session_hub
+from utils.session_actor import session_actors
+from routes.multiplayer_routes import start_round_deadline
+from utils.story_summaries import summarized_context
+from google.cloud.firestore import AsyncClient
 from routes.auth_routes import get_current_user
 from models import Character, Novel, User, TextSegment, Choice, now_utc, MultiplayerSession
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Одночасні запити варіантів для тієї ж сесії й позиції чекають одну генерацію
+choice_flights = SingleFlight()
+
+
+async def get_ai_user(current_user: User = Depends(get_current_user)) -> User:
+    """
+    get_current_user, який ще й позначає, від чийого імені йдуть AI-запити
+    (для ліміту одночасних запитів на користувача).
+    """
+    current_ai_user.set(current_user.user_id)
+    return current_user
 
 
 @router.get("/health", summary="AI Health Check")
 async def ai_health():
     try:
-        resp = client.models.list()
+        resp = await client.models.list()
         return {
             "status": "ok",
             "available_models": [m.id for m in resp.data]
@@ -37,6 +70,19 @@ async def ai_health():
         )
 
 
+@router.get("/cache/stats", summary="AI context cache counters")
+async def ai_cache_stats(_: User = Depends(get_current_user)):
+    return {
+        "original_context": original_context_cache.stats(),
+        "plot_options":     plot_options_cache.stats(),
+        "prompt_tokens":    prompt_usage,
+        "model_router":     model_router.stats(),
+        "responses":        response_cache.stats() if response_cache is not None else None,
+        "choice_flights":   choice_flights.stats(),
+        "speculation":      speculation.stats(),
+    }
+
+
 class MetadataFieldsRequest(BaseModel):
     fields: List[Literal["title", "description", "setting"]]
 
@@ -48,6 +94,21 @@ class CharacterGenRequest(BaseModel):
     backstory:  Optional[str] = None
     traits:     Optional[str] = None
 
+    def existing(self) -> Dict[str, str]:
+        # існуючі значення (замінимо None → "")
+        return {
+            "name":       self.name or "",
+            "appearance": self.appearance or "",
+            "backstory":  self.backstory or "",
+            "traits":     self.traits or "",
+        }
+
+# Скільки персонажів можна згенерувати одним запитом
+MAX_CHARACTER_BATCH = 12
+
+class CharacterBatchGenRequest(BaseModel):
+    characters: List[CharacterGenRequest] = Field(min_length=1, max_length=MAX_CHARACTER_BATCH)
+
 @router.post(
     "/novels/{novel_id}/metadata",
     summary="Generate metadata (title/description/setting) without saving",
@@ -56,12 +117,14 @@ class CharacterGenRequest(BaseModel):
 async def suggest_metadata(
     novel_id: str,
     req: MetadataFieldsRequest,
-    db: FirestoreClient = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    response: Response,
+    fresh: bool = Query(False, description="Skip cached suggestions and ask the model again"),
+    db: AsyncClient = Depends(get_db),
+    current_user: User = Depends(get_ai_user),
 ):
     # Load novel and check permissions
     ref = db.collection("novels").document(novel_id)
-    snap = ref.get()
+    snap = await ref.get()
     if not snap.exists:
         raise HTTPException(404, "Novel not found")
     novel = Novel.model_validate(snap.to_dict())
@@ -76,29 +139,39 @@ async def suggest_metadata(
             "Cannot suggest metadata: please select at least one genre first."
         )
 
-    results: Dict[str, str] = {}
-
-    # Title
+    # Поля, які треба згенерувати, і від яких згенерованих полів вони залежать:
+    # опису й сеттингу потрібна назва, якщо її теж генеруємо; між собою вони незалежні
+    nodes = {}
     if "title" in req.fields and not novel.title:
-        results["title"] = generate_title(
+        nodes["title"] = ((), lambda deps: generate_title(
             genres=novel.genres,
             description=novel.description,
             setting=novel.setting,
-        )
-    # Description
+            use_cache=not fresh,
+        ))
     if "description" in req.fields and not novel.description.strip():
-        results["description"] = generate_novel_description(
-            title=results.get("title", novel.title),
+        nodes["description"] = (("title",), lambda deps: generate_novel_description(
+            title=deps.get("title", novel.title),
             genres=novel.genres,
             existing_setting=novel.setting,
-        )
-    # Setting
+            use_cache=not fresh,
+        ))
     if "setting" in req.fields and not novel.setting.strip():
-        results["setting"] = generate_novel_setting(
-            title=results.get("title", novel.title),
+        nodes["setting"] = (("title",), lambda deps: generate_novel_setting(
+            title=deps.get("title", novel.title),
             genres=novel.genres,
-            existing_description=results.get("description", novel.description),
+            existing_description=novel.description,
+            use_cache=not fresh,
+        ))
+
+    results, timings = await run_graph(nodes)
+    # Час генерації кожного поля - у заголовку Server-Timing і в лог
+    if timings:
+        response.headers["Server-Timing"] = ", ".join(
+            f"{field};dur={ms:.0f}" for field, ms in timings.items()
         )
+        logger.info("Metadata for novel %s generated in %s", novel_id,
+                    {field: round(ms) for field, ms in timings.items()})
 
     return results
 # Для збереження змін виклик виклик: PUT /novels/{novel_id} из routes/novel_routes
@@ -112,79 +185,185 @@ async def suggest_metadata(
 async def generate_character_fields(
     novel_id: str,
     req: CharacterGenRequest,
-    db: FirestoreClient     = Depends(get_db),
-    current_user: User      = Depends(get_current_user),
+    fresh: bool             = Query(False, description="Skip cached suggestions and ask the model again"),
+    db: AsyncClient         = Depends(get_db),
+    current_user: User      = Depends(get_ai_user),
 ):
     # перевіряємо, що новела є
-    snap = db.collection("novels").document(novel_id).get()
+    snap = await db.collection("novels").document(novel_id).get()
     if not snap.exists:
         raise HTTPException(404, "Novel not found")
     novel = Novel.model_validate(snap.to_dict())
 
-    # существующие значення (замінимо None → "")
-    existing = {
-        "name":       req.name or "",
-        "appearance": req.appearance or "",
-        "backstory":  req.backstory or "",
-        "traits":     req.traits or "",
-    }
+    existing = req.existing()
 
     # викликаємо утиліту, вона поверне тільки ті ключі, що в req.fields
-    generated = generate_character(
+    generated = await generate_character(
         title    = novel.title,
         genres   = novel.genres,
         description = novel.description,
         setting  = novel.setting,
         fields   = req.fields,
         existing = existing,
+        use_cache = not fresh,
     )
 
+    return _unsaved_character(novel_id, req, generated, current_user)
+# Для збереження виклик: POST /novels/{novel_id}/characters из routes/novel_routes
+
+
+def _unsaved_character(novel_id: str, req: CharacterGenRequest, generated: Dict[str, str], user: User) -> Character:
     # об'єднуємо
-    combined = {**existing, **generated}
+    combined = {**req.existing(), **generated}
 
     # повертаємо Character (поки ще не зберігаючи)
     return Character(
         character_id = "",  # присвоїться тільки при фактичному збереженні
         novel_id     = novel_id,
-        user_id      = None if req.role=="npc" else current_user.user_id,
+        user_id      = None if req.role=="npc" else user.user_id,
         role         = req.role,
         name         = combined["name"],
         appearance   = combined["appearance"],
         backstory    = combined["backstory"],
         traits       = combined["traits"],
     )
-# Для збереження виклик: POST /novels/{novel_id}/characters из routes/novel_routes
 
 
 @router.post(
-    "/novels/{novel_id}/text/prologue",
-    response_model=TextSegment,
+    "/novels/{novel_id}/characters/generate",
+    response_model=List[Character],
     status_code=status.HTTP_201_CREATED,
-    summary="Generate prologue without saving",
+    summary="AI: generate several characters in one completion",
 )
-async def create_prologue(
+async def generate_characters_batch(
     novel_id: str,
-    db: FirestoreClient = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    req: CharacterBatchGenRequest,
+    fresh: bool             = Query(False, description="Skip cached suggestions and ask the model again"),
+    db: AsyncClient         = Depends(get_db),
+    current_user: User      = Depends(get_ai_user),
 ):
+    snap = await db.collection("novels").document(novel_id).get()
+    if not snap.exists:
+        raise HTTPException(404, "Novel not found")
+    novel = Novel.model_validate(snap.to_dict())
+
+    novel_args = dict(
+        title       = novel.title,
+        genres      = novel.genres,
+        description = novel.description,
+        setting     = novel.setting,
+    )
+    generated = await generate_characters(
+        **novel_args,
+        requests  = [{"fields": c.fields, "existing": c.existing()} for c in req.characters],
+        use_cache = not fresh,
+    )
+
+    # персонажів, яких модель пропустила або заповнила не повністю, догенеровуємо
+    # поодинці (послідовно - паралельно вперлися б у ліміт запитів користувача)
+    missing = [
+        i for i, c in enumerate(req.characters)
+        if any(f not in generated[i] for f in c.fields)
+    ]
+    if missing:
+        logger.info("Character batch for novel %s: regenerating %d of %d", novel_id, len(missing), len(req.characters))
+    for i in missing:
+        extra = await generate_character(
+            **novel_args,
+            fields   = req.characters[i].fields,
+            existing = {**req.characters[i].existing(), **generated[i]},
+            use_cache = not fresh,
+        )
+        generated[i] = {**generated[i], **{f: extra[f] for f in req.characters[i].fields if f in extra}}
+
+    return [
+        _unsaved_character(novel_id, c, fields, current_user)
+        for c, fields in zip(req.characters, generated)
+    ]
+# Для збереження виклик: POST /novels/{novel_id}/characters из routes/novel_routes
+
+
+async def _prologue_args(novel_id: str, db: AsyncClient) -> dict:
     # Завантажуємо весь контекст
     try:
-        ctx = load_novel_context(novel_id, db)
+        ctx = await load_novel_context(novel_id, db)
     except ValueError:
         raise HTTPException(404, "Novel not found")
 
-    novel    = ctx["novel"]
-    chars    = ctx["characters"]
-    orig_ctx = ctx["original_context"]
-
-    content = generate_prologue(
+    novel = ctx["novel"]
+    return dict(
         title=novel.title,
         description=novel.description,
         genres=novel.genres,
         setting=novel.setting,
-        characters=chars,
-        initial_context=orig_ctx,
+        characters=ctx["characters"],
+        initial_context=ctx["original_context"],
     )
+
+async def _continuation_args(novel_id: str, db: AsyncClient) -> dict:
+    try:
+        return await speculation.continuation_inputs(db, novel_id)
+    except ValueError:
+        raise HTTPException(404, "Novel not found")
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def _stream_segment(chunks: AsyncGenerator[str, None], author_id: str) -> StreamingResponse:
+    """
+    SSE-відповідь: події `delta` з кожним шматком тексту, наприкінці -
+    `segment` з готовим TextSegment (або `error`, якщо генерація впала).
+    Перший шматок чекаємо ще до відповіді: так місце під completion
+    займається заздалегідь, і AIConcurrencyLimit чи збій моделі до початку
+    тексту повертаються звичайним HTTP-статусом, а не подією в потоці.
+    """
+    try:
+        first = await anext(chunks)
+    except StopAsyncIteration:
+        first = None
+
+    async def events():
+        parts: List[str] = []
+        try:
+            if first is not None:
+                parts.append(first)
+                yield _sse("delta", {"content": first})
+            async for delta in chunks:
+                parts.append(delta)
+                yield _sse("delta", {"content": delta})
+        except Exception:
+            logger.exception("Streamed generation failed")
+            yield _sse("error", {"detail": "Generation failed"})
+            return
+        finally:
+            await chunks.aclose()  # звільняє місце одразу, навіть якщо клієнт відключився
+        seg = TextSegment(
+            segment_id="",
+            author_id=author_id,
+            content="".join(parts).strip(),
+            created_at=datetime.now(timezone.utc),
+        )
+        yield _sse("segment", seg.model_dump(mode="json"))
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post(
+    "/novels/{novel_id}/text/prologue",
+    response_model=TextSegment,
+    status_code=status.HTTP_201_CREATED,
+    summary="Generate prologue without saving",
+)
+async def create_prologue(
+    novel_id: str,
+    db: AsyncClient = Depends(get_db),
+    current_user: User = Depends(get_ai_user),
+):
+    content = await generate_prologue(**await _prologue_args(novel_id, db))
     return TextSegment(
         segment_id="",
         author_id=current_user.user_id,
@@ -194,6 +373,19 @@ async def create_prologue(
 # Для збереження виклику: POST /novels/{novel_id}/text/segments из routes/novel_routes
 
 
+@router.post(
+    "/novels/{novel_id}/text/prologue/stream",
+    summary="Stream prologue generation as server-sent events, without saving",
+)
+async def stream_prologue_text(
+    novel_id: str,
+    db: AsyncClient = Depends(get_db),
+    current_user: User = Depends(get_ai_user),
+):
+    args = await _prologue_args(novel_id, db)
+    return await _stream_segment(stream_prologue(**args), current_user.user_id)
+
+
 @router.post(
     "/novels/{novel_id}/text/continue",
     response_model=TextSegment,
@@ -202,29 +394,19 @@ async def create_prologue(
 )
 async def continue_text(
     novel_id: str,
-    db: FirestoreClient = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: AsyncClient = Depends(get_db),
+    current_user: User = Depends(get_ai_user),
 ):
-    try:
-        ctx = load_novel_context(novel_id, db)
-    except ValueError:
-        raise HTTPException(404, "Novel not found")
-
-    novel    = ctx["novel"]
-    own_text = ctx["own_text"]
-    chars    = ctx["characters"]
-    orig_ctx = ctx["original_context"]
+    # Якщо продовження для поточної позиції вже згенеровано у фоні - віддаємо його
+    content = None
+    if speculation.AI_SPECULATION:
+        pos_snap = await db.collection("novels").document(novel_id).get(field_paths=["current_position"])
+        if pos_snap.exists:
+            content = await speculation.take(novel_id, pos_snap.get("current_position"))
 
     # Генеруємо продовження
-    content = generate_continuation(
-        full_text=own_text,
-        title=novel.title,
-        description=novel.description,
-        genres=novel.genres,
-        setting=novel.setting,
-        characters=chars,
-        initial_context=orig_ctx,
-    )
+    if content is None:
+        content = await generate_continuation(**await _continuation_args(novel_id, db))
 
     return TextSegment(
         segment_id="",
@@ -235,6 +417,19 @@ async def continue_text(
 # Для збереження виклик: POST /novels/{novel_id}/text/segments из routes/novel_routes
 
 
+@router.post(
+    "/novels/{novel_id}/text/continue/stream",
+    summary="Stream next-segment generation as server-sent events, without saving",
+)
+async def stream_continue_text(
+    novel_id: str,
+    db: AsyncClient = Depends(get_db),
+    current_user: User = Depends(get_ai_user),
+):
+    args = await _continuation_args(novel_id, db)
+    return await _stream_segment(stream_continuation(**args), current_user.user_id)
+
+
 # AI-generated choices
 @router.post(
     "/{sid}/choices/ai",
@@ -244,35 +439,65 @@ async def continue_text(
 )
 async def generate_choices_ai(
     sid: str,
-    db: FirestoreClient = Depends(get_db),
-    current: User = Depends(get_current_user),
+    db: AsyncClient = Depends(get_db),
+    current: User = Depends(get_ai_user),
 ):
     # Перевірка сесії та доступу
     sess_ref = db.collection("sessions").document(sid)
-    snap = sess_ref.get()
+    snap = await sess_ref.get()
     if not snap.exists:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Session not found")
     sess = MultiplayerSession.model_validate(snap.to_dict())
     if current.user_id not in (*sess.players, sess.host_id):
         raise HTTPException(status.HTTP_403_FORBIDDEN, detail="Access denied")
 
-    # Завантажуємо весь контекст новели
-    ctx = load_novel_context(sess.novel_id, db)
-    novel      = ctx["novel"]
-    opts = generate_three_plot_options(
-        title=novel.title,
-        description=novel.description,
-        genres=novel.genres,
-        setting=novel.setting,
-        characters=ctx["characters"],
-        original_context=ctx["original_context"],
-        full_text=ctx["own_text"],
-    )
-
-    out = []
-    for text in opts:
-        c = Choice(proposer_id=None, content=text, created_at=now_utc())
-        sess_ref.collection("choices").document(c.choice_id).set(c.model_dump())
-        out.append(c)
-
-    return out
+    # Позиція в історії, для якої генеруємо варіанти
+    pos_snap = await db.collection("novels").document(sess.novel_id).get(field_paths=["current_position"])
+    if not pos_snap.exists:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Novel not found")
+    position = pos_snap.get("current_position")
+
+    async def generate() -> List[Choice]:
+        # Варіанти для цієї позиції вже є - не питаємо модель і не дублюємо Choice
+        cached = plot_options_cache.get(sess.novel_id)
+        if cached is None \
+           or cached["position"] != position \
+           or cached["version"] != PLOT_OPTIONS_PROMPT_VERSION:
+            # Завантажуємо весь контекст новели
+            ctx = await load_novel_context(sess.novel_id, db)
+            novel      = ctx["novel"]
+            summary, own_text = await summarized_context(db, sess.novel_id, ctx["own_segments"])
+            opts = await generate_three_plot_options(
+                title=novel.title,
+                description=novel.description,
+                genres=novel.genres,
+                setting=novel.setting,
+                characters=ctx["characters"],
+                original_context=ctx["original_context"],
+                full_text=own_text,
+                summary=summary,
+            )
+            cached = {
+                "position": position,
+                "version":  PLOT_OPTIONS_PROMPT_VERSION,
+                "options":  opts,
+                "sessions": {},  # sid -> уже записані Choice
+            }
+            plot_options_cache.set(sess.novel_id, cached)
+        elif sid in cached["sessions"]:
+            return cached["sessions"][sid]
+
+        out = []
+        for text in cached["options"]:
+            c = Choice(proposer_id=None, content=text, created_at=now_utc())
+            await sess_ref.collection("choices").document(c.choice_id).set(c.model_dump())
+            out.append(c)
+        cached["sessions"][sid] = out
+        actor = session_actors.peek(sid)
+        if actor is not None:
+            actor.add_saved_choices(out)
+        session_hub.publish(sid, "choice_proposed", {"choices": [c.model_dump(mode="json") for c in out]})
+        start_round_deadline(sid, actor.state.round if actor is not None else sess.round)
+        return out
+
+    return await choice_flights.do((sid, position), generate)
@@ -5,13 +5,15 @@ from typing import Optional, Tuple, Union
 
 from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr, Field
 from passlib.context import CryptContext
 from jose import jwt
 from jose.exceptions import JWTError
 
 from utils.firebase import get_db, get_storage_bucket
-from google.cloud.firestore import Client as FirestoreClient, FieldFilter
+from utils.cache import TTLCache
+from google.cloud.firestore import AsyncClient, FieldFilter
 from models import User, gen_uuid, now_utc
 
 # ─── JWT settings ───────────────────────────────────────────────────────────────
@@ -19,11 +21,18 @@ SECRET_KEY       = os.getenv("SECRET_KEY", "changeme")
 ALGORITHM        = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_MIN = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "260"))
 
+# ─── User cache settings ────────────────────────────────────────────────────────
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "2048"))
+USER_CACHE_TTL  = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+
 pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
 router  = APIRouter()
 
 bearer_scheme = HTTPBearer()
 
+# Валідовані User за uid; TTL обмежує застарілість між воркерами
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
 
 # ─── Pydantic schemas ───
 class UserCreate(BaseModel):
@@ -63,13 +72,19 @@ def hash_password(pw: str) -> str:
 def verify_password(plain: str, hashed: str) -> bool:
     return pwd_ctx.verify(plain, hashed)
 
+def invalidate_user(*user_ids: str) -> None:
+    """
+    Drop cached User objects; call after every write to users/{uid}.
+    """
+    user_cache.invalidate(*user_ids)
+
 def create_jwt(user_id: str) -> str:
     expire  = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_MIN)
     payload = {"sub": user_id, "exp": expire}
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_user_by_email(
-    db:    FirestoreClient,
+async def get_user_by_email(
+    db:    AsyncClient,
     email: Union[str, EmailStr],
 ) -> Tuple[Optional[str], Optional[dict]]:
     """
@@ -82,14 +97,14 @@ def get_user_by_email(
           )
           .stream()
     )
-    for doc in snaps:
+    async for doc in snaps:
         data = doc.to_dict()
         data["user_id"] = doc.id
         return doc.id, data
     return None, None
 
-def get_user_by_username(
-    db: FirestoreClient,
+async def get_user_by_username(
+    db: AsyncClient,
     username: str
 ) -> Tuple[Optional[str], Optional[dict]]:
     snaps = (
@@ -97,7 +112,7 @@ def get_user_by_username(
           .where(filter=FieldFilter("username", "==", username))
           .stream()
     )
-    for doc in snaps:
+    async for doc in snaps:
         data = doc.to_dict()
         data["user_id"] = doc.id
         return doc.id, data
@@ -107,14 +122,14 @@ def get_user_by_username(
 @router.post("/register", response_model=Me, status_code=status.HTTP_201_CREATED)
 async def register(
     payload: UserCreate,
-    db:      FirestoreClient = Depends(get_db),
+    db:      AsyncClient = Depends(get_db),
 ):
     # уникальность email
-    existing_id, _ = get_user_by_email(db, payload.email)
+    existing_id, _ = await get_user_by_email(db, payload.email)
     if existing_id:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Email already registered")
     # уникальность username
-    existing_id, _ = get_user_by_username(db, payload.username)
+    existing_id, _ = await get_user_by_username(db, payload.username)
     if existing_id:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "Username already taken")
 
@@ -138,7 +153,7 @@ async def register(
         favorite_novels   = [],
         abandoned_novels  = [],
     )
-    db.collection("users").document(user.user_id).set(user.model_dump())
+    await db.collection("users").document(user.user_id).set(user.model_dump())
     return Me(**user.model_dump())
 
 
@@ -146,22 +161,26 @@ async def register(
 @router.post("/login", response_model=Token)
 async def login(
     payload: LoginRequest,
-    db:      FirestoreClient = Depends(get_db),
+    db:      AsyncClient = Depends(get_db),
 ):
-    user_id, data = get_user_by_email(db, payload.email)
+    user_id, data = await get_user_by_email(db, payload.email)
     if not data or not verify_password(payload.password, data["password"]):
         raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Incorrect email or password")
 
-    db.collection("users").document(user_id).update({"last_login": now_utc()})
+    await db.collection("users").document(user_id).update({"last_login": now_utc()})
+    invalidate_user(user_id)
     return Token(access_token=create_jwt(user_id))
 
 
 # ─── Dependency: get_current_user ──
 async def get_current_user(
     creds: HTTPAuthorizationCredentials = Depends(bearer_scheme),
-    db:    FirestoreClient             = Depends(get_db),
+    db:    AsyncClient             = Depends(get_db),
 ) -> User:
-    token = creds.credentials
+    return await user_from_token(creds.credentials, db)
+
+# Те саме для місць без заголовка Authorization (наприклад, WebSocket з ?token=)
+async def user_from_token(token: str, db: AsyncClient) -> User:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         uid  = payload.get("sub")
@@ -169,10 +188,17 @@ async def get_current_user(
             raise HTTPException(401, "Invalid token")
     except JWTError:
         raise HTTPException(401, "Invalid token")
-    doc = db.collection("users").document(uid).get()
+
+    cached = user_cache.get(uid)
+    if cached is not None:
+        return cached
+
+    doc = await db.collection("users").document(uid).get()
     if not doc.exists:
         raise HTTPException(401, "User not found")
-    return User.model_validate(doc.to_dict())
+    user = User.model_validate(doc.to_dict())
+    user_cache.set(uid, user)
+    return user
 
 @router.get("/me", response_model=Me)
 async def me(current: User = Depends(get_current_user)):
@@ -182,11 +208,11 @@ async def me(current: User = Depends(get_current_user)):
 @router.post("/me/avatar",status_code=status.HTTP_200_OK, summary="Upload avatar for current user")
 async def upload_user_avatar(
     file: UploadFile = File(...),
-    db: FirestoreClient  = Depends(get_db),
+    db: AsyncClient      = Depends(get_db),
     current_user: User   = Depends(get_current_user),
 ):
     user_ref = db.collection("users").document(current_user.user_id)
-    snap = user_ref.get()
+    snap = await user_ref.get()
     if not snap.exists:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "User not found")
 
@@ -203,20 +229,21 @@ async def upload_user_avatar(
         # parsed.path = "/<bucket-name>/users/{user_id}/{filename}"
         # прибираємо перший сегмент "/<bucket-name>/"
         blob_path = parsed.path.lstrip("/").split("/", 1)[1]
-        bucket.blob(blob_path).delete()
+        await run_in_threadpool(bucket.blob(blob_path).delete)
 
     # завантажуємо новий файл
     blob = bucket.blob(f"users/{current_user.user_id}/{file.filename}")
     contents = await file.read()
-    blob.upload_from_string(contents, content_type=file.content_type)
-    blob.make_public()
+    await run_in_threadpool(blob.upload_from_string, contents, content_type=file.content_type)
+    await run_in_threadpool(blob.make_public)
     new_url = blob.public_url
 
     # зберігаємо новий URL у Firestore
-    user_ref.update({
+    await user_ref.update({
         "avatar": new_url,
         "last_login": datetime.now(timezone.utc)
     })
+    invalidate_user(current_user.user_id)
 
     return {"avatar_url": new_url}
 
@@ -228,7 +255,7 @@ async def upload_user_avatar(
 )
 async def update_me(
     payload: UserPatch,
-    db:      FirestoreClient = Depends(get_db),
+    db:      AsyncClient     = Depends(get_db),
     current: User            = Depends(get_current_user),
 ):
     # Збираємо тільки ті поля, що прийшли
@@ -238,7 +265,7 @@ async def update_me(
 
     # Перевірка унікальності username
     if "username" in update_data and update_data["username"] != current.username:
-        existing_id, _ = get_user_by_username(db, update_data["username"])
+        existing_id, _ = await get_user_by_username(db, update_data["username"])
         if existing_id:
             raise HTTPException(status.HTTP_400_BAD_REQUEST, "Username already taken")
 
@@ -248,8 +275,13 @@ async def update_me(
 
     # Оновлюємо документ користувача
     user_ref = db.collection("users").document(current.user_id)
-    user_ref.update(update_data)
+    await user_ref.update(update_data)
+    invalidate_user(current.user_id)
 
-    new_doc = user_ref.get().to_dict()
+    new_doc = (await user_ref.get()).to_dict()
     new_doc["user_id"]   = current.user_id
-    return Me(**new_doc)
\ No newline at end of file
+    return Me(**new_doc)
+
+@router.get("/cache/stats", summary="User cache hit/miss counters")
+async def user_cache_stats(_: User = Depends(get_current_user)):
+    return user_cache.stats()
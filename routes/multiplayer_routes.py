@@ -1,22 +1,37 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Response
-from datetime import datetime, timezone
-from typing import Dict, List, Optional
+import asyncio
+import logging
+import os
+from fastapi import APIRouter, Depends, HTTPException, status, Response, WebSocket, WebSocketDisconnect, Query
+from typing import Dict, List, Optional, Tuple
 import random
 from pydantic import BaseModel
 
-from models import User, MultiplayerSession, Choice, now_utc
-from utils.firebase import get_db
-from google.cloud.firestore import Client as FirestoreClient
+from datetime import datetime
+from models import User, MultiplayerSession, Choice, ChatMessage, Page, chat_message_id, now_utc
+from utils.firebase import FIRESTORE_BATCH_LIMIT, field_path, get_db, get_documents
+from google.cloud.firestore import AsyncClient, AsyncQuery, AsyncDocumentReference, AsyncTransaction, async_transactional
+from utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 
-from routes.auth_routes import get_current_user
+from routes.auth_routes import get_current_user, user_from_token
 from firebase_admin import firestore  # for ArrayUnion, ArrayRemove
 from routes.novel_routes import add_text_segment
 from routes.novel_routes import TextEdit as NovelTextEdit
+from utils.ai_utils import plot_options_cache
+from utils.session_events import session_hub
+from utils.session_actor import session_actors, CHAT_COLL, CHOICES_COLL
+from utils.timer_wheel import TimerWheel
 
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 MAX_PLAYERS = 4
 
+# Дедлайн раунду голосування: відлік від першого варіанту раунду (0 - без дедлайну)
+VOTE_ROUND_SECONDS       = float(os.getenv("VOTE_ROUND_SECONDS", "120"))
+ROUND_TIMER_TICK_SECONDS = float(os.getenv("ROUND_TIMER_TICK_SECONDS", "1"))
+# Одне колесо таймерів на процес; main.py запускає round_timers.run()
+round_timers = TimerWheel(tick=ROUND_TIMER_TICK_SECONDS)
+
 class FriendInfo(BaseModel):
     user_id: str
     username: str
@@ -27,10 +42,10 @@ class FriendInfo(BaseModel):
 async def create_session(
     payload: Dict[str, str],  # {"novel_id": ...}
     current: User = Depends(get_current_user),
-    db: FirestoreClient = Depends(get_db),
+    db: AsyncClient = Depends(get_db),
 ):
     novel_id = payload.get("novel_id")
-    if not novel_id or not db.collection("novels").document(novel_id).get().exists:
+    if not novel_id or not (await db.collection("novels").document(novel_id).get()).exists:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Novel not found")
     # створення об'єкту сесії
     session = MultiplayerSession(
@@ -38,7 +53,7 @@ async def create_session(
         novel_id=novel_id, # відразу хоста в players
         players={current.user_id: None}
     )
-    db.collection("sessions").document(session.session_id).set(session.model_dump())
+    await db.collection("sessions").document(session.session_id).set(session.model_dump())
     return session
 
 @router.get(
@@ -49,10 +64,10 @@ async def create_session(
 async def list_available_friends(
     sid: str,
     current_user: User = Depends(get_current_user),
-    db: FirestoreClient = Depends(get_db),
+    db: AsyncClient = Depends(get_db),
 ):
     # Завантажуємо сесію
-    snap = db.collection("sessions").document(sid).get()
+    snap = await db.collection("sessions").document(sid).get()
     if not snap.exists:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Session not found")
     sess = MultiplayerSession.model_validate(snap.to_dict())
@@ -67,12 +82,9 @@ async def list_available_friends(
         if fid not in in_session
     ]
 
-    # Завантажуємо документи друзів із Firestore
+    # Завантажуємо документи друзів із Firestore одним пакетом
     available: List[User] = []
-    for fid in available_ids:
-        user_snap = db.collection("users").document(fid).get()
-        if not user_snap.exists:
-            continue
+    for user_snap in await get_documents(db, "users", available_ids):
         data = user_snap.to_dict()
         data["user_id"] = user_snap.id
         available.append(User.model_validate(data))
@@ -85,18 +97,22 @@ async def invite_player(
     sid: str,
     payload: Dict[str, str],  # {"user_id": ...}
     current: User = Depends(get_current_user),
-    db: FirestoreClient = Depends(get_db),
+    db: AsyncClient = Depends(get_db),
 ):
     user_to_invite = payload.get("user_id")
     if not user_to_invite:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Missing user_id")
 
-    # Перевіряємо сесію
+    # Перевіряємо сесію (у режимі акторів - живий стан з пам'яті)
     ref = db.collection("sessions").document(sid)
-    snap = ref.get()
-    if not snap.exists:
-        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Session not found")
-    sess = MultiplayerSession.model_validate(snap.to_dict())
+    actor = await session_actors.get(db, sid) if session_actors.enabled_for(sid) else None
+    if actor is not None:
+        sess = actor.state
+    else:
+        snap = await ref.get()
+        if not snap.exists:
+            raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Session not found")
+        sess = MultiplayerSession.model_validate(snap.to_dict())
 
     # Тільки хост може запрошувати
     if sess.host_id != current.user_id:
@@ -118,19 +134,24 @@ async def invite_player(
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Max players exceeded")
 
     # запрошуємо
-    ref.update({
+    await ref.update({
         "invited": firestore.ArrayUnion([user_to_invite])
     })
+    if actor is not None and user_to_invite not in actor.state.invited:
+        actor.state.invited.append(user_to_invite)
 
 # Join a session
 @router.post("/{sid}/join", response_model=MultiplayerSession)
 async def join_session(
     sid: str,
     current: User = Depends(get_current_user),
-    db: FirestoreClient = Depends(get_db),
+    db: AsyncClient = Depends(get_db),
 ):
+    if session_actors.enabled_for(sid):
+        return (await session_actors.get(db, sid)).join(current.user_id, MAX_PLAYERS)
+
     ref = db.collection("sessions").document(sid)
-    snap = ref.get()
+    snap = await ref.get()
     if not snap.exists:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Session not found")
     sess = MultiplayerSession.model_validate(snap.to_dict())
@@ -140,7 +161,8 @@ async def join_session(
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Session is full")
 
     sess.players[current.user_id] = None
-    ref.update({"players": sess.players})
+    await ref.update({"players": sess.players})
+    session_hub.publish(sid, "player_joined", {"user_id": current.user_id})
     return sess
 
 # Get session state
@@ -148,9 +170,14 @@ async def join_session(
 async def get_session_state(
     sid: str,
     current: User = Depends(get_current_user),
-    db: FirestoreClient = Depends(get_db),
+    db: AsyncClient = Depends(get_db),
 ):
-    snap = db.collection("sessions").document(sid).get()
+    if session_actors.enabled_for(sid):
+        actor = await session_actors.get(db, sid)
+        actor.check_member(current.user_id)
+        return actor.snapshot()
+
+    snap = await db.collection("sessions").document(sid).get()
     if not snap.exists:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Session not found")
     sess = MultiplayerSession.model_validate(snap.to_dict())
@@ -158,28 +185,179 @@ async def get_session_state(
         raise HTTPException(status.HTTP_403_FORBIDDEN, detail="Access denied")
     return sess
 
+# Push-канал сесії: одразу стан, далі - події chat, vote_cast, player_joined,
+# choice_proposed, choice_finalized. Токен - у ?token=, бо браузерний WebSocket
+# не вміє передати заголовок Authorization.
+@router.websocket("/{sid}/ws")
+async def session_events(
+    websocket: WebSocket,
+    sid: str,
+    token: str,
+    db: AsyncClient = Depends(get_db),
+):
+    try:
+        current = await user_from_token(token, db)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    # підписуємось ДО читання стану: події, що прийдуть, поки стан читається і
+    # надсилається, чекають у черзі. Подія може збігтися з тим, що вже є у стані,
+    # тож клієнт застосовує їх ідемпотентно
+    queue = session_hub.subscribe(sid)
+    try:
+        try:
+            if session_actors.enabled_for(sid):
+                sess = (await session_actors.get(db, sid)).snapshot()
+            else:
+                snap = await db.collection("sessions").document(sid).get()
+                if not snap.exists:
+                    raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Session not found")
+                sess = MultiplayerSession.model_validate(snap.to_dict())
+        except HTTPException:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        if current.user_id not in (*sess.players, sess.host_id):
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+
+        await websocket.accept()
+
+        async def push():
+            try:
+                await websocket.send_json({"event": "state", "data": sess.model_dump(mode="json")})
+                while True:
+                    message = await queue.get()
+                    if message is None:  # відстали - клієнт має перепідключитись
+                        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                        return
+                    await websocket.send_json(message)
+            except WebSocketDisconnect:
+                return
+
+        async def drain():
+            # вхідні повідомлення не потрібні, чекаємо лише на відключення
+            try:
+                while True:
+                    await websocket.receive_text()
+            except WebSocketDisconnect:
+                return
+
+        tasks = [asyncio.create_task(push()), asyncio.create_task(drain())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+    finally:
+        session_hub.unsubscribe(sid, queue)
+
+# Старі сесії тримали чат масивом "chat" у своєму документі
+LEGACY_CHAT_FIELD = "chat"
+
+async def _migrate_legacy_chat(db: AsyncClient, ref: AsyncDocumentReference, data: dict) -> None:
+    """
+    Moves the legacy chat array of a session document into the chat
+    subcollection and deletes the field. Ids of moved messages are derived
+    from their position, so concurrent migrations write the same documents.
+    """
+    legacy = data.get(LEGACY_CHAT_FIELD)
+    if legacy is None:
+        return
+    docs = []
+    for i, entry in enumerate(legacy):
+        ts = entry.get("ts")
+        if isinstance(ts, str):
+            ts = datetime.fromisoformat(ts)
+        elif not isinstance(ts, datetime):
+            ts = now_utc()
+        message = ChatMessage(
+            message_id=chat_message_id(ts, tail=f"{i:08x}"),
+            user_id=entry.get("user_id"),
+            msg=entry.get("msg", ""),
+            ts=ts,
+        )
+        docs.append((ref.collection(CHAT_COLL).document(message.message_id), message.model_dump()))
+    # поле видаляємо останнім batch-ем - лише коли всі повідомлення вже записані
+    for i in range(0, len(docs), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for doc_ref, doc in docs[i:i + FIRESTORE_BATCH_LIMIT]:
+            batch.set(doc_ref, doc)
+        await batch.commit()
+    await ref.update({LEGACY_CHAT_FIELD: firestore.DELETE_FIELD})
+
 # Send chat message
 @router.post("/{sid}/chat", status_code=status.HTTP_204_NO_CONTENT)
 async def send_chat(
     sid: str,
     payload: Dict[str, str],  # {"msg": "..."}
     current: User = Depends(get_current_user),
-    db: FirestoreClient = Depends(get_db),
+    db: AsyncClient = Depends(get_db),
 ):
+    if session_actors.enabled_for(sid):
+        (await session_actors.get(db, sid)).chat(current.user_id, payload["msg"])
+        return
+
     ref = db.collection("sessions").document(sid)
-    snap = ref.get()
+    snap = await ref.get()
     if not snap.exists:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Session not found")
     sess = MultiplayerSession.model_validate(snap.to_dict())
     if current.user_id not in sess.players:
         raise HTTPException(status.HTTP_403_FORBIDDEN, detail="Not in session")
+    await _migrate_legacy_chat(db, ref, snap.to_dict())
 
-    entry = {
-        "user_id": current.user_id,
-        "msg": payload["msg"],
-        "ts": datetime.now(timezone.utc).isoformat()
-    }
-    ref.update({"chat": firestore.ArrayUnion([entry])})
+    message = ChatMessage(user_id=current.user_id, msg=payload["msg"])
+    await ref.collection(CHAT_COLL).document(message.message_id).set(message.model_dump())
+    session_hub.publish(sid, "chat", message.model_dump(mode="json"))
+
+
+# Chat history: сторінка з кінця (або перед `before`) чи повідомлення після `since`
+@router.get("/{sid}/chat", response_model=Page[ChatMessage])
+async def list_chat(
+    sid: str,
+    since: Optional[str] = Query(None, description="message_id of the last message already seen"),
+    before: Optional[str] = Query(None, description="next_cursor of a page without since: older history"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current: User = Depends(get_current_user),
+    db: AsyncClient = Depends(get_db),
+):
+    if since is not None and before is not None:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Use either since or before")
+
+    ref = db.collection("sessions").document(sid)
+    snap = await ref.get()
+    if not snap.exists:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Session not found")
+    sess = MultiplayerSession.model_validate(snap.to_dict())
+    if current.user_id not in (*sess.players, sess.host_id):
+        raise HTTPException(status.HTTP_403_FORBIDDEN, detail="Access denied")
+    await _migrate_legacy_chat(db, ref, snap.to_dict())
+
+    # повідомлення, що ще чекають запису в пам'яті актора
+    actor = session_actors.peek(sid)
+    if actor is not None:
+        await actor.flush()
+
+    coll = ref.collection(CHAT_COLL)
+    if since is None:
+        # назад у часі: новіші спершу, віддаємо в хронологічному порядку;
+        # next_cursor - значення before для ще старішої сторінки
+        query = coll.order_by("message_id", direction=AsyncQuery.DESCENDING)
+        if before is not None:
+            query = query.start_after({"message_id": before})
+        items = [ChatMessage.model_validate(d.to_dict()) async for d in query.limit(limit + 1).stream()]
+        more = len(items) > limit
+        items = items[:limit]
+        items.reverse()
+        return Page(items=items, next_cursor=items[0].message_id if more else None)
+
+    # id сортуються за часом, тож "після since" - просто start_after по id
+    query = coll.order_by("message_id").start_after({"message_id": since}).limit(limit + 1)
+    items = [ChatMessage.model_validate(d.to_dict()) async for d in query.stream()]
+    if len(items) <= limit:
+        return Page(items=items)
+    items = items[:limit]
+    return Page(items=items, next_cursor=items[-1].message_id)
 
 
 # Vote for a choice
@@ -187,27 +365,65 @@ async def send_chat(
 async def vote(
     sid: str,
     payload: Dict[str, str],
-    background_tasks: BackgroundTasks,
     current: User = Depends(get_current_user),
-    db: FirestoreClient = Depends(get_db),
+    db: AsyncClient = Depends(get_db),
 ):
+    if session_actors.enabled_for(sid):
+        actor = await session_actors.get(db, sid)
+        if actor.vote(current.user_id, payload["choice_id"]):
+            finalize_soon(sid, actor.state.round)
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+    choice_id = payload["choice_id"]
     ref = db.collection("sessions").document(sid)
-    snap = ref.get()
+    all_voted, round_no = await _cast_vote(db.transaction(), ref, current.user_id, choice_id)
+    session_hub.publish(sid, "vote_cast", {"user_id": current.user_id, "choice_id": choice_id})
+
+    # якщо всі проголосували - закриваємо раунд достроково
+    if all_voted:
+        finalize_soon(sid, round_no)
+
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@async_transactional
+async def _cast_vote(
+    transaction: AsyncTransaction,
+    sess_ref: AsyncDocumentReference,
+    user_id: str,
+    choice_id: str,
+) -> Tuple[bool, int]:
+    """
+    Records the vote and moves it in the tally, reading the previous vote in
+    the same transaction: repeated or concurrent votes of one player and a
+    concurrent finalize cannot desync tally from votes. A choice that is not
+    in the choices subcollection (already cleared by a finalize) is refused
+    with 409. Only the fields of this player and the two choices are
+    written. Returns (whether every player has voted, the round number).
+    """
+    snap = await sess_ref.get(transaction=transaction)
     if not snap.exists:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Session not found")
     sess = MultiplayerSession.model_validate(snap.to_dict())
-    if current.user_id not in sess.players:
+    if user_id not in sess.players:
         raise HTTPException(status.HTTP_403_FORBIDDEN, detail="Not in session")
-
-    # Зберігаємо голос
-    sess.votes[current.user_id] = payload["choice_id"]
-    ref.update({"votes": sess.votes})
-
-    # якщо всі проголосували - плануємо finalize_choice
-    if len(sess.votes) == len(sess.players):
-        background_tasks.add_task(finalize_choice, sid, current, db)
-
-    return Response(status_code=status.HTTP_204_NO_CONTENT)
+    # варіант має бути серед поточних: голос за видалений (з минулого раунду)
+    # інакше переміг би і зламав закриття раунду
+    choice_snap = await sess_ref.collection(CHOICES_COLL).document(choice_id).get(transaction=transaction)
+    if not choice_snap.exists:
+        raise HTTPException(status.HTTP_409_CONFLICT, detail="Choice is not open for voting")
+
+    previous = sess.votes.get(user_id)
+    if previous != choice_id:
+        changes = {
+            field_path("votes", user_id):   choice_id,
+            field_path("tally", choice_id): sess.tally.get(choice_id, 0) + 1,
+        }
+        if previous is not None:
+            changes[field_path("tally", previous)] = max(sess.tally.get(previous, 1) - 1, 0)
+        transaction.update(sess_ref, changes)
+        sess.votes[user_id] = choice_id
+    return len(sess.votes) >= len(sess.players), sess.round
 
 class MultiChoiceRequest(BaseModel):
     contents: List[str]
@@ -223,11 +439,18 @@ async def propose_choices(
     sid: str,
     req: MultiChoiceRequest,
     current: User = Depends(get_current_user),
-    db: FirestoreClient = Depends(get_db),
+    db: AsyncClient = Depends(get_db),
 ):
+    if session_actors.enabled_for(sid):
+        actor = await session_actors.get(db, sid)
+        out = actor.propose(current.user_id, req.contents)
+        start_round_deadline(sid, actor.state.round)
+        return out
+
     # Перевіряємо, що сесія є
     sess_ref = db.collection("sessions").document(sid)
-    if not sess_ref.get().exists:
+    sess_snap = await sess_ref.get()
+    if not sess_snap.exists:
         raise HTTPException(status_code=404, detail="Session not found")
 
     out: List[dict] = []
@@ -238,19 +461,135 @@ async def propose_choices(
             created_at=now_utc()
         )
         # зберігаємо в Firestore
-        sess_ref.collection("choices").document(choice.choice_id).set(choice.model_dump())
+        await sess_ref.collection(CHOICES_COLL).document(choice.choice_id).set(choice.model_dump())
         # і відразу в dict
         out.append(choice.model_dump())
+    session_hub.publish(sid, "choice_proposed", {"choices": [Choice.model_validate(c).model_dump(mode="json") for c in out]})
+    start_round_deadline(sid, sess_snap.to_dict().get("round", 0))
     return out
 
 # List all choices
 @router.get("/{sid}/choices", response_model=List[Choice])
 async def list_choices(
     sid: str,
-    db: FirestoreClient = Depends(get_db),
+    db: AsyncClient = Depends(get_db),
 ):
-    snaps = db.collection("sessions").document(sid).collection("choices").stream()
-    return [Choice.model_validate(d.to_dict()) for d in snaps]
+    if session_actors.enabled_for(sid):
+        return (await session_actors.get(db, sid)).list_choices()
+
+    snaps = db.collection("sessions").document(sid).collection(CHOICES_COLL).stream()
+    return [Choice.model_validate(d.to_dict()) async for d in snaps]
+
+
+@async_transactional
+async def _close_voting(
+    transaction: AsyncTransaction,
+    sess_ref: AsyncDocumentReference,
+    user_id: str,
+    fallback_choice_id: Optional[str] = None,
+    expected_round: Optional[int] = None,
+) -> Tuple[MultiplayerSession, Choice, int]:
+    """
+    Picks the winner from the running tally, resets votes and tally and
+    starts the next round in one transaction, so concurrent finalize calls
+    close a round only once. Without votes the round closes with
+    `fallback_choice_id`, if given. With `expected_round` only that round
+    is closed (409 if it is already over).
+    """
+    snap = await sess_ref.get(transaction=transaction)
+    if not snap.exists:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Session not found")
+    sess = MultiplayerSession.model_validate(snap.to_dict())
+
+    if user_id not in (*sess.players, sess.host_id):
+        raise HTTPException(status.HTTP_403_FORBIDDEN, detail="Not in session")
+    if expected_round is not None and sess.round != expected_round:
+        raise HTTPException(status.HTTP_409_CONFLICT, detail="Round already closed")
+    if not sess.votes and fallback_choice_id is None:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="No votes to finalize")
+
+    if sess.votes:
+        # підрахунок голосів уже є; для сесій без tally - рахуємо з votes
+        tally = {ch: n for ch, n in sess.tally.items() if n > 0}
+        if not tally:
+            for ch_id in sess.votes.values():
+                tally[ch_id] = tally.get(ch_id, 0) + 1
+        max_votes = max(tally.values())
+        top = [ch for ch, cnt in tally.items() if cnt == max_votes]
+        winner_id = random.choice(top)
+    else:
+        max_votes, winner_id = 0, fallback_choice_id
+
+    choice_snap = await sess_ref.collection(CHOICES_COLL).document(winner_id).get(transaction=transaction)
+    if not choice_snap.exists:
+        raise HTTPException(
+            status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Winning choice not found"
+        )
+
+    # Скидаємо голоси в документі сесії і починаємо наступний раунд
+    transaction.update(sess_ref, {"votes": {}, "tally": {}, "round": sess.round + 1})
+    return sess, Choice.model_validate(choice_snap.to_dict()), max_votes
+
+
+# Таймери - на процес, а раунд може закрити інший воркер. Тому таймер ключується
+# (sid, номер раунду) і закриває лише свій раунд: застарілий таймер раунду N,
+# що спрацює вже в раунді N+1, нічого не зробить.
+def start_round_deadline(sid: str, round_no: int) -> None:
+    """Запускає відлік раунду, якщо він ще не йде (перший варіант раунду)."""
+    if VOTE_ROUND_SECONDS > 0 and (sid, round_no) not in round_timers:
+        round_timers.schedule((sid, round_no), VOTE_ROUND_SECONDS, lambda: _finalize_on_timer(sid, round_no))
+
+
+def finalize_soon(sid: str, round_no: int) -> None:
+    """Усі проголосували: замість дедлайну - закриття на найближчому тіку."""
+    round_timers.schedule((sid, round_no), 0, lambda: _finalize_on_timer(sid, round_no))
+
+
+async def _finalize_on_timer(sid: str, round_no: int) -> None:
+    """
+    Closes round `round_no` from the timer, on behalf of the host and with
+    the app-wide client (no request is alive by now); does nothing if that
+    round is already over. With no votes at all the winner is a random
+    AI-proposed choice, or any choice if there is none. A round without any
+    choices has nothing to pick from and stays open: the deadline starts
+    again with its first proposed choice.
+    """
+    db = get_db()
+    actor = session_actors.peek(sid)
+    if actor is not None:
+        sess, choices = actor.snapshot(), actor.list_choices()
+    else:
+        snap = await db.collection("sessions").document(sid).get()
+        if not snap.exists:
+            return
+        sess = MultiplayerSession.model_validate(snap.to_dict())
+        choices = []
+        if sess.round == round_no and not sess.votes:
+            snaps = db.collection("sessions").document(sid).collection(CHOICES_COLL).stream()
+            choices = [Choice.model_validate(d.to_dict()) async for d in snaps]
+    if sess.round != round_no:
+        return
+
+    fallback = None
+    if not sess.votes:
+        candidates = [c for c in choices if c.proposer_id is None] or choices
+        if not candidates:
+            logger.info("Deadline of session %s round %d passed with no choices, leaving it open", sid, round_no)
+            return
+        fallback = random.choice(candidates).choice_id
+
+    host_snap = await db.collection("users").document(sess.host_id).get()
+    if not host_snap.exists:
+        logger.error("Cannot finalize session %s: host %s not found", sid, sess.host_id)
+        return
+    host = User.model_validate({**host_snap.to_dict(), "user_id": host_snap.id})
+    try:
+        await finalize_round(sid, db, host, fallback, expected_round=round_no)
+    except HTTPException as e:
+        # раунд уже закрив хтось інший
+        if e.status_code not in (status.HTTP_400_BAD_REQUEST, status.HTTP_409_CONFLICT):
+            logger.error("Finalize of session %s failed: %s", sid, e.detail)
 
 
 # Створення підсумків голосування: вибір переможця (популярне + випадковий переможець якщо нічия)
@@ -264,43 +603,47 @@ async def list_choices(
 async def finalize_choice(
     sid: str,
     current: User = Depends(get_current_user),
-    db: FirestoreClient = Depends(get_db),
+    db: AsyncClient = Depends(get_db),
 ):
-    sess_ref = db.collection("sessions").document(sid)
-    snap = sess_ref.get()
-    if not snap.exists:
-        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Session not found")
-    sess = MultiplayerSession.model_validate(snap.to_dict())
-
-    if current.user_id not in (*sess.players, sess.host_id):
-        raise HTTPException(status.HTTP_403_FORBIDDEN, detail="Not in session")
-    if not sess.votes:
-        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="No votes to finalize")
+    return await finalize_round(sid, db, current)
 
-    # підрахунок голосів
-    tally: Dict[str, int] = {}
-    for ch_id in sess.votes.values():
-        tally[ch_id] = tally.get(ch_id, 0) + 1
-    max_votes = max(tally.values())
-    top = [ch for ch, cnt in tally.items() if cnt == max_votes]
-    winner_id = random.choice(top)
 
-    # Збереження переможного Choice
-    choice_snap = sess_ref.collection("choices").document(winner_id).get()
-    if not choice_snap.exists:
-        raise HTTPException(
-            status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Winning choice not found"
+async def finalize_round(
+    sid: str,
+    db: AsyncClient,
+    current: User,
+    fallback_choice_id: Optional[str] = None,
+    expected_round: Optional[int] = None,
+) -> Choice:
+    sess_ref = db.collection("sessions").document(sid)
+    actor = session_actors.peek(sid)
+    if actor is not None:
+        # голоси з пам'яті потрапляють у Firestore до підрахунку, а ті, що
+        # прийдуть під час закриття, відкидає reset_round
+        async with actor.closing_round():
+            sess, win_choice, max_votes = await _close_voting(
+                db.transaction(), sess_ref, current.user_id, fallback_choice_id, expected_round
+            )
+            actor.reset_round(sess.round + 1)
+    else:
+        # Переможець і скидання голосів - однією транзакцією; далі - лише побічні дії
+        sess, win_choice, max_votes = await _close_voting(
+            db.transaction(), sess_ref, current.user_id, fallback_choice_id, expected_round
         )
-    win_choice = Choice.model_validate(choice_snap.to_dict())
+    # раунд закрито - його дедлайн більше не потрібен
+    round_timers.cancel((sid, sess.round))
 
     # Надсилаємо оголошення в чат
-    announcement = {
-        "user_id": None,
-        "msg":     f"Choice «{win_choice.content}» selected ({max_votes} votes).",
-        "ts":      datetime.now(timezone.utc).isoformat()
-    }
-    sess_ref.update({"chat": firestore.ArrayUnion([announcement])})
+    if max_votes:
+        announce = f"Choice «{win_choice.content}» selected ({max_votes} votes)."
+    else:
+        announce = f"Time is up: choice «{win_choice.content}» selected automatically."
+    if actor is not None:
+        actor.chat(None, announce)
+    else:
+        announcement = ChatMessage(user_id=None, msg=announce)
+        await sess_ref.collection(CHAT_COLL).document(announcement.message_id).set(announcement.model_dump())
+        session_hub.publish(sid, "chat", announcement.model_dump(mode="json"))
 
     # Додаємо текст в основну новелу
     await add_text_segment(
@@ -309,16 +652,17 @@ async def finalize_choice(
         db=db,
         current_user=current
     )
+    # позиція новели змінилась - старі AI-варіанти більше не актуальні
+    plot_options_cache.invalidate(sess.novel_id)
 
     # Видалення всіх варіантів в підколекції "choices" і batch для ефективності
     batch = db.batch()
-    choices_coll = sess_ref.collection("choices")
-    for doc in choices_coll.stream():
+    choices_coll = sess_ref.collection(CHOICES_COLL)
+    async for doc in choices_coll.stream():
         batch.delete(doc.reference)
-    batch.commit()
+    await batch.commit()
 
-    # Скидаємо голоси в документі сесії
-    sess_ref.update({"votes": {}})
+    session_hub.publish(sid, "choice_finalized", {"choice": win_choice.model_dump(mode="json"), "votes": max_votes})
 
     return win_choice
 
@@ -1,14 +1,19 @@
 from fastapi import APIRouter, HTTPException, Depends, status, Query, File, UploadFile, Response
+from starlette.concurrency import run_in_threadpool
 from typing import List, Literal, Optional
 from pydantic import BaseModel
 from datetime import datetime, timezone
 import uuid
 from itertools import islice
 
-from models import NovelCreate, Novel, Character, User, TextSegment,TextEdit, Genre, Status, StatusFilter, CharacterCreate, MultiplayerSession
-from utils.firebase import get_db, get_storage_bucket
-from google.cloud.firestore import Client as FirestoreClient
-from routes.auth_routes import get_current_user
+from models import NovelCreate, Novel, Character, User, TextSegment,TextEdit, Genre, Status, StatusFilter, CharacterCreate, MultiplayerSession, Page, genre_mask
+from utils.firebase import get_db, get_storage_bucket, get_documents
+from google.cloud.firestore import AsyncClient, AsyncQuery
+from utils.pagination import paginate, encode_cursor, decode_cursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from utils.search_index import title_index, genre_index, index_novel, unindex_novel, to_micros, from_micros
+from routes.auth_routes import get_current_user, invalidate_user
+from utils import text_snapshot, story_summaries, speculation
+from utils.session_actor import session_actors
 from firebase_admin import firestore  # firestore.ArrayUnion, ArrayRemove
 
 router = APIRouter()
@@ -17,6 +22,25 @@ router = APIRouter()
 class CharacterIdResponse(BaseModel):
     character_id: str
 
+async def _novel_page(query: AsyncQuery, limit: int, after: Optional[str]) -> Page[Novel]:
+    """
+    Одна сторінка новел, від найсвіжіше оновлених.
+    """
+    try:
+        snaps, next_cursor = await paginate(query, "updated_at", limit, after)
+    except ValueError:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid cursor")
+    return Page[Novel](
+        items=[Novel.model_validate(doc.to_dict()) for doc in snaps],
+        next_cursor=next_cursor,
+    )
+
+def _novel_doc(novel: Novel) -> dict:
+    """
+    Документ новели для Firestore: модель + бітова маска жанрів.
+    """
+    return {**novel.model_dump(), "genre_mask": genre_mask(novel.genres)}
+
 @router.get("/genres",response_model=List[Genre],summary="List all available genres")
 async def list_genres():
     """
@@ -28,7 +52,7 @@ async def list_genres():
 async def create_novel(
     data: NovelCreate,
     current_user: User           = Depends(get_current_user),
-    db:           FirestoreClient = Depends(get_db),
+    db:           AsyncClient = Depends(get_db),
 ):
     now = datetime.now(timezone.utc)
     novel = Novel(
@@ -45,52 +69,58 @@ async def create_novel(
     )
 
     # зберігаємо
-    db.collection("novels").document(novel.novel_id).set(novel.model_dump())
+    await db.collection("novels").document(novel.novel_id).set(_novel_doc(novel))
 
     # додаємо в created_novels автора
-    db.collection("users").document(current_user.user_id).update({
+    await db.collection("users").document(current_user.user_id).update({
         "created_novels": firestore.ArrayUnion([novel.novel_id])
     })
+    invalidate_user(current_user.user_id)
+    index_novel(novel)
     return novel
 
 # Список усіх новел в БД
-@router.get("/", response_model=List[Novel])
-async def list_novels(db: FirestoreClient = Depends(get_db)):
-    snaps = db.collection("novels").stream()
-    return [Novel.model_validate(doc.to_dict()) for doc in snaps]
+@router.get("/", response_model=Page[Novel])
+async def list_novels(
+    limit: int           = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    db:    AsyncClient   = Depends(get_db),
+):
+    return await _novel_page(db.collection("novels"), limit, after)
 
 # Список Публічних новел
-@router.get("/public", response_model=List[Novel], summary="List of Public Novels (is_public=True)")
+@router.get("/public", response_model=Page[Novel], summary="List of Public Novels (is_public=True)")
 async def list_public_novels(
-    db: FirestoreClient = Depends(get_db),
+    limit: int           = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    db:    AsyncClient   = Depends(get_db),
 ):
-    snaps = db.collection("novels").where("is_public", "==", True).stream()
-    return [ Novel.model_validate(doc.to_dict()) for doc in snaps ]
+    query = db.collection("novels").where("is_public", "==", True)
+    return await _novel_page(query, limit, after)
 
 # Пошук новели за назвою/частиною
 @router.get("/search",response_model=List[Novel], summary="Пошук новелли по частині назви")
 async def search_novels(
     q: str = Query(..., min_length=1, description="Фрагмент назви для пошуку"),
-    db: FirestoreClient = Depends(get_db),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncClient = Depends(get_db),
 ):
-    low = q.lower()
-    snaps = db.collection("novels").stream()
-    result: List[Novel] = []
-    for doc in snaps:
-        data = doc.to_dict()
-        title = data.get("title", "")
-        if low in title.lower():
-            result.append(Novel.model_validate(data))
-    return result
+    """
+    Шукає кандидатів у триграмному індексі назв і читає з Firestore
+    лише знайдені новели (найкращі збіги першими).
+    """
+    ids = title_index.search(q, limit)
+    snaps = await get_documents(db, "novels", ids)
+    return [Novel.model_validate(snap.to_dict()) for snap in snaps]
 
 
 # Знайти новелу за novel_id
 @router.get("/{novel_id}", response_model=Novel)
 async def get_novel(
     novel_id: str,
-    db:        FirestoreClient = Depends(get_db),
+    db:        AsyncClient = Depends(get_db),
 ):
-    doc = db.collection("novels").document(novel_id).get()
+    doc = await db.collection("novels").document(novel_id).get()
     if not doc.exists:
         raise HTTPException(status_code=404, detail="Novel not found")
     return Novel.model_validate(doc.to_dict())
@@ -100,11 +130,11 @@ async def get_novel(
 async def update_novel(
     novel_id: str,
     payload:  Novel,
-    db:        FirestoreClient = Depends(get_db),
+    db:        AsyncClient = Depends(get_db),
     current_user: User          = Depends(get_current_user),
 ):
     ref = db.collection("novels").document(novel_id)
-    snap = ref.get()
+    snap = await ref.get()
     if not snap.exists:
         raise HTTPException(status_code=404, detail="Novel not found")
 
@@ -117,7 +147,8 @@ async def update_novel(
         )
 
     payload.updated_at = datetime.now(timezone.utc)
-    ref.set(payload.model_dump(), merge=True)
+    await ref.set(_novel_doc(payload), merge=True)
+    index_novel(payload.model_copy(update={"novel_id": novel_id}))
     return payload
 
 class NovelPatch(BaseModel):
@@ -136,11 +167,11 @@ class NovelPatch(BaseModel):
 async def patch_novel(
     novel_id: str,
     payload:  NovelPatch,
-    db:        FirestoreClient = Depends(get_db),
+    db:        AsyncClient = Depends(get_db),
     current_user: User        = Depends(get_current_user),
 ):
     ref = db.collection("novels").document(novel_id)
-    snap = ref.get()
+    snap = await ref.get()
     if not snap.exists:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Novel not found")
 
@@ -153,21 +184,25 @@ async def patch_novel(
     if not update_data:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="No fields to update")
 
-    # Додаємо мітку часу
+    # Додаємо мітку часу (і нову маску, якщо змінились жанри)
     update_data["updated_at"] = datetime.now(timezone.utc)
+    if "genres" in update_data:
+        update_data["genre_mask"] = genre_mask(update_data["genres"])
 
     # Пушим в Firestore
-    ref.update(update_data)
+    await ref.update(update_data)
 
     # Повертаємо свіжі дані
-    new_snap = ref.get()
-    return Novel.model_validate(new_snap.to_dict())
+    new_snap = await ref.get()
+    updated = Novel.model_validate(new_snap.to_dict())
+    index_novel(updated)
+    return updated
 
 # Видаляє новелу, очищає всі згадки в профілях користувачів і видаляє пов'язані з нею сеанси.
 @router.delete("/{novel_id}")
 async def delete_novel(
     novel_id: str,
-    db:        FirestoreClient = Depends(get_db),
+    db:        AsyncClient = Depends(get_db),
     current_user: User          = Depends(get_current_user),
 ):
     """
@@ -176,8 +211,8 @@ async def delete_novel(
     """
     # Перевіряємо, що новела є
     ref = db.collection("novels").document(novel_id)
-    snap = ref.get()
-    if not ref.get().exists:
+    snap = await ref.get()
+    if not snap.exists:
         raise HTTPException(status_code=404, detail="Novel not found")
 
     # перевіряємо, що поточний юзер - один з авторів
@@ -188,30 +223,37 @@ async def delete_novel(
             detail="Only the Author of the short story can delete"
         )
 
-    # Видаляємо сам документ новели
-    ref.delete()
+    # Видаляємо сам документ новели і похідні від тексту дані (знімок, підсумки)
+    await ref.delete()
+    unindex_novel(novel_id)
+    await db.recursive_delete(ref.collection(text_snapshot.SNAPSHOT_COLL))
+    await db.recursive_delete(ref.collection(story_summaries.SUMMARIES_COLL))
 
-    # Видаляємо всі сесії, прив'язані до цієї новели
+    # Видаляємо всі сесії, прив'язані до цієї новели, разом з чатом і варіантами
     sessions = db.collection("sessions").where("novel_id", "==", novel_id).stream()
-    for sess_doc in sessions:
-        sess_doc.reference.delete()
+    async for sess_doc in sessions:
+        session_actors.drop(sess_doc.id)
+        await db.recursive_delete(sess_doc.reference)
 
     # Видаляємо novel_id з масивів у всіх користувачів (created_novels, saved_novels, completed_novels)
     users = db.collection("users").where("created_novels", "array_contains", novel_id).stream()
-    for u in users:
-        u.reference.update({
+    async for u in users:
+        await u.reference.update({
             "created_novels":   firestore.ArrayRemove([novel_id])
         })
+        invalidate_user(u.id)
     users = db.collection("users").where("saved_novels", "array_contains", novel_id).stream()
-    for u in users:
-        u.reference.update({
+    async for u in users:
+        await u.reference.update({
             "saved_novels":     firestore.ArrayRemove([novel_id])
         })
+        invalidate_user(u.id)
     users = db.collection("users").where("completed_novels", "array_contains", novel_id).stream()
-    for u in users:
-        u.reference.update({
+    async for u in users:
+        await u.reference.update({
             "completed_novels": firestore.ArrayRemove([novel_id])
         })
+        invalidate_user(u.id)
     return {"detail": "Novel and all references to it have been removed"}
 
 # Створення копії новели, з новим автором, гравцем і тд.
@@ -219,13 +261,13 @@ async def delete_novel(
 async def fork_novel(
     novel_id:     str,
     current_user: User            = Depends(get_current_user),
-    db:           FirestoreClient = Depends(get_db),
+    db:           AsyncClient     = Depends(get_db),
 ):
     """
     Fork the Novel: clone it, change the ID, put current_user as author and player.
     """
     orig_ref = db.collection("novels").document(novel_id)
-    orig_snap = orig_ref.get()
+    orig_snap = await orig_ref.get()
     if not orig_snap.exists:
         raise HTTPException(status_code=404, detail="The original Novel was not found")
 
@@ -242,19 +284,20 @@ async def fork_novel(
     new.users_author = [current_user.user_id]
     new.user_players = [current_user.user_id]
 
-    db.collection("novels").document(new.novel_id).set(new.model_dump())
+    await db.collection("novels").document(new.novel_id).set(_novel_doc(new))
+    index_novel(new)
     return new
 
 
 @router.get("/{novel_id}/original", response_model=Novel)
 async def get_original(
     novel_id: str,
-    db:        FirestoreClient = Depends(get_db),
+    db:        AsyncClient = Depends(get_db),
 ):
     """
     Returns the original of the Forked Novel.
     """
-    fork_snap = db.collection("novels").document(novel_id).get()
+    fork_snap = await db.collection("novels").document(novel_id).get()
     if not fork_snap.exists:
         raise HTTPException(status_code=404, detail="Novel not found")
 
@@ -262,7 +305,7 @@ async def get_original(
     if not fork.novel_original_id:
         raise HTTPException(status_code=400, detail="It's not a fork - the original is not listed")
 
-    orig_snap = db.collection("novels").document(fork.novel_original_id).get()
+    orig_snap = await db.collection("novels").document(fork.novel_original_id).get()
     if not orig_snap.exists:
         raise HTTPException(status_code=404, detail="Original not found")
 
@@ -278,13 +321,13 @@ async def create_character(
     novel_id:     str,
     payload:      CharacterCreate,
     current_user: User            = Depends(get_current_user),
-    db:           FirestoreClient = Depends(get_db),
+    db:           AsyncClient     = Depends(get_db),
 ):
     """
     Створення персонажу з обов'язковим полем `role`.
     """
     novel_ref = db.collection("novels").document(novel_id)
-    if not novel_ref.get().exists:
+    if not (await novel_ref.get()).exists:
         raise HTTPException(404, "Novel not found")
 
     # Если создаётся именно роль "player" — проверяем, не создавал ли уже игрок персонажа
@@ -297,7 +340,7 @@ async def create_character(
             .limit(1)
             .stream()
         )
-        if any(True for _ in existing_player):
+        if [doc async for doc in existing_player]:
             raise HTTPException(
                 status.HTTP_400_BAD_REQUEST,
                 "You already have a player character in this novel"
@@ -322,12 +365,12 @@ async def create_character(
     )
 
     # зберігаємо в Firestore
-    novel_ref.collection("characters") \
-             .document(char.character_id) \
-             .set(char.model_dump())
+    await novel_ref.collection("characters") \
+                   .document(char.character_id) \
+                   .set(char.model_dump())
 
     # додаємо юзера до списку гравців новели
-    novel_ref.update({
+    await novel_ref.update({
         "user_players": firestore.ArrayUnion([current_user.user_id])
     })
 
@@ -337,7 +380,7 @@ async def create_character(
 @router.get("/{novel_id}/characters",response_model=List[Character])
 async def list_characters(
     novel_id: str,
-    db:        FirestoreClient = Depends(get_db),
+    db:        AsyncClient = Depends(get_db),
 ):
     """
     Повертає всіх персонажів певної новели.
@@ -346,7 +389,7 @@ async def list_characters(
                     .document(novel_id)
                     .collection("characters")
                     .stream())
-    return [Character.model_validate(doc.to_dict()) for doc in char_snaps]
+    return [Character.model_validate(doc.to_dict()) async for doc in char_snaps]
 
 # Оновити персонажа
 @router.put("/{novel_id}/characters/{character_id}", response_model=Character)
@@ -354,7 +397,7 @@ async def update_character(
     novel_id:     str,
     character_id: str,
     payload:      CharacterCreate,
-    db:           FirestoreClient = Depends(get_db),
+    db:           AsyncClient = Depends(get_db),
 ):
     """
     Updates the Character's fields.
@@ -363,11 +406,11 @@ async def update_character(
                   .document(novel_id)
                   .collection("characters")
                   .document(character_id))
-    if not char_ref.get().exists:
+    if not (await char_ref.get()).exists:
         raise HTTPException(status_code=404, detail="Character not found")
 
-    char_ref.set(payload.model_dump(), merge=True)
-    return Character.model_validate(char_ref.get().to_dict())
+    await char_ref.set(payload.model_dump(), merge=True)
+    return Character.model_validate((await char_ref.get()).to_dict())
 
 # Отримати ID персонажа поточного користувача в цій новелі
 @router.get("/{novel_id}/characters/me", response_model=CharacterIdResponse,
@@ -375,7 +418,7 @@ async def update_character(
 async def get_my_character(
     novel_id:     str,
     current_user: User            = Depends(get_current_user),
-    db:           FirestoreClient = Depends(get_db),
+    db:           AsyncClient     = Depends(get_db),
 ):
     """
     Шукає в підколекції `characters` документа `novels/{novel_id}`
@@ -389,7 +432,7 @@ async def get_my_character(
 
     # запит за полем user_id
     snaps = chars_coll.where("user_id", "==", current_user.user_id).stream()
-    for doc in snaps:
+    async for doc in snaps:
         return CharacterIdResponse(character_id=doc.id)
 
     # якщо жодного не знайшли - 404
@@ -407,12 +450,13 @@ async def get_my_character(
 async def add_text_segment(
     novel_id: str,
     edit: TextEdit,
-    db: FirestoreClient = Depends(get_db),
+    db: AsyncClient     = Depends(get_db),
     current_user: User  = Depends(get_current_user),
 ):
     # Перевіряємо, що новела існує
     novel_ref = db.collection("novels").document(novel_id)
-    if not novel_ref.get().exists:
+    novel_snap = await novel_ref.get()
+    if not novel_snap.exists:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Novel not found")
 
     # Зберігається новий сегмент
@@ -423,13 +467,18 @@ async def add_text_segment(
         content=edit.content,
         created_at=datetime.now(timezone.utc),
     )
-    novel_ref.collection("text_segments").document(segment_id).set(seg.model_dump())
 
-    # Оновлюється поточна позиція і час оновлення самої новели
-    novel_ref.update({
+    # Сегмент, дописування в знімок тексту і позиція новели - однією транзакцією
+    await text_snapshot.append_segment(db, novel_ref, segment_id, seg.model_dump(), {
+        # Оновлюється поточна позиція і час оновлення самої новели
         "current_position": segment_id,
-        "updated_at": datetime.now(timezone.utc)
+        "updated_at": datetime.now(timezone.utc),
     })
+
+    # старіші сегменти поступово згортаються у підсумки у фоні
+    story_summaries.schedule_refresh(db, novel_id)
+    # і одразу (якщо увімкнено) починаємо генерувати наступний фрагмент
+    speculation.schedule(db, novel_id, segment_id, current_user.user_id)
     return seg
 
 # Редагувати сегмент Новели
@@ -439,7 +488,7 @@ async def edit_segment(
     novel_id:     str,
     segment_id:   str,
     edit:         TextEdit,
-    db:           FirestoreClient = Depends(get_db),
+    db:           AsyncClient     = Depends(get_db),
     current_user: User            = Depends(get_current_user),
 ):
     seg_ref = (
@@ -448,7 +497,7 @@ async def edit_segment(
           .collection("text_segments")
           .document(segment_id)
     )
-    snap = seg_ref.get()
+    snap = await seg_ref.get()
     if not snap.exists:
         raise HTTPException(404, "Segment not found")
 
@@ -462,36 +511,54 @@ async def edit_segment(
         "created_at": data["created_at"],  # зберігаємо оригінальну дату
     }
 
-    # оновлюємо у новели мітку часу
-    db.collection("novels").document(novel_id).update({
+    await seg_ref.set(updated, merge=True)
+    await text_snapshot.patch_segment(
+        db,
+        db.collection("novels").document(novel_id),
+        {**data, "segment_id": segment_id},
+        edit.content,
+    )
+
+    # мітку часу новели оновлюємо останньою: за (novel_id, updated_at) кешується
+    # текст оригіналу, і під новою міткою має читатись уже новий текст
+    await db.collection("novels").document(novel_id).update({
         "updated_at": datetime.now(timezone.utc)
     })
-
-    seg_ref.set(updated, merge=True)
+    await story_summaries.segment_changed(db, novel_id, data["created_at"])
+    speculation.discard(novel_id)
     out = TextSegment(segment_id=segment_id, **updated)
     return out
 
 # Отримати всі сегменти новели за айді новели
 @router.get(
     "/{novel_id}/text/segments",
-    response_model=List[TextSegment],
-    summary="List all text segments for a novel",
+    response_model=Page[TextSegment],
+    summary="List text segments for a novel, oldest first",
 )
 async def list_text_segments(
     novel_id: str,
-    db: FirestoreClient = Depends(get_db),
+    limit: int           = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    db: AsyncClient      = Depends(get_db),
 ):
     novel_ref = db.collection("novels").document(novel_id)
-    if not novel_ref.get().exists:
+    if not (await novel_ref.get()).exists:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Novel not found")
 
-    snaps = (
-        novel_ref
-        .collection("text_segments")
-        .order_by("created_at")
-        .stream()
+    try:
+        snaps, next_cursor = await paginate(
+            novel_ref.collection("text_segments"),
+            "created_at",
+            limit,
+            after,
+            descending=False,
+        )
+    except ValueError:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid cursor")
+    return Page[TextSegment](
+        items=[TextSegment.model_validate(doc.to_dict()) for doc in snaps],
+        next_cursor=next_cursor,
     )
-    return [TextSegment.model_validate(doc.to_dict()) for doc in snaps]
 
 @router.delete(
     "/{novel_id}/text/segments/{segment_id}",
@@ -501,16 +568,16 @@ async def list_text_segments(
 async def delete_text_segment(
     novel_id: str,
     segment_id: str,
-    db: FirestoreClient = Depends(get_db),
+    db: AsyncClient     = Depends(get_db),
     current_user: User  = Depends(get_current_user),
 ):
     novel_ref = db.collection("novels").document(novel_id)
-    if not novel_ref.get().exists:
+    if not (await novel_ref.get()).exists:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Novel not found")
 
     # load segment
     seg_ref = novel_ref.collection("text_segments").document(segment_id)
-    seg_snap = seg_ref.get()
+    seg_snap = await seg_ref.get()
     if not seg_snap.exists:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Segment not found")
 
@@ -525,7 +592,7 @@ async def delete_text_segment(
         sessions = db.collection("sessions")\
                      .where("novel_id", "==", novel_id)\
                      .stream()
-        for s in sessions:
+        async for s in sessions:
             sess = MultiplayerSession.model_validate(s.to_dict())
             if current_user.user_id == sess.host_id \
                or current_user.user_id in sess.players:
@@ -536,45 +603,44 @@ async def delete_text_segment(
         raise HTTPException(status.HTTP_403_FORBIDDEN, detail="Not permitted to delete this segment")
 
     # delete the segment
-    seg_ref.delete()
+    await seg_ref.delete()
+    await text_snapshot.patch_segment(db, novel_ref, {**seg_data, "segment_id": segment_id}, None)
+    await story_summaries.segment_changed(db, novel_id, seg_data["created_at"])
+    speculation.discard(novel_id)
 
     # if this was the novel’s current_position, clear it
-    novel = novel_ref.get().to_dict()
+    novel = (await novel_ref.get()).to_dict()
     if novel.get("current_position") == segment_id:
-        novel_ref.update({
+        await novel_ref.update({
             "current_position": None,
             "updated_at": datetime.now(timezone.utc)
         })
     else:
-        novel_ref.update({"updated_at": datetime.now(timezone.utc)})
+        await novel_ref.update({"updated_at": datetime.now(timezone.utc)})
 
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 # Список новел, створених користувачем (не враховує ті де бере участь)
-@router.get("/user/{user_id}",response_model=List[Novel],summary="List of Novels created by the user")
+@router.get("/user/{user_id}",response_model=Page[Novel],summary="List of Novels created by the user")
 async def list_user_novels(
     user_id: str,
-    db: FirestoreClient = Depends(get_db),
+    limit: int           = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    db: AsyncClient      = Depends(get_db),
 ):
-    snaps = (
-        db.collection("novels")
-          .where("users_author", "array_contains", user_id)
-          .stream()
-    )
-    return [ Novel.model_validate(doc.to_dict()) for doc in snaps ]
+    query = db.collection("novels").where("users_author", "array_contains", user_id)
+    return await _novel_page(query, limit, after)
 
 # Список новел за 1 жанром
-@router.get("/genre/{genre}",response_model=List[Novel],summary="List of Novel by genre")
+@router.get("/genre/{genre}",response_model=Page[Novel],summary="List of Novel by genre")
 async def list_genre_novels(
     genre: Genre,
-    db: FirestoreClient = Depends(get_db),
+    limit: int           = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    db: AsyncClient      = Depends(get_db),
 ):
-    snaps = (
-        db.collection("novels")
-          .where("genres", "array_contains", genre.value)
-          .stream()
-    )
-    return [ Novel.model_validate(doc.to_dict()) for doc in snaps ]
+    query = db.collection("novels").where("genres", "array_contains", genre.value)
+    return await _novel_page(query, limit, after)
 
 def chunked(iterable, size=10):
     it = iter(iterable)
@@ -592,7 +658,7 @@ def chunked(iterable, size=10):
 )
 async def list_novels_by_genres(
     genres: List[Genre] = Query(..., description="?genres=horror&genres=drama&…"),
-    db: FirestoreClient = Depends(get_db),
+    db: AsyncClient     = Depends(get_db),
 ):
     genre_values = [g.value for g in genres]
     seen_ids = set()
@@ -602,16 +668,47 @@ async def list_novels_by_genres(
         snaps = db.collection("novels") \
                   .where("genres", "array_contains_any", chunk) \
                   .stream()
-        for doc in snaps:
+        async for doc in snaps:
             if doc.id not in seen_ids:
                 seen_ids.add(doc.id)
                 result.append(Novel.model_validate(doc.to_dict()))
 
     return result
 
+async def _genre_mask_page(
+    db: AsyncClient,
+    genres: List[Genre],
+    public_only: bool,
+    limit: int,
+    after: Optional[str],
+) -> Page[Novel]:
+    """
+    Сторінка новел, що мають усі жанри: AND по масках в genre_index,
+    з Firestore читаються лише новели цієї сторінки.
+    """
+    if not genres:
+        return Page[Novel](items=[])
+    try:
+        key = None
+        if after:
+            ts, nid = decode_cursor(after)
+            key = (to_micros(ts), nid)
+    except ValueError:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid cursor")
+
+    want = genre_mask(genres)
+    ids, last = genre_index.query(want, public_only, limit, key)
+    novels = [Novel.model_validate(doc.to_dict()) for doc in await get_documents(db, "novels", ids)]
+    # індекс іншого воркера міг застаріти - перевіряємо жанри за свіжими даними
+    novels = [n for n in novels if genre_mask(n.genres) & want == want]
+    return Page[Novel](
+        items=novels,
+        next_cursor=encode_cursor(from_micros(last[0]), last[1]) if last else None,
+    )
+
 @router.get(
     "/novels/by-all-genres",
-    response_model=List[Novel],
+    response_model=Page[Novel],
     summary="List all novels matching ALL of the given genres",
 )
 async def list_novels_by_all_genres(
@@ -619,69 +716,35 @@ async def list_novels_by_all_genres(
         ...,
         description="One or more genres to filter by (e.g. ?genres=horror&genres=drama)"
     ),
-    db: FirestoreClient = Depends(get_db),
+    limit: int           = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    db: AsyncClient      = Depends(get_db),
 ):
     """
     Поверне тільки ті новели, масив genres яких містить **все**
     передані в запиті значення.
     """
-    # Приводим Enum -> строки
-    genre_values = [g.value for g in genres]
-    if not genre_values:
-        return []
-
-    # Сначала фильтрация по первому жанру
-    first = genre_values[0]
-    snaps = db.collection("novels") \
-              .where("genres", "array_contains", first) \
-              .stream()
-
-    result: List[Novel] = []
-    for doc in snaps:
-        data = doc.to_dict()
-        # убеждаемся, что все жанры есть в массиве
-        if all(g in data.get("genres", []) for g in genre_values):
-            # валидирует через Pydantic
-            result.append(Novel.model_validate(data))
-
-    return result
+    return await _genre_mask_page(db, genres, False, limit, after)
 
 @router.get(
     "/public/by-all-genres",
-    response_model=List[Novel],
+    response_model=Page[Novel],
     summary="List public novels matching ALL of the given genres",
 )
 async def list_public_novels_by_all_genres(
-    genres: List[Genre] = Query(...),
-    db: FirestoreClient = Depends(get_db),
+    genres: List[Genre]  = Query(...),
+    limit: int           = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    db: AsyncClient      = Depends(get_db),
 ):
-    genre_values = [g.value for g in genres]
-    if not genre_values:
-        return []
-
-    # спочатку фільтрація за першим жанром + публічність
-    first = genre_values[0]
-    snaps = (
-        db.collection("novels")
-          .where("is_public", "==", True)              # ← только публичные
-          .where("genres", "array_contains", first)
-          .stream()
-    )
-
-    result: List[Novel] = []
-    for doc in snaps:
-        data = doc.to_dict()
-        # проверяем, что все жанры есть
-        if all(g in data.get("genres", []) for g in genre_values):
-            result.append(Novel.model_validate(data))
-    return result
+    return await _genre_mask_page(db, genres, True, limit, after)
 
 
 
 @router.get("/user/{user_id}/both",response_model=List[Novel],summary="Novels where the user is both Author and Player")
 async def list_author_and_player_novels(
     user_id: str,
-    db: FirestoreClient = Depends(get_db),
+    db: AsyncClient = Depends(get_db),
 ):
     """
     Returns all novels in which user_id is both
@@ -695,7 +758,7 @@ async def list_author_and_player_novels(
     )
 
     result: List[Novel] = []
-    for doc in snaps:
+    async for doc in snaps:
         data = doc.to_dict()
         # фильтруем по наличию в user_players
         if user_id in data.get("user_players", []):
@@ -717,7 +780,7 @@ async def upload_novel_image(
 ):
     # Перевіряємо, що новела існує і поточний користувач - її автор
     ref = db.collection("novels").document(novel_id)
-    snap = ref.get()
+    snap = await ref.get()
     if not snap.exists:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Novel not found")
     novel = Novel.model_validate(snap.to_dict())
@@ -728,13 +791,13 @@ async def upload_novel_image(
     bucket = get_storage_bucket()
     blob = bucket.blob(f"novels/{novel_id}/{file.filename}")
     contents = await file.read()
-    blob.upload_from_string(contents, content_type=file.content_type)
-    blob.make_public()
+    await run_in_threadpool(blob.upload_from_string, contents, content_type=file.content_type)
+    await run_in_threadpool(blob.make_public)
     # Отримуємо публічний URL
     url = blob.public_url
 
     # Зберігаємо рядок URL у полі cover_image_url
-    ref.update({"cover_image_url": url})
+    await ref.update({"cover_image_url": url})
 
     return {"cover_image_url": url}
 
@@ -747,7 +810,7 @@ async def upload_novel_image(
 async def set_novel_status(
     novel_id: str,
     new_status: Status = Query(..., description="Select a Status"),
-    db: FirestoreClient = Depends(get_db),
+    db: AsyncClient     = Depends(get_db),
     current: User       = Depends(get_current_user),
 ):
     """
@@ -765,7 +828,8 @@ async def set_novel_status(
     updates[field_to_add] = firestore.ArrayUnion([novel_id])
 
     # применяем всё одним вызовом update
-    user_ref.update(updates)
+    await user_ref.update(updates)
+    invalidate_user(current.user_id)
 
 
 @router.get(
@@ -775,10 +839,10 @@ async def set_novel_status(
 )
 async def get_novel_status(
     novel_id: str,
-    db: FirestoreClient     = Depends(get_db),
+    db: AsyncClient         = Depends(get_db),
     current: User           = Depends(get_current_user),
 ):
-    user_doc = db.collection("users").document(current.user_id).get()
+    user_doc = await db.collection("users").document(current.user_id).get()
     if not user_doc.exists:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "User not found")
     data = user_doc.to_dict()
@@ -805,7 +869,7 @@ async def get_novel_status(
 async def list_my_novels(
     user_status: StatusFilter = Query("all", description="all | created | playing | planned | completed | favorite | abandoned"),
     genre: Optional[Genre] = Query(None, description="Optional genre filter"),
-    db: FirestoreClient = Depends(get_db),
+    db: AsyncClient = Depends(get_db),
     me: User = Depends(get_current_user),
 ):
     """
@@ -820,7 +884,7 @@ async def list_my_novels(
     uid = me.user_id
 
     # виймаємо з користувача потрібний список ID
-    user_doc = db.collection("users").document(uid).get()
+    user_doc = await db.collection("users").document(uid).get()
     if not user_doc.exists:
         raise HTTPException(404, "User not found")
     u = user_doc.to_dict()
@@ -835,24 +899,19 @@ async def list_my_novels(
         "abandoned": "abandoned_novels",
     }
 
-    # збираємо set з потрібних списків
-    ids = set()
+    # збираємо потрібні списки (без дублікатів, зі збереженням порядку)
     if user_status == "all":
-        ids |= set(u.get("created_novels", []))
-        ids |= set(u.get("playing_novels", []))
+        ids = u.get("created_novels", []) + u.get("playing_novels", [])
     else:
-        ids |= set(u.get(field_map[user_status], []))
+        ids = u.get(field_map[user_status], [])
 
     # якщо після цього порожньо - повернемо порожній список
     if not ids:
         return []
 
-    # робимо get за всіма цими novel_id
+    # завантажуємо всі новели пакетами через get_all
     novels = []
-    for nid in ids:
-        snap = db.collection("novels").document(nid).get()
-        if not snap.exists:
-            continue
+    for snap in await get_documents(db, "novels", ids):
         nov = Novel.model_validate(snap.to_dict())
         if genre is None or genre in nov.genres:
             novels.append(nov)
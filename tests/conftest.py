@@ -0,0 +1,15 @@
+import os
+import sys
+
+# Корінь репозиторію - щоб імпортувати main, routes, utils як у продакшні
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Модулі читають налаштування під час імпорту; у .env вони можуть бути порожні
+for name, value in {
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "60",
+    "SECRET_KEY":                  "test-secret",
+    "ALGORITHM":                   "HS256",
+    "OPENAI_API_KEY":              "test-key",
+}.items():
+    if not os.environ.get(name):
+        os.environ[name] = value
@@ -0,0 +1,6 @@
+def test_app_imports():
+    import main
+
+    paths = {route.path for route in main.app.routes}
+    for prefix in ("/auth", "/novels", "/ai", "/sessions"):
+        assert any(p.startswith(prefix) for p in paths), prefix
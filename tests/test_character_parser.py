@@ -0,0 +1,53 @@
+from utils.ai_utils import parse_characters
+
+
+def test_plain_format():
+    raw = (
+        "### Character 1\n"
+        "Name: Bob\n"
+        "Traits: brave\n"
+        "### Character 2\n"
+        "Name: Alice\n"
+    )
+    assert parse_characters(raw, 2) == [{"name": "Bob", "traits": "brave"}, {"name": "Alice"}]
+
+
+def test_markdown_bold_labels_and_values():
+    raw = (
+        "### Character 1\n"
+        "**Name:** Bob\n"
+        "- **Appearance**: tall, grey coat\n"
+        "__Traits:__ *stubborn*\n"
+    )
+    assert parse_characters(raw, 1) == [
+        {"name": "Bob", "appearance": "tall, grey coat", "traits": "stubborn"},
+    ]
+
+
+def test_header_variants_are_boundaries():
+    raw = (
+        "## Character 1:\n"
+        "Name: Bob\n"
+        "\n"
+        "Character 2 (the villain)\n"
+        "Name: Mordo\n"
+        "\n"
+        "**Character 3 - the mentor**\n"
+        "Name: Ilsa\n"
+    )
+    assert [c.get("name") for c in parse_characters(raw, 3)] == ["Bob", "Mordo", "Ilsa"]
+
+
+def test_continuation_lines_and_out_of_range_blocks():
+    raw = (
+        "### Character 1\n"
+        "Backstory: grew up by the sea\n"
+        "and never left it.\n"
+        "Character 1 is the narrator's brother.\n"
+        "### Character 5\n"
+        "Name: Ghost\n"
+    )
+    assert parse_characters(raw, 2) == [
+        {"backstory": "grew up by the sea and never left it. Character 1 is the narrator's brother."},
+        {},
+    ]
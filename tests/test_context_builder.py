@@ -0,0 +1,44 @@
+from utils import context_builder
+
+
+def test_token_counting_falls_back_when_encoding_cannot_load(monkeypatch):
+    def offline(*_args, **_kwargs):
+        raise ConnectionError("no network")
+
+    monkeypatch.setattr(context_builder.tiktoken, "encoding_for_model", offline)
+    monkeypatch.setattr(context_builder.tiktoken, "get_encoding", offline)
+    context_builder._encoding.cache_clear()
+    try:
+        assert context_builder.count_tokens("abcdefgh", "offline-model") == 2
+        assert context_builder.truncate_tokens("abcdefghij", 1, "offline-model") == "abcd"
+    finally:
+        context_builder._encoding.cache_clear()
+
+
+def test_stored_summary_is_budgeted_before_the_extractive_tail(monkeypatch):
+    monkeypatch.setattr(context_builder, "_encoding", lambda model: None)
+    older = [f"Older scene {i} happens here. More detail follows." for i in range(40)]
+    full_text = "\n\n".join(older + ["The latest scene."])
+    stored = "OVERVIEW: the heroes left home. " * 5
+
+    ctx = context_builder.build_story_context(full_text, [], summary=stored, budget=120)
+
+    assert ctx.summary.startswith(stored.strip())
+    assert ctx.summary.endswith("Older scene 34 happens here.")
+    assert ctx.recent_text.startswith("Older scene 35 ")
+    assert "Older scene 0 " not in ctx.summary
+    assert ctx.usage["total"] <= 120
+
+
+def test_recent_text_comes_before_the_stable_prefix(monkeypatch):
+    monkeypatch.setattr(context_builder, "_encoding", lambda model: None)
+    monkeypatch.setattr(context_builder, "AI_CONTEXT_RECENT_SHARE", 0.8)
+    monkeypatch.setattr(context_builder, "AI_CONTEXT_STABLE_SHARE", 0.5)
+    latest = "x" * 300  # 75 токенів
+    characters = [{"name": f"Hero{i}", "backstory": "y" * 30} for i in range(20)]
+
+    ctx = context_builder.build_story_context(latest, characters, budget=100)
+
+    assert ctx.recent_text == latest
+    assert ctx.usage["characters"] <= 25
+    assert ctx.usage["total"] <= 100
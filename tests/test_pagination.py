@@ -0,0 +1,18 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from utils.pagination import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    ts = datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+    cursor = encode_cursor(ts, "novel-1")
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (ts, "novel-1")
+
+
+@pytest.mark.parametrize("cursor", ["", "not-base64!", "e30", "eyJ2IjogMX0"])
+def test_malformed_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
@@ -0,0 +1,30 @@
+from routes import multiplayer_routes
+from routes.multiplayer_routes import finalize_soon, round_timers, start_round_deadline
+
+
+def test_round_deadlines_are_keyed_by_session_and_round():
+    try:
+        start_round_deadline("s1", 0)
+        start_round_deadline("s1", 1)
+        assert ("s1", 0) in round_timers and ("s1", 1) in round_timers
+
+        # повторний варіант того самого раунду не відкладає дедлайн
+        slot = round_timers._where[("s1", 0)]
+        start_round_deadline("s1", 0)
+        assert round_timers._where[("s1", 0)] == slot
+
+        # усі проголосували - дедлайн раунду замінюється найближчим тіком
+        finalize_soon("s1", 1)
+        assert round_timers._where[("s1", 1)] == (round_timers._cursor + 1) % len(round_timers._slots)
+
+        assert round_timers.cancel(("s1", 0)) is True
+        assert ("s1", 1) in round_timers
+    finally:
+        round_timers.cancel(("s1", 0))
+        round_timers.cancel(("s1", 1))
+
+
+def test_no_deadline_when_rounds_are_untimed(monkeypatch):
+    monkeypatch.setattr(multiplayer_routes, "VOTE_ROUND_SECONDS", 0)
+    start_round_deadline("s2", 0)
+    assert ("s2", 0) not in round_timers
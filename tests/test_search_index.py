@@ -0,0 +1,136 @@
+import asyncio
+from datetime import datetime, timezone
+
+from models import Novel
+from utils import search_index
+from utils.search_index import GenreMaskIndex, TrigramIndex
+
+
+def make_index():
+    index = TrigramIndex()
+    index.reset([
+        ("exact",  "Dragon"),
+        ("prefix", "Dragonfly Summer"),
+        ("word",   "The Dragon King"),
+        ("inner",  "Snapdragon"),
+        ("other",  "Silent Sea"),
+    ])
+    return index
+
+
+def test_search_ranks_exact_prefix_word_start_then_substring():
+    assert make_index().search("dragon") == ["exact", "prefix", "word", "inner"]
+
+
+def test_search_is_case_insensitive_and_limited():
+    index = make_index()
+    assert index.search("DRAGON", limit=2) == ["exact", "prefix"]
+    assert index.search("") == []
+
+
+def test_short_queries_scan_titles():
+    assert make_index().search("se") == ["other"]
+
+
+def test_rename_and_remove_update_postings():
+    index = make_index()
+    index.add("other", "Dragon Sea")
+    assert "other" in index.search("dragon")
+    assert index.search("silent") == []
+
+    index.remove("other")
+    assert "other" not in index.search("dragon")
+    assert len(index) == 4
+
+
+def test_genre_query_requires_every_bit_and_sorts_newest_first():
+    index = GenreMaskIndex()
+    index.add("a", 0b011, True,  datetime(2024, 1, 1, tzinfo=timezone.utc))
+    index.add("b", 0b111, False, datetime(2024, 1, 3, tzinfo=timezone.utc))
+    index.add("c", 0b001, True,  datetime(2024, 1, 2, tzinfo=timezone.utc))
+
+    assert index.query(0b011)[0] == ["b", "a"]
+    assert index.query(0b011, public_only=True)[0] == ["a"]
+
+
+def test_genre_query_pages_with_cursor_key():
+    index = GenreMaskIndex()
+    for day in range(1, 6):
+        index.add(f"n{day}", 0b1, True, datetime(2024, 1, day, tzinfo=timezone.utc))
+
+    first, cursor = index.query(0b1, limit=2)
+    assert first == ["n5", "n4"]
+    second, cursor = index.query(0b1, limit=2, after=cursor)
+    assert second == ["n3", "n2"]
+    last, cursor = index.query(0b1, limit=2, after=cursor)
+    assert last == ["n1"]
+    assert cursor is None
+
+
+def test_genre_index_reuses_freed_slots():
+    index = GenreMaskIndex()
+    ts = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    index.add("a", 0b1, True, ts)
+    index.add("b", 0b1, True, ts)
+    index.remove("a")
+    index.add("c", 0b1, True, ts)
+
+    assert len(index) == 2
+    assert len(index._ids) == 2
+    assert sorted(index.query(0b1)[0]) == ["b", "c"]
+
+
+class _Doc:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return self._data
+
+
+class _ScanDuringWrites:
+    """Fake db whose novel scan interleaves with local writes."""
+
+    def __init__(self, docs, during_scan):
+        self._docs = docs
+        self._during_scan = during_scan
+
+    def collection(self, name):
+        return self
+
+    def select(self, fields):
+        return self
+
+    async def stream(self):
+        for doc in self._docs:
+            yield doc
+        self._during_scan()
+
+
+def test_rebuild_replays_local_writes_made_during_the_scan():
+    old = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    new = datetime(2024, 1, 2, tzinfo=timezone.utc)
+    docs = [
+        _Doc("kept",    {"title": "Old Title", "genres": [], "is_public": True, "updated_at": old}),
+        _Doc("deleted", {"title": "Gone",      "genres": [], "is_public": True, "updated_at": old}),
+    ]
+
+    def writes():
+        search_index.index_novel(Novel(novel_id="kept", title="New Title", description="",
+                                       setting="", is_public=True, updated_at=new))
+        search_index.index_novel(Novel(novel_id="created", title="Fresh", description="",
+                                       setting="", is_public=True, updated_at=new))
+        search_index.unindex_novel("deleted")
+
+    try:
+        asyncio.run(search_index.rebuild_novel_indexes(_ScanDuringWrites(docs, writes)))
+
+        assert search_index.title_index.search("new title") == ["kept"]
+        assert search_index.title_index.search("fresh") == ["created"]
+        assert search_index.title_index.search("gone") == []
+        assert sorted(search_index.genre_index.query(0)[0]) == ["created", "kept"]
+        assert search_index._journals == []
+    finally:
+        search_index.title_index.clear()
+        search_index.genre_index.clear()
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from models import Choice, MultiplayerSession
+from utils.session_actor import SessionActor
+
+
+class _Batch:
+    def __init__(self, writes):
+        self._writes = writes
+        self._ops = []
+
+    def set(self, ref, data):
+        self._ops.append(("set", data))
+
+    def update(self, ref, fields):
+        self._ops.append(("update", dict(fields)))
+
+    async def commit(self):
+        self._writes.extend(self._ops)
+
+
+class _RecordingDb:
+    """Fake client that records committed batch writes."""
+
+    def __init__(self):
+        self.writes = []
+
+    def collection(self, name):
+        return self
+
+    def document(self, doc_id):
+        return self
+
+    def batch(self):
+        return _Batch(self.writes)
+
+
+def make_actor(db=None):
+    sess = MultiplayerSession(session_id="s1", host_id="host", novel_id="n1", players={"p1": None, "p2": None})
+    choice = Choice(choice_id="c1", proposer_id=None, content="Go north")
+    return SessionActor(db=db, sess=sess, choices=[choice])
+
+
+def test_vote_for_unknown_choice_is_refused():
+    actor = make_actor()
+    with pytest.raises(HTTPException) as err:
+        actor.vote("p1", "stale")
+    assert err.value.status_code == 409
+    assert actor.state.votes == {} and actor.state.tally == {}
+    assert not actor.dirty
+
+
+def test_vote_moves_tally_between_choices():
+    async def scenario():
+        actor = make_actor()
+        actor.choices["c2"] = Choice(choice_id="c2", proposer_id="p2", content="Go south")
+        try:
+            assert actor.vote("p1", "c1") is False
+            assert actor.vote("p1", "c2") is False
+            assert actor.state.tally == {"c1": 0, "c2": 1}
+            assert actor.vote("p2", "c2") is True
+        finally:
+            actor._flush_task.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_vote_during_round_close_is_not_written_into_the_next_round():
+    async def scenario():
+        db = _RecordingDb()
+        actor = make_actor(db)
+        actor.vote("p1", "c1")
+        async with actor.closing_round():
+            assert db.writes == [("update", {"votes.p1": "c1", "tally.c1": 1})]
+            # голос, що прийшов поки раунд закривається, і фоновий flush
+            actor.vote("p2", "c1")
+            late_flush = asyncio.create_task(actor.flush())
+            await asyncio.sleep(0)
+            assert not late_flush.done()
+            actor.reset_round(1)
+        await late_flush
+        actor._flush_task.cancel()
+
+        assert db.writes == [("update", {"votes.p1": "c1", "tally.c1": 1})]
+        assert actor.state.votes == {} and actor.state.round == 1
+
+    asyncio.run(scenario())
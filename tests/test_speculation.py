@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from utils import speculation
+
+
+@pytest.fixture
+def fake_generation(monkeypatch):
+    """Speculation on, generation replaced by a controllable fake."""
+    gate = {"event": None, "calls": 0}
+
+    async def inputs(_db, novel_id):
+        return {"novel_id": novel_id}
+
+    async def generate(novel_id):
+        gate["calls"] += 1
+        if gate["event"] is not None:
+            await gate["event"].wait()
+        return f"next of {novel_id} #{gate['calls']}"
+
+    monkeypatch.setattr(speculation, "AI_SPECULATION", True)
+    monkeypatch.setattr(speculation, "AI_SPECULATION_PER_USER", 1)
+    monkeypatch.setattr(speculation, "continuation_inputs", inputs)
+    monkeypatch.setattr(speculation, "generate_continuation", generate)
+    speculation.speculations.clear()
+    yield gate
+    for novel_id in list(speculation._inflight):
+        speculation.discard(novel_id)
+    speculation.speculations.clear()
+
+
+def test_take_waits_for_the_speculation_and_hands_it_out_once(fake_generation):
+    async def main():
+        speculation.schedule(None, "n1", "seg-1", "u1")
+        assert await speculation.take("n1", "seg-1") == "next of n1 #1"
+        assert await speculation.take("n1", "seg-1") is None
+
+    asyncio.run(main())
+
+
+def test_take_ignores_a_speculation_for_another_position(fake_generation):
+    async def main():
+        speculation.schedule(None, "n1", "seg-1", "u1")
+        await asyncio.sleep(0.01)
+        assert await speculation.take("n1", "seg-2") is None
+        assert await speculation.take("n1", "seg-1") == "next of n1 #1"
+
+    asyncio.run(main())
+
+
+def test_discard_cancels_in_flight_and_frees_the_user_budget(fake_generation):
+    async def main():
+        fake_generation["event"] = asyncio.Event()
+        speculation.schedule(None, "n1", "seg-1", "u1")
+        await asyncio.sleep(0)  # генерація почалась і чекає
+        assert fake_generation["calls"] == 1
+        # бюджет користувача вичерпано - друга новела не стартує
+        speculation.schedule(None, "n2", "seg-9", "u1")
+        assert set(speculation._inflight) == {"n1"}
+
+        speculation.discard("n1")
+        assert speculation._inflight == {} and speculation._user_inflight == {}
+        assert await speculation.take("n1", "seg-1") is None
+
+        fake_generation["event"].set()
+        speculation.schedule(None, "n2", "seg-9", "u1")
+        assert await speculation.take("n2", "seg-9") == "next of n2 #2"
+
+    asyncio.run(main())
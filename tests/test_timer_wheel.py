@@ -0,0 +1,64 @@
+import asyncio
+
+from utils.timer_wheel import TimerWheel
+
+
+def run_ticks(wheel, ticks):
+    """Advances the wheel by hand and lets the fired callbacks run."""
+    async def main():
+        for _ in range(ticks):
+            wheel._advance()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+
+
+def recorder(fired, name):
+    async def callback():
+        fired.append(name)
+    return callback
+
+
+def test_timer_fires_on_its_tick_and_only_once():
+    wheel, fired = TimerWheel(tick=1, slots=4), []
+    wheel.schedule("a", 2, recorder(fired, "a"))
+    run_ticks(wheel, 1)
+    assert fired == [] and "a" in wheel
+    run_ticks(wheel, 1)
+    assert fired == ["a"] and "a" not in wheel
+    run_ticks(wheel, 8)
+    assert fired == ["a"]
+
+
+def test_delays_longer_than_one_turn_wait_full_rounds():
+    wheel, fired = TimerWheel(tick=1, slots=4), []
+    wheel.schedule("late", 10, recorder(fired, "late"))
+    run_ticks(wheel, 9)
+    assert fired == []
+    run_ticks(wheel, 1)
+    assert fired == ["late"]
+
+
+def test_reschedule_replaces_and_cancel_removes():
+    wheel, fired = TimerWheel(tick=1, slots=4), []
+    wheel.schedule("a", 1, recorder(fired, "first"))
+    wheel.schedule("a", 3, recorder(fired, "second"))
+    wheel.schedule("b", 1, recorder(fired, "b"))
+    assert wheel.cancel("b") is True
+    assert wheel.cancel("b") is False
+    run_ticks(wheel, 3)
+    assert fired == ["second"]
+    assert wheel.stats()["pending"] == 0
+
+
+def test_failing_callback_does_not_stop_the_wheel():
+    wheel, fired = TimerWheel(tick=1, slots=4), []
+
+    async def boom():
+        raise RuntimeError("boom")
+
+    wheel.schedule("bad", 1, boom)
+    wheel.schedule("good", 1, recorder(fired, "good"))
+    run_ticks(wheel, 1)
+    assert fired == ["good"]
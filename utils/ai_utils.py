@@ -1,35 +1,236 @@
 import os
-from openai import OpenAI
+import re
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+import httpx
+from openai import (
+    AsyncOpenAI,
+    DefaultAsyncHttpxClient,
+    APIConnectionError,
+    InternalServerError,
+    RateLimitError,
+)
 from dotenv import load_dotenv
-from typing import List, Dict, Optional
-from google.cloud.firestore import Client as FirestoreClient
+from typing import List, Dict, AsyncIterator, Optional, Tuple
+from google.cloud.firestore import AsyncClient
 from models import Novel, TextSegment, Character
+from utils import text_snapshot
+from utils.cache import SizedLRUCache, TTLCache
+from utils.llm_cache import response_cache, response_key
+from utils.model_router import ModelRouter
+from utils.context_builder import (
+    AI_CONTEXT_TOKEN_BUDGET,
+    StoryContext,
+    build_story_context,
+    character_line,
+    count_tokens,
+)
 
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+AI_MODEL = os.getenv("AI_MODEL", "gpt-3.5-turbo")
+logger = logging.getLogger(__name__)
 
-# Загальна обгортка під будь-який чат-запит
-def chat_with_model(
+# Скільки completion-запитів можуть бути в польоті одночасно: на процес і на користувача
+AI_MAX_INFLIGHT          = int(os.getenv("AI_MAX_INFLIGHT", "32"))
+AI_MAX_INFLIGHT_PER_USER = int(os.getenv("AI_MAX_INFLIGHT_PER_USER", "2"))
+
+# Один пул HTTP-з'єднань з keep-alive на весь процес
+client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=AI_MAX_INFLIGHT,
+            max_keepalive_connections=AI_MAX_INFLIGHT,
+            keepalive_expiry=60,
+        ),
+    ),
+)
+
+# Користувач, від імені якого йдуть AI-запити поточного HTTP-запиту
+current_ai_user: ContextVar[Optional[str]] = ContextVar("current_ai_user", default=None)
+
+_global_slots = asyncio.Semaphore(AI_MAX_INFLIGHT)
+_user_inflight: Dict[str, int] = {}
+
+
+class AIConcurrencyLimit(Exception):
+    """Користувач уже має AI_MAX_INFLIGHT_PER_USER запитів у польоті."""
+
+
+@asynccontextmanager
+async def completion_slot():
+    """
+    Займає місце під один completion. Понад ліміт користувача - одразу
+    AIConcurrencyLimit; понад глобальний ліміт - чекаємо в черзі.
+    """
+    uid = current_ai_user.get()
+    if uid is not None:
+        if _user_inflight.get(uid, 0) >= AI_MAX_INFLIGHT_PER_USER:
+            raise AIConcurrencyLimit(uid)
+        _user_inflight[uid] = _user_inflight.get(uid, 0) + 1
+    try:
+        async with _global_slots:
+            yield
+    finally:
+        if uid is not None:
+            left = _user_inflight[uid] - 1
+            if left:
+                _user_inflight[uid] = left
+            else:
+                del _user_inflight[uid]
+
+# Текст оригіналів для форків: (novel_id, updated_at) -> tuple текстів.
+# Усі форки одного оригіналу ділять один незмінний кортеж у пам'яті процесу.
+ORIGINAL_CONTEXT_CACHE_MB = int(os.getenv("ORIGINAL_CONTEXT_CACHE_MB", "64"))
+original_context_cache = SizedLRUCache(max_weight=ORIGINAL_CONTEXT_CACHE_MB * 1024 * 1024)
+# novel_id -> останній бачений updated_at, щоб одразу звільняти попередню версію;
+# забутий запис лише означає, що стара версія піде з кешу за LRU
+ORIGINAL_VERSIONS_SIZE = int(os.getenv("ORIGINAL_VERSIONS_SIZE", "4096"))
+_original_versions = TTLCache(maxsize=ORIGINAL_VERSIONS_SIZE, ttl=24 * 3600)
+
+# Згенеровані варіанти сюжету: novel_id -> {"position", "version", "options", "sessions"}
+PLOT_OPTIONS_CACHE_SIZE = int(os.getenv("PLOT_OPTIONS_CACHE_SIZE", "1024"))
+PLOT_OPTIONS_CACHE_TTL  = float(os.getenv("PLOT_OPTIONS_CACHE_TTL", "3600"))
+plot_options_cache = TTLCache(maxsize=PLOT_OPTIONS_CACHE_SIZE, ttl=PLOT_OPTIONS_CACHE_TTL)
+
+# Скільки токенів промпту провайдер узяв зі свого кешу префіксів
+prompt_usage = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0}
+
+def record_usage(usage, model: str) -> None:
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", None) or 0) if details else 0
+    prompt_usage["requests"] += 1
+    prompt_usage["prompt_tokens"] += usage.prompt_tokens
+    prompt_usage["cached_tokens"] += cached
+    logger.info("%s usage: prompt=%d cached=%d completion=%d",
+                model, usage.prompt_tokens, cached, usage.completion_tokens)
+
+# Рівні моделей для різних завдань (див. utils/model_router)
+model_router = ModelRouter(default_model=AI_MODEL)
+# Помилки, після яких варто спробувати наступну модель рівня
+FAILOVER_ERRORS = (APIConnectionError, InternalServerError, RateLimitError)
+
+def _elapsed_ms(started: float) -> float:
+    return (time.perf_counter() - started) * 1000
+
+# Загальна обгортка під будь-який чат-запит. Модель - явна (model) або з
+# рівня завдання (task); при збої переходимо до наступної моделі рівня
+async def chat_with_model(
     messages: List[dict],
-    model: str = os.getenv("AI_MODEL", "gpt-3.5-turbo"),
+    model: Optional[str] = None,
     max_tokens: int = 200,
     temperature: float = 0.8,
+    task: str = "default",
 ) -> str:
-    resp = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        max_tokens=max_tokens,
-        temperature=temperature,
-    )
-    return resp.choices[0].message.content.strip()
+    content, _ = await _complete(messages, model, max_tokens, temperature, task)
+    return content
+
+# Повертає (текст, модель, яка насправді відповіла)
+async def _complete(
+    messages: List[dict],
+    model: Optional[str],
+    max_tokens: int,
+    temperature: float,
+    task: str,
+) -> Tuple[str, str]:
+    models = [model] if model else model_router.candidates(task)
+    for i, name in enumerate(models):
+        async with completion_slot():
+            started = time.perf_counter()
+            try:
+                resp = await client.chat.completions.create(
+                    model=name,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                )
+            except FAILOVER_ERRORS as e:
+                model_router.record(name, _elapsed_ms(started), ok=False)
+                if i == len(models) - 1:
+                    raise
+                logger.warning("%s failed for %s (%s), falling back to %s", name, task, e, models[i + 1])
+                continue
+        model_router.record(name, _elapsed_ms(started), ok=True)
+        record_usage(resp.usage, name)
+        return resp.choices[0].message.content.strip(), name
+
+# Те саме, але з stream=True: віддає шматки тексту, щойно вони приходять.
+# На іншу модель переходимо лише доти, доки не віддано жодного шматка;
+# затримка моделі тут - час до першого шматка
+async def stream_chat_with_model(
+    messages: List[dict],
+    model: Optional[str] = None,
+    max_tokens: int = 200,
+    temperature: float = 0.8,
+    task: str = "default",
+) -> AsyncIterator[str]:
+    models = [model] if model else model_router.candidates(task)
+    for i, name in enumerate(models):
+        async with completion_slot():
+            started = time.perf_counter()
+            first = True
+            try:
+                stream = await client.chat.completions.create(
+                    model=name,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    stream=True,
+                    stream_options={"include_usage": True},  # usage приходить останнім чанком
+                )
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if first:
+                            model_router.record(name, _elapsed_ms(started), ok=True)
+                            first = False
+                        yield chunk.choices[0].delta.content
+                    if chunk.usage is not None:
+                        record_usage(chunk.usage, name)
+            except FAILOVER_ERRORS as e:
+                model_router.record(name, _elapsed_ms(started), ok=False)
+                if not first or i == len(models) - 1:
+                    raise
+                logger.warning("%s failed for %s (%s), falling back to %s", name, task, e, models[i + 1])
+                continue
+        return
+
+# chat_with_model через кеш відповідей (якщо AI_RESPONSE_CACHE увімкнено);
+# use_cache=False - завжди новий запит, але результат усе одно кешується
+async def cached_chat_with_model(
+    messages: List[dict],
+    task: str,
+    max_tokens: int = 200,
+    temperature: float = 0.8,
+    use_cache: bool = True,
+) -> str:
+    if response_cache is None:
+        return await chat_with_model(messages, max_tokens=max_tokens, temperature=temperature, task=task)
+    # ключ - основна модель рівня: зміна моделей рівня не віддає старих відповідей
+    primary = model_router.primary(task)
+    key = response_key(primary, messages, temperature, max_tokens)
+    if use_cache:
+        cached = await response_cache.get(key)
+        if cached is not None:
+            return cached
+    content, answered_by = await _complete(messages, None, max_tokens, temperature, task)
+    # відповідь запасної моделі не видаємо пізніше за відповідь основної
+    if answered_by == primary:
+        await response_cache.set(key, content)
+    return content
 
 # Генерація назви новели
-def generate_title(
+async def generate_title(
     genres: List[str],
     description: str = "",
     setting: str = "",
     max_tokens: int = 20,
+    use_cache: bool = True,
 ) -> str:
     """
     Генерує лаконічну назву для новели на основі жанру
@@ -48,22 +249,25 @@ def generate_title(
         user_msg += f"Setting: {setting}\n"
     user_msg += "\nGenerate a title (just the title)."
 
-    return chat_with_model(
+    return await cached_chat_with_model(
         [
             {"role": "system", "content": system_msg},
             {"role": "user",   "content": user_msg},
         ],
+        task="title",
         max_tokens=max_tokens,
         temperature=0.7,
+        use_cache=use_cache,
     )
 
 
 # Генерація опису новели
-def generate_novel_description(
+async def generate_novel_description(
     title: str,
     genres: List[str],
     existing_setting: str = "",
     max_tokens: int = 300,
+    use_cache: bool = True,
 ) -> str:
     system_msg = (
         "You are a creative writing assistant."
@@ -78,22 +282,25 @@ def generate_novel_description(
         user_msg += f"Setting: {existing_setting}\n"
     user_msg += "\nWrite the novel’s description\nDescription:"
 
-    return chat_with_model(
+    return await cached_chat_with_model(
         [
             {"role": "system", "content": system_msg},
             {"role": "user",   "content": user_msg},
         ],
+        task="description",
         max_tokens=max_tokens,
         temperature=0.7,
+        use_cache=use_cache,
     )
 
 
 # Генерація сеттингу новели
-def generate_novel_setting(
+async def generate_novel_setting(
     title: str,
     genres: List[str],
     existing_description: str = "",
     max_tokens: int = 300,
+    use_cache: bool = True,
 ) -> str:
     system_msg = (
         "You are a world-building assistant."
@@ -107,17 +314,19 @@ def generate_novel_setting(
         user_msg += f"Description: {existing_description}\n"
     user_msg += "\n\nList 4–6 bullet points."
 
-    return chat_with_model(
+    return await cached_chat_with_model(
         [
             {"role": "system", "content": system_msg},
             {"role": "user",   "content": user_msg},
         ],
+        task="setting",
         max_tokens=max_tokens,
         temperature=0.7,
+        use_cache=use_cache,
     )
 
 # Генерація персонажа: доповнюємо відсутні поля
-def generate_character(
+async def generate_character(
     title: str,
     description: str,
     genres: List[str],
@@ -126,6 +335,7 @@ def generate_character(
     existing: Optional[Dict[str, str]] = None,
     max_tokens: int = 200,
     temperature: float = 0.8,
+    use_cache: bool = True,
 ) -> Dict[str, str]:
     existing = existing or {}
 
@@ -160,13 +370,15 @@ def generate_character(
 
     user_msg = "\n".join(parts)
 
-    raw = chat_with_model(
+    raw = await cached_chat_with_model(
         [
             {"role": "system", "content": system_msg},
             {"role": "user",   "content": user_msg},
         ],
+        task="character",
         max_tokens=max_tokens,
         temperature=temperature,
+        use_cache=use_cache,
     )
     # Парсер забирает только лейблы с двоеточием
     result: Dict[str, str] = {}
@@ -176,32 +388,146 @@ def generate_character(
             result[key.strip().lower()] = val.strip()
     return result
 
-def load_novel_context(
+CHARACTER_FIELDS = ("name", "appearance", "backstory", "traits")
+# "### Character 2", "## Character 2:", "**Character 2 (the villain)**", "Character 2 - Mira"
+_CHARACTER_HEADER = re.compile(r"^[\W_]*character\s*#?\s*(\d+)\s*(?:[:.)(\-–—*_]|$)", re.IGNORECASE)
+# "Name: Bob", "- **Name:** Bob", "**Name**: Bob"
+_CHARACTER_FIELD  = re.compile(r"^[\W_]*(name|appearance|backstory|traits)[*_\s]*:(.*)$", re.IGNORECASE)
+# markdown-виділення навколо значення
+_DECORATION = "*_ \t"
+
+def parse_characters(raw: str, count: int) -> List[Dict[str, str]]:
+    """
+    Розбирає відповідь виду "### Character N" + "Field: value" на `count`
+    словників (markdown-заголовки і виділення допускаються). Рядки без мітки
+    дописуються до попереднього поля; блоки з
+    номером поза 1..count ігноруються, відсутні персонажі - порожні словники.
+    """
+    result: List[Dict[str, str]] = [{} for _ in range(count)]
+    current: Optional[Dict[str, str]] = None
+    field: Optional[str] = None
+    for line in raw.splitlines():
+        header = _CHARACTER_HEADER.match(line.strip())
+        if header:
+            n = int(header.group(1))
+            current = result[n - 1] if 1 <= n <= count else None
+            field = None
+            continue
+        if current is None:
+            continue
+        labelled = _CHARACTER_FIELD.match(line.strip())
+        if labelled:
+            field = labelled.group(1).lower()
+            current[field] = labelled.group(2).strip(_DECORATION)
+        elif field and line.strip(_DECORATION):
+            current[field] = f"{current[field]} {line.strip(_DECORATION)}".strip()
+    return result
+
+# Кілька персонажів одним запитом: контекст новели надсилається один раз
+async def generate_characters(
+    title: str,
+    description: str,
+    genres: List[str],
+    setting: Optional[str],
+    requests: List[Dict],
+    max_tokens_per_character: int = 200,
+    temperature: float = 0.8,
+    use_cache: bool = True,
+) -> List[Dict[str, str]]:
+    """
+    `requests` - [{"fields": [...], "existing": {...}}] на кожного персонажа.
+    Повертає для кожного лише згенеровані запитані поля (у тому ж порядку).
+    """
+    system_msg = (
+        "You are a character design assistant of novel.\n"
+        "You will get several character slots. For every slot fill in *only* its requested fields.\n"
+        "You **must** answer with one block per slot, in order, in the exact format:\n"
+        "### Character N\n"
+        "FieldName: value\n"
+        "Keep every value on one line. Make the characters distinct from each other. "
+        "Do not add any extra text."
+    )
+    parts: List[str] = [
+        f"Title: {title}",
+        f"Description: {description}",
+        f"Genres: {', '.join(genres)}",
+    ]
+    if setting:
+        parts.append(f"Setting: {setting}")
+
+    for n, req in enumerate(requests, 1):
+        existing = req.get("existing") or {}
+        parts.extend(["", f"### Character {n}"])
+        for field in CHARACTER_FIELDS:
+            if existing.get(field):
+                parts.append(f"{field.capitalize()}: {existing[field]}")
+        parts.append("Generate only: " + ", ".join(f.capitalize() for f in req["fields"]))
+
+    raw = await cached_chat_with_model(
+        [
+            {"role": "system", "content": system_msg},
+            {"role": "user",   "content": "\n".join(parts)},
+        ],
+        task="character",
+        max_tokens=max_tokens_per_character * len(requests),
+        temperature=temperature,
+        use_cache=use_cache,
+    )
+    parsed = parse_characters(raw, len(requests))
+    return [
+        {f: data[f] for f in req["fields"] if data.get(f)}
+        for req, data in zip(requests, parsed)
+    ]
+
+async def load_original_context(
+    novel_id: str,
+    db: AsyncClient,
+) -> Tuple[str, ...]:
+    """
+    Текст оригіналу з кешу процесу. Ключ - (novel_id, updated_at): будь-яка
+    зміна оригіналу оновлює updated_at, тож застаріла версія просто замінюється.
+    """
+    ref = db.collection("novels").document(novel_id)
+    snap = await ref.get()
+    if not snap.exists:
+        return ()
+    data = snap.to_dict()
+    key = (novel_id, data.get("updated_at"))
+
+    texts = original_context_cache.get(key)
+    if texts is not None:
+        return texts
+
+    texts = tuple(await text_snapshot.load_texts(db, ref, data))
+    # стара версія цього оригіналу більше не знадобиться
+    previous = _original_versions.get(novel_id)
+    if previous is not None and previous != key[1]:
+        original_context_cache.invalidate((novel_id, previous))
+    _original_versions.set(novel_id, key[1])
+    original_context_cache.set(key, texts, sum(len(t.encode("utf-8")) for t in texts))
+    return texts
+
+async def load_novel_context(
     novel_id: str,
-    db: FirestoreClient
+    db: AsyncClient
 ) -> dict:
     """
     Завантажує:
         основний документ Novel,
-        усі текстові сегменти (у порядку created_at),
+        усі текстові сегменти (у порядку created_at) - зі знімка text_snapshot,
         усі персонажі,
         за наявності .novel_original_id - текст оригіналу.
     """
     #Новелла
-    doc = db.collection("novels").document(novel_id).get()
+    novel_ref = db.collection("novels").document(novel_id)
+    doc = await novel_ref.get()
     if not doc.exists:
         raise ValueError("Novel not found")
-    novel = Novel.model_validate(doc.to_dict())
+    novel_data = doc.to_dict()
+    novel = Novel.model_validate(novel_data)
 
-    # Свои тексты
-    own_snaps = (
-        db.collection("novels")
-          .document(novel_id)
-          .collection("text_segments")
-          .order_by("created_at")
-          .stream()
-    )
-    own_texts = [s.to_dict()["content"] for s in own_snaps]
+    # Свои тексты: один документ на чанк замість усіх сегментів
+    own_texts = await text_snapshot.load_texts(db, novel_ref, novel_data)
 
     # Персонажи
     char_snaps = (
@@ -210,28 +536,81 @@ def load_novel_context(
           .collection("characters")
           .stream()
     )
-    characters = [c.to_dict() for c in char_snaps]
+    characters = [c.to_dict() async for c in char_snaps]
 
     # Контекст оригинала
-    orig_texts: List[str] = []
+    orig_texts: Tuple[str, ...] = ()
     if novel.novel_original_id:
-        orig_snaps = (
-            db.collection("novels")
-              .document(novel.novel_original_id)
-              .collection("text_segments")
-              .order_by("created_at")
-              .stream()
-        )
-        orig_texts = [s.to_dict()["content"] for s in orig_snaps]
+        orig_texts = await load_original_context(novel.novel_original_id, db)
 
     return {
         "novel": novel,
         "own_text": "\n\n".join(own_texts),
+        "own_segments": own_texts,
         "characters": characters,
         "original_context": orig_texts,
     }
 
-def generate_prologue(
+# Спільний system-промпт усіх генераторів тексту історії. Разом зі story_prefix
+# він дає однаковий початок запиту для тієї ж новели, і провайдер може
+# перевикористати закешований префікс; усе змінне - в кінці повідомлення.
+STORY_SYSTEM_MSG = (
+    "You are a creative writing assistant for an interactive novel. "
+    "Write in the second or third person. "
+    "Use the background context only as a foundation; do not continue or reintroduce original characters."
+)
+
+def story_header(title: str, description: str, genres: List[str], setting: str) -> List[str]:
+    return [
+        f"Title: {title}",
+        f"Description: {description}",
+        f"Genres: {', '.join(genres)}",
+        f"Setting: {setting}",
+    ]
+
+def story_prefix(
+    header: List[str],
+    characters: List[Dict[str, str]],
+    original_context: Optional[List[str]],
+    summary: Optional[str] = None,
+) -> List[str]:
+    """
+    Стабільна частина промпту, від найменш до найбільш змінних секцій:
+    шапка новели, персонажі, контекст оригіналу, підсумок старіших подій.
+    """
+    parts = [*header, "", "Characters:"]
+    parts.extend(character_line(c) for c in characters)
+    if original_context:
+        parts.extend(["", "Background context (plot foundation):"])
+        parts.extend(f"- {line}" for line in original_context)
+    if summary:
+        parts.extend(["", "Earlier events (summary):", summary])
+    return parts
+
+def story_messages(prefix: List[str], suffix: List[str]) -> List[dict]:
+    return [
+        {"role": "system", "content": STORY_SYSTEM_MSG},
+        {"role": "user",   "content": "\n".join([*prefix, "", *suffix])},
+    ]
+
+PROLOGUE_TASK = (
+    "Task: write a 1–2 paragraph prologue that introduces the world, the main conflict and these characters, "
+    "building on the existing story foundation but avoiding direct continuation of old characters.\n"
+    "Write the prologue:"
+)
+
+def prologue_messages(
+    title: str,
+    description: str,
+    genres: List[str],
+    setting: str,
+    characters: List[Dict[str, str]],
+    initial_context: Optional[List[str]] = None,
+) -> List[dict]:
+    header = story_header(title, description, genres, setting)
+    return story_messages(story_prefix(header, characters, initial_context), [PROLOGUE_TASK])
+
+async def generate_prologue(
     title: str,
     description: str,
     genres: List[str],
@@ -240,38 +619,71 @@ def generate_prologue(
     initial_context: Optional[List[str]] = None,
     max_tokens: int = 400,
 ) -> str:
-    system_msg = (
-        "You are a creative writing assistant for interactive novel"
-        "Write in the second or third person 1–2 paragraph prologue that introduces the world, main conflict and these characters,"
-        "building on the existing story foundation but avoiding direct continuation of old characters."
+    messages = prologue_messages(title, description, genres, setting, characters, initial_context)
+    return await chat_with_model(messages, max_tokens=max_tokens, temperature=0.7, task="prologue")
+
+def stream_prologue(
+    title: str,
+    description: str,
+    genres: List[str],
+    setting: str,
+    characters: List[Dict[str, str]],
+    initial_context: Optional[List[str]] = None,
+    max_tokens: int = 400,
+) -> AsyncIterator[str]:
+    messages = prologue_messages(title, description, genres, setting, characters, initial_context)
+    return stream_chat_with_model(messages, max_tokens=max_tokens, temperature=0.7, task="prologue")
+
+def fit_story_context(
+    task: str,
+    fixed_parts: List[str],
+    full_text: str,
+    characters: List[Dict[str, str]],
+    original_context: Optional[List[str]],
+    summary: Optional[str],
+    budget: int,
+) -> StoryContext:
+    """
+    Віднімає від бюджету незмінну частину промпту, наповнює решту
+    контекстом історії і логує, скільки токенів пішло на кожну секцію.
+    """
+    fixed = count_tokens("\n".join(fixed_parts), AI_MODEL)
+    ctx = build_story_context(
+        full_text,
+        characters,
+        original_context,
+        summary=summary,
+        budget=budget - fixed,
+        model=AI_MODEL,
     )
-    # якщо є фон оригіналу, вставляємо його
-    user_parts = []
-    if initial_context:
-        user_parts.append("Background context (do not continue specific original characters):")
-        user_parts.extend(f"- {line}" for line in initial_context)
-        user_parts.append("")  # разделитель
-
-    user_parts += [
-        f"Title: {title}",
-        f"Genres: {', '.join(genres)}",
-        f"Description: {description}",
-        f"Setting: {setting}",
-        "Characters:",
-    ]
-    user_parts += [f"- {c['name']}: {c['backstory']}" for c in characters]
-    user_parts.append("\nWrite the prologue:")
+    logger.info("%s prompt tokens: fixed=%d %s", task, fixed, ctx.usage)
+    return ctx
 
-    return chat_with_model(
-        [
-            {"role": "system", "content": system_msg},
-            {"role": "user",   "content": "\n".join(user_parts)},
-        ],
-        max_tokens=max_tokens,
-        temperature=0.7,
+CONTINUATION_TASK = (
+    "Task: continue the novel, maintaining tone and advancing the main plot.\n"
+    "Write the next passage:"
+)
+
+def continuation_messages(
+    full_text: str,
+    title: str,
+    description: str,
+    genres: List[str],
+    setting: str,
+    characters: List[Dict[str, str]],
+    initial_context: Optional[List[str]] = None,
+    summary: Optional[str] = None,
+    context_budget: int = AI_CONTEXT_TOKEN_BUDGET,
+) -> List[dict]:
+    header = story_header(title, description, genres, setting)
+    ctx = fit_story_context(
+        "continuation", [STORY_SYSTEM_MSG, *header, CONTINUATION_TASK], full_text,
+        characters, initial_context, summary, context_budget,
     )
+    prefix = story_prefix(header, ctx.characters, ctx.original_context, ctx.summary)
+    return story_messages(prefix, ["Current story text:", ctx.recent_text, "", CONTINUATION_TASK])
 
-def generate_continuation(
+async def generate_continuation(
     full_text: str,
     title: str,
     description: str,
@@ -280,50 +692,44 @@ def generate_continuation(
     characters: List[Dict[str, str]],
     initial_context: Optional[List[str]] = None,
     max_tokens: int = 300,
+    summary: Optional[str] = None,
+    context_budget: int = AI_CONTEXT_TOKEN_BUDGET,
 ) -> str:
-    system_msg = (
-        "You are a creative writing assistant."
-        "Continue the following interactive novel, maintaining tone and advancing the main plot. Write in the second or third person."
-        "Use the background context only as a foundation; do not reintroduce original characters."
+    messages = continuation_messages(
+        full_text, title, description, genres, setting, characters,
+        initial_context, summary, context_budget,
     )
-    user_parts = []
-    if initial_context:
-        user_parts.append("Background context (plot foundation):")
-        user_parts.extend(f"- {line}" for line in initial_context)
-        user_parts.append("")  # разделитель
+    return await chat_with_model(messages, max_tokens=max_tokens, temperature=0.8, task="continuation")
 
-    user_parts.extend([
-        f"Title: {title}",
-        f"Description: {description}",
-        f"Genres: {', '.join(genres)}",
-        f"Setting: {setting}",
-        "",
-        "Characters in this copy:",
-    ])
-    # список персонажів
-    for char in characters:
-        user_parts.append(f"- {char['name']}: {char.get('backstory','')}")
-
-    user_parts.extend([
-        "",
-        "Current story text:",
-        full_text,
-        "",
-        "Write the next passage:",
-    ])
+def stream_continuation(
+    full_text: str,
+    title: str,
+    description: str,
+    genres: List[str],
+    setting: str,
+    characters: List[Dict[str, str]],
+    initial_context: Optional[List[str]] = None,
+    max_tokens: int = 300,
+    summary: Optional[str] = None,
+    context_budget: int = AI_CONTEXT_TOKEN_BUDGET,
+) -> AsyncIterator[str]:
+    messages = continuation_messages(
+        full_text, title, description, genres, setting, characters,
+        initial_context, summary, context_budget,
+    )
+    return stream_chat_with_model(messages, max_tokens=max_tokens, temperature=0.8, task="continuation")
 
-    user_msg = "\n".join(user_parts)
+PLOT_OPTIONS_TASK = (
+    "Task: based on the novel's world, existing text and characters, "
+    "propose exactly three distinct options for the next scene. "
+    "Label them '1.', '2.', '3.' at the start of each line.\n"
+    "Provide three next-scene options:"
+)
 
-    return chat_with_model(
-        [
-            {"role": "system", "content": system_msg},
-            {"role": "user",   "content": user_msg},
-        ],
-        max_tokens=max_tokens,
-        temperature=0.8,
-    )
+# Змінюйте при кожній зміні промпту нижче, щоб не віддавати варіанти зі старого кешу
+PLOT_OPTIONS_PROMPT_VERSION = 2
 
-def generate_three_plot_options(
+async def generate_three_plot_options(
     title: str,
     description: str,
     genres: List[str],
@@ -332,42 +738,20 @@ def generate_three_plot_options(
     original_context: Optional[List[str]] = None,
     full_text: str = "",
     max_tokens: int = 300,
+    summary: Optional[str] = None,
+    context_budget: int = AI_CONTEXT_TOKEN_BUDGET,
 ) -> List[str]:
-    system_msg = (
-        "You are an interactive novel assistant. "
-        "Based on the novel’s world, existing text, and characters, "
-        "propose exactly three distinct options for the next scene. "
-        "Label them '1.', '2.', '3.' at the start of each line."
+    header = story_header(title, description, genres, setting)
+    ctx = fit_story_context(
+        "plot_options", [STORY_SYSTEM_MSG, *header, PLOT_OPTIONS_TASK], full_text,
+        characters, original_context, summary, context_budget,
     )
-    parts: List[str] = []
-    if original_context:
-        parts.append("Background context (foundation):")
-        parts.extend(f"- {line}" for line in original_context)
-        parts.append("")
-
-    parts.extend([
-        f"Title: {title}",
-        f"Description: {description}",
-        f"Genres: {', '.join(genres)}",
-        f"Setting: {setting}",
-        "",
-        "Characters:",
-    ])
-    for c in characters:
-        parts.append(f"- {c['name']}: {c.get('backstory','')}")
+    prefix = story_prefix(header, ctx.characters, ctx.original_context, ctx.summary)
+    suffix = ["Current story text:", ctx.recent_text, ""] if ctx.recent_text else []
 
-    if full_text:
-        parts.extend(["", "Current story text:", full_text])
-
-    parts.append("\nProvide three next-scene options:")
-
-    user_msg = "\n".join(parts)
-
-    raw = chat_with_model(
-        [
-            {"role": "system", "content": system_msg},
-            {"role": "user",   "content": user_msg},
-        ],
+    raw = await chat_with_model(
+        story_messages(prefix, [*suffix, PLOT_OPTIONS_TASK]),
+        task="plot_options",
         max_tokens=max_tokens,
         temperature=0.8,
     )
@@ -378,4 +762,60 @@ def generate_three_plot_options(
         if line.strip().startswith(("1.","2.","3.")):
             _, text = line.split(".",1)
             opts.append(text.strip())
-    return opts
\ No newline at end of file
+    return opts
+
+# Підсумок "глави" - кількох послідовних уривків історії
+async def generate_chapter_summary(
+    passages: List[str],
+    previous_summary: str = "",
+    max_tokens: int = 250,
+) -> str:
+    system_msg = (
+        "You are a story editor. "
+        "Summarize the given passages of an interactive novel as one compact paragraph. "
+        "Keep names, decisions, unresolved threads and changes in relationships; drop style and dialogue."
+    )
+    parts: List[str] = []
+    if previous_summary:
+        parts.extend(["What happened just before (for continuity only):", previous_summary, ""])
+    parts.append("Passages:")
+    parts.extend(passages)
+    parts.append("\nSummary:")
+
+    return await chat_with_model(
+        [
+            {"role": "system", "content": system_msg},
+            {"role": "user",   "content": "\n\n".join(parts)},
+        ],
+        task="summary",
+        max_tokens=max_tokens,
+        temperature=0.3,
+    )
+
+# Підсумок підсумків: вливає старі глави в загальний огляд історії
+async def generate_summary_of_summaries(
+    overview: str,
+    chapter_summaries: List[str],
+    max_tokens: int = 350,
+) -> str:
+    system_msg = (
+        "You are a story editor. "
+        "Merge the story-so-far overview with the following chapter summaries into one updated overview. "
+        "Keep it chronological and compact; keep only what matters for future events."
+    )
+    parts: List[str] = []
+    if overview:
+        parts.extend(["Story so far:", overview, ""])
+    parts.append("Next chapters:")
+    parts.extend(f"- {s}" for s in chapter_summaries)
+    parts.append("\nUpdated overview:")
+
+    return await chat_with_model(
+        [
+            {"role": "system", "content": system_msg},
+            {"role": "user",   "content": "\n".join(parts)},
+        ],
+        task="summary",
+        max_tokens=max_tokens,
+        temperature=0.3,
+    )
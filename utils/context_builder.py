@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+try:
+    import tiktoken
+except ImportError:  # без tiktoken рахуємо приблизно
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Скільки токенів промпту можна витратити на контекст історії
+AI_CONTEXT_TOKEN_BUDGET = int(os.getenv("AI_CONTEXT_TOKEN_BUDGET", "3000"))
+# Частка бюджету, яку можуть зайняти останні сегменти тексту
+AI_CONTEXT_RECENT_SHARE = float(os.getenv("AI_CONTEXT_RECENT_SHARE", "0.6"))
+# Частка бюджету під персонажів і контекст оригіналу (в межах того, що лишили
+# останні сегменти). Вона не залежить від довжини тексту, тож ці секції
+# (стабільний префікс промпту) не змінюються від запиту до запиту і провайдер
+# може брати їх зі свого кешу
+AI_CONTEXT_STABLE_SHARE = float(os.getenv("AI_CONTEXT_STABLE_SHARE", "0.3"))
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s")
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    """
+    tiktoken encoding of `model`, or None when it cannot be loaded: tiktoken is
+    not installed, or its BPE file is not cached and cannot be downloaded.
+    The result (None too) is cached, so a failed download is tried only once.
+    """
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        logger.warning("tiktoken encoding for %s is unavailable, counting tokens approximately", model, exc_info=True)
+        return None
+
+
+async def warm_encoding(model: str = "gpt-3.5-turbo") -> None:
+    """Loads the encoding off the event loop (the first load may download it)."""
+    await asyncio.get_running_loop().run_in_executor(None, _encoding, model)
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    if not text:
+        return 0
+    enc = _encoding(model)
+    if enc is None:
+        return (len(text) + 3) // 4
+    return len(enc.encode(text))
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str = "gpt-3.5-turbo", keep_end: bool = False) -> str:
+    """
+    Cuts `text` to at most `max_tokens`, keeping its beginning (or its end).
+    """
+    if max_tokens <= 0:
+        return ""
+    enc = _encoding(model)
+    if enc is None:
+        limit = max_tokens * 4
+        return text[-limit:] if keep_end else text[:limit]
+    tokens = enc.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    part = tokens[-max_tokens:] if keep_end else tokens[:max_tokens]
+    return enc.decode(part)
+
+
+def extractive_summary(segments: List[str]) -> str:
+    """
+    Cheap local stand-in for a real summary: the first sentence of each segment.
+    """
+    firsts = []
+    for seg in segments:
+        seg = seg.strip()
+        if seg:
+            firsts.append(_SENTENCE_END.split(seg, 1)[0])
+    return " ".join(firsts)
+
+
+class StoryContext(BaseModel):
+    recent_text:      str = ""
+    summary:          str = ""
+    characters:       List[Dict[str, str]] = Field(default_factory=list)
+    original_context: List[str] = Field(default_factory=list)
+    usage:            Dict[str, int] = Field(default_factory=dict)  # токени по секціях
+
+
+def character_line(c: Dict[str, str]) -> str:
+    return f"- {c['name']}: {c.get('backstory', '')}"
+
+
+def build_story_context(
+    full_text: str,
+    characters: List[Dict[str, str]],
+    original_context: Optional[List[str]] = None,
+    summary: Optional[str] = None,
+    budget: int = AI_CONTEXT_TOKEN_BUDGET,
+    model: str = "gpt-3.5-turbo",
+) -> StoryContext:
+    """
+    Fills `budget` tokens by priority:
+        1. the most recent segments (up to AI_CONTEXT_RECENT_SHARE of the budget),
+        2. characters, then original-novel context (lines closest to the fork
+           point first) - within AI_CONTEXT_STABLE_SHARE of the budget, capped
+           by what the recent segments left. With the default shares the cap
+           never bites, so these prefix sections do not change as the story grows;
+        3. a summary of the older text: the given one (covering text before
+           `full_text`) followed by an extractive summary of the segments of
+           `full_text` older than the recent window.
+    """
+    segments = [s for s in full_text.split("\n\n") if s.strip()] if full_text else []
+    original_context = original_context or []
+    budget = max(budget, 0)
+
+    remaining = budget
+
+    # 1. останні сегменти - з кінця, поки влазять у свою частку
+    recent_limit = int(budget * AI_CONTEXT_RECENT_SHARE)
+    first_recent = len(segments)
+    while first_recent > 0:
+        cost = count_tokens(segments[first_recent - 1], model)
+        if cost > recent_limit:
+            break
+        recent_limit -= cost
+        remaining -= cost
+        first_recent -= 1
+
+    if first_recent == len(segments) and segments:
+        # навіть останній сегмент не вліз - беремо його кінець
+        tail = truncate_tokens(segments[-1], recent_limit, model, keep_end=True)
+        remaining -= count_tokens(tail, model)
+        recent = [tail]
+        first_recent -= 1
+    else:
+        recent = segments[first_recent:]
+
+    # 2. персонажі і контекст оригіналу - зі своєї частки, але не більше
+    # того, що лишили останні сегменти
+    stable = min(int(budget * AI_CONTEXT_STABLE_SHARE), remaining)
+    chars: List[Dict[str, str]] = []
+    for c in characters:
+        cost = count_tokens(character_line(c), model)
+        if cost > stable:
+            break
+        chars.append(c)
+        stable -= cost
+        remaining -= cost
+
+    # з кінця, ближче до точки форку
+    orig: List[str] = []
+    for line in reversed(original_context):
+        cost = count_tokens(line, model)
+        if cost > stable:
+            break
+        orig.insert(0, line)
+        stable -= cost
+        remaining -= cost
+
+    # 3. підсумок старішого тексту - з усього, що лишилось
+    # (збережений підсумок покриває лише текст до full_text; старіші сегменти
+    # самого full_text, що не влізли у вікно, стискаються поверх нього).
+    # Першим у бюджет іде збережений підсумок (огляд і розділи, з початку),
+    # а обрізається екстрактивний хвіст - з боку, дальшого від вікна
+    older = segments[:first_recent]
+    summary_text = ""
+    if older or summary:
+        stored = truncate_tokens(summary or "", remaining, model)
+        remaining -= count_tokens(stored, model)
+        extract = extractive_summary(older)
+        if stored and extract:
+            remaining -= count_tokens("\n\n", model)
+        extract = truncate_tokens(extract, remaining, model, keep_end=True)
+        summary_text = "\n\n".join(p for p in (stored, extract) if p)
+
+    recent_text = "\n\n".join(recent)
+    usage = {
+        "recent_text":      count_tokens(recent_text, model),
+        "summary":          count_tokens(summary_text, model),
+        "characters":       sum(count_tokens(character_line(c), model) for c in chars),
+        "original_context": sum(count_tokens(line, model) for line in orig),
+    }
+    usage["total"] = sum(usage.values())
+    return StoryContext(
+        recent_text=recent_text,
+        summary=summary_text,
+        characters=chars,
+        original_context=orig,
+        usage=usage,
+    )
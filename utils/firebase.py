@@ -1,8 +1,16 @@
 import os
 import json
+import asyncio
+from typing import Iterable, List
 import firebase_admin
-from firebase_admin import credentials, firestore as _firestore, storage
-from google.cloud.firestore import Client as FirestoreClient
+from firebase_admin import credentials, firestore_async as _firestore, storage
+from google.cloud.firestore import AsyncClient, DocumentSnapshot
+from google.cloud.firestore_v1.field_path import FieldPath
+
+# Firestore обробляє до кількох сотень документів у BatchGetDocuments без проблем
+GET_ALL_CHUNK = 100
+# Firestore дозволяє до 500 операцій в одному batch
+FIRESTORE_BATCH_LIMIT = 500
 
 def init_firebase() -> None:
     try:
@@ -20,14 +28,59 @@ def init_firebase() -> None:
         else:
             firebase_admin.initialize_app(cred)
 
-def get_db() -> FirestoreClient:
+def get_db() -> AsyncClient:
     """
-    Return a Firestore client.
+    Return an async Firestore client.
+    Every call must be awaited so handlers never block the event loop.
     """
     return _firestore.client()
 
+def field_path(*parts: str) -> str:
+    """
+    Dotted path to a nested field, escaped where needed (ids with "-" etc.),
+    for update() keys: field_path("votes", user_id) -> "votes.`a-b`".
+    """
+    return FieldPath(*parts).to_api_repr()
+
 def get_storage_bucket():
     """
     Return the default Storage bucket.
     """
-    return storage.bucket()
\ No newline at end of file
+    return storage.bucket()
+
+async def get_documents(
+    db: AsyncClient,
+    collection: str,
+    ids: Iterable[str],
+    chunk_size: int = GET_ALL_CHUNK,
+) -> List[DocumentSnapshot]:
+    """
+    Bulk-load documents of one collection by id.
+    Ids are split into chunks of `chunk_size`, every chunk is one `get_all`
+    round trip and all chunks run concurrently. Missing documents are skipped,
+    duplicates are dropped and the result keeps the order of `ids`.
+    """
+    unique_ids = list(dict.fromkeys(ids))
+    if not unique_ids:
+        return []
+
+    coll = db.collection(collection)
+
+    async def load_chunk(chunk: List[str]) -> List[DocumentSnapshot]:
+        refs = [coll.document(doc_id) for doc_id in chunk]
+        return [snap async for snap in db.get_all(refs)]
+
+    chunks = [
+        unique_ids[i:i + chunk_size]
+        for i in range(0, len(unique_ids), chunk_size)
+    ]
+    loaded = await asyncio.gather(*(load_chunk(c) for c in chunks))
+
+    # get_all не гарантує порядок - відновлюємо порядок вхідних id
+    by_id = {
+        snap.id: snap
+        for batch in loaded
+        for snap in batch
+        if snap.exists
+    }
+    return [by_id[doc_id] for doc_id in unique_ids if doc_id in by_id]
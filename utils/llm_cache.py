@@ -0,0 +1,119 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Кеш відповідей моделі: off (за замовчуванням) | memory | sqlite
+AI_RESPONSE_CACHE      = os.getenv("AI_RESPONSE_CACHE", "off").lower()
+AI_RESPONSE_CACHE_TTL  = float(os.getenv("AI_RESPONSE_CACHE_TTL", "86400"))
+AI_RESPONSE_CACHE_SIZE = int(os.getenv("AI_RESPONSE_CACHE_SIZE", "2048"))
+AI_RESPONSE_CACHE_PATH = os.getenv("AI_RESPONSE_CACHE_PATH", "llm_cache.sqlite3")
+
+# Як часто (у записах) SQLite-бекенд чистить прострочені рядки
+_PRUNE_EVERY = 256
+
+
+def response_key(model: str, messages: List[dict], temperature: float, max_tokens: int) -> str:
+    """Хеш усього, що визначає відповідь моделі."""
+    payload = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryResponseCache:
+    """In-process LRU of completions; lost on restart, not shared by workers."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._cache.get(key)
+
+    async def set(self, key: str, value: str) -> None:
+        self._cache.set(key, value)
+
+    def stats(self) -> Dict[str, int]:
+        return self._cache.stats()
+
+
+class SQLiteResponseCache:
+    """
+    Completions in a local SQLite file: survives restarts and is shared by
+    the workers of one host. Queries run in a worker thread.
+    """
+
+    def __init__(self, path: str, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM responses WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key: str, value: str, prune: bool) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, now + self.ttl),
+            )
+            if prune:
+                self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+            self._conn.commit()
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await asyncio.to_thread(self._get, key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: str) -> None:
+        self._writes += 1
+        await asyncio.to_thread(self._set, key, value, self._writes % _PRUNE_EVERY == 0)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "writes": self._writes}
+
+
+def _make_backend():
+    if AI_RESPONSE_CACHE == "memory":
+        return MemoryResponseCache(AI_RESPONSE_CACHE_SIZE, AI_RESPONSE_CACHE_TTL)
+    if AI_RESPONSE_CACHE == "sqlite":
+        return SQLiteResponseCache(AI_RESPONSE_CACHE_PATH, AI_RESPONSE_CACHE_TTL)
+    if AI_RESPONSE_CACHE != "off":
+        logger.warning("Unknown AI_RESPONSE_CACHE=%r, response cache disabled", AI_RESPONSE_CACHE)
+    return None
+
+
+# None - кеш вимкнено
+response_cache = _make_backend()
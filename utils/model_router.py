@@ -0,0 +1,112 @@
+import os
+import time
+from collections import deque
+from statistics import median
+from typing import Deque, Dict, List, Optional, Tuple
+
+# Яким рівнем моделей обслуговується кожне AI-завдання
+TASK_TIERS: Dict[str, str] = {
+    "title":        "fast",
+    "character":    "fast",
+    "description":  "standard",
+    "setting":      "standard",
+    "summary":      "standard",
+    "prologue":     "quality",
+    "continuation": "quality",
+    "plot_options": "quality",
+}
+DEFAULT_TIER = "standard"
+
+# Поріг медіанної затримки (мс), вище якого модель рівня вважається деградованою
+_TIER_MAX_MS = {"fast": 4000, "standard": 10000, "quality": 20000}
+
+# За скільки останніх секунд рахуємо статистику моделі
+AI_ROUTER_WINDOW_SECONDS = float(os.getenv("AI_ROUTER_WINDOW_SECONDS", "300"))
+# Менше замірів - ще не судимо про модель
+AI_ROUTER_MIN_SAMPLES    = int(os.getenv("AI_ROUTER_MIN_SAMPLES", "5"))
+AI_ROUTER_MAX_ERROR_RATE = float(os.getenv("AI_ROUTER_MAX_ERROR_RATE", "0.5"))
+
+
+class ModelStats:
+    """Rolling latency and error rate of one model over the last window."""
+
+    def __init__(self, window: float):
+        self.window = window
+        self._samples: Deque[Tuple[float, float, bool]] = deque()  # (коли, мс, успіх)
+
+    def _prune(self) -> None:
+        cutoff = time.monotonic() - self.window
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+
+    def record(self, latency_ms: float, ok: bool) -> None:
+        self._samples.append((time.monotonic(), latency_ms, ok))
+        self._prune()
+
+    def snapshot(self) -> Dict[str, Optional[float]]:
+        self._prune()
+        total = len(self._samples)
+        errors = sum(1 for _, _, ok in self._samples if not ok)
+        latencies = [ms for _, ms, ok in self._samples if ok]
+        return {
+            "samples":    total,
+            "error_rate": errors / total if total else 0.0,
+            "p50_ms":     median(latencies) if latencies else None,
+        }
+
+
+class ModelRouter:
+    """
+    Maps AI tasks to an ordered list of models (a tier with fallbacks).
+    Models of the tier whose rolling error rate or median latency is over the
+    limit move to the end of the list until their window recovers.
+
+    Tiers are configured as comma-separated models, preferred first:
+        AI_TIER_FAST, AI_TIER_STANDARD, AI_TIER_QUALITY  (default: AI_MODEL)
+        AI_TIER_<NAME>_MAX_MS - latency threshold of the tier
+    """
+
+    def __init__(self, default_model: str):
+        self.tiers: Dict[str, List[str]] = {}
+        self.max_ms: Dict[str, float] = {}
+        for tier, default_ms in _TIER_MAX_MS.items():
+            env = os.getenv(f"AI_TIER_{tier.upper()}", default_model)
+            self.tiers[tier] = [m.strip() for m in env.split(",") if m.strip()] or [default_model]
+            self.max_ms[tier] = float(os.getenv(f"AI_TIER_{tier.upper()}_MAX_MS", str(default_ms)))
+        self._stats: Dict[str, ModelStats] = {}
+
+    def _model_stats(self, model: str) -> ModelStats:
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats[model] = ModelStats(AI_ROUTER_WINDOW_SECONDS)
+        return stats
+
+    def _healthy(self, model: str, max_ms: float) -> bool:
+        snap = self._model_stats(model).snapshot()
+        if snap["samples"] < AI_ROUTER_MIN_SAMPLES:
+            return True
+        if snap["error_rate"] > AI_ROUTER_MAX_ERROR_RATE:
+            return False
+        return snap["p50_ms"] is None or snap["p50_ms"] <= max_ms
+
+    def primary(self, task: str) -> str:
+        """The preferred model of the tier of `task`, whatever its health."""
+        return self.tiers[TASK_TIERS.get(task, DEFAULT_TIER)][0]
+
+    def candidates(self, task: str) -> List[str]:
+        """Models to try for `task`, in order: healthy ones first, then the rest."""
+        tier = TASK_TIERS.get(task, DEFAULT_TIER)
+        models = self.tiers[tier]
+        healthy = [m for m in models if self._healthy(m, self.max_ms[tier])]
+        degraded = [m for m in models if m not in healthy]
+        degraded.sort(key=lambda m: self._model_stats(m).snapshot()["error_rate"])
+        return healthy + degraded
+
+    def record(self, model: str, latency_ms: float, ok: bool) -> None:
+        self._model_stats(model).record(latency_ms, ok)
+
+    def stats(self) -> dict:
+        return {
+            "tiers":  self.tiers,
+            "models": {m: s.snapshot() for m, s in self._stats.items()},
+        }
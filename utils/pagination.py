@@ -0,0 +1,60 @@
+import base64
+import json
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from google.cloud.firestore import AsyncQuery, DocumentSnapshot, Query
+from google.cloud.firestore_v1.field_path import FieldPath
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE     = 100
+
+
+def encode_cursor(value: datetime, doc_id: str) -> str:
+    """
+    Packs the sort key of the last returned document into an opaque token.
+    """
+    raw = json.dumps({"v": value.isoformat(), "id": doc_id}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """
+    Reverse of encode_cursor; raises ValueError for a malformed token.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(data["v"]), str(data["id"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+async def paginate(
+    query: AsyncQuery,
+    order_field: str,
+    limit: int = DEFAULT_PAGE_SIZE,
+    after: Optional[str] = None,
+    descending: bool = True,
+) -> Tuple[List[DocumentSnapshot], Optional[str]]:
+    """
+    Returns one page of `query` ordered by (order_field, document id) and the
+    cursor of the next page (None when this page is the last one).
+    Only limit + 1 documents are read, whatever the collection size.
+    """
+    direction = Query.DESCENDING if descending else Query.ASCENDING
+    q = (
+        query.order_by(order_field, direction=direction)
+             .order_by(FieldPath.document_id(), direction=direction)
+    )
+    if after:
+        value, doc_id = decode_cursor(after)
+        q = q.start_after({order_field: value, FieldPath.document_id(): doc_id})
+
+    snaps = [doc async for doc in q.limit(limit + 1).stream()]
+    if len(snaps) <= limit:
+        return snaps, None
+
+    snaps = snaps[:limit]
+    last = snaps[-1]
+    return snaps, encode_cursor(last.get(order_field), last.id)
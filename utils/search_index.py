@@ -0,0 +1,282 @@
+import asyncio
+import heapq
+import logging
+import os
+from array import array
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from google.cloud.firestore import AsyncClient
+
+from models import Novel, genre_mask
+
+logger = logging.getLogger(__name__)
+
+# Як часто перечитувати індекси з Firestore, щоб побачити записи інших воркерів (0 - ніколи)
+NOVEL_INDEX_REFRESH_SECONDS = float(os.getenv("NOVEL_INDEX_REFRESH_SECONDS", "600"))
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def to_micros(dt: datetime) -> int:
+    """Точний (без float) час у мікросекундах від епохи."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - _EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(us: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=us)
+
+
+class TrigramIndex:
+    """
+    In-memory inverted index trigram -> novel ids over lowercased titles.
+    A query is matched as a substring: candidates are the intersection of the
+    posting lists of its trigrams, then every candidate is verified and ranked.
+    """
+
+    def __init__(self):
+        self._titles: Dict[str, str] = {}
+        self._postings: Dict[str, Set[str]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self._titles)
+
+    def add(self, novel_id: str, title: str) -> None:
+        self.remove(novel_id)
+        low = (title or "").lower()
+        self._titles[novel_id] = low
+        for tri in trigrams(low):
+            self._postings[tri].add(novel_id)
+
+    def remove(self, novel_id: str) -> None:
+        low = self._titles.pop(novel_id, None)
+        if low is None:
+            return
+        for tri in trigrams(low):
+            ids = self._postings.get(tri)
+            if ids is None:
+                continue
+            ids.discard(novel_id)
+            if not ids:
+                del self._postings[tri]
+
+    def clear(self) -> None:
+        self._titles.clear()
+        self._postings.clear()
+
+    def reset(self, items: List[Tuple[str, str]]) -> None:
+        """
+        Replaces the whole index with (novel_id, title) pairs.
+        """
+        self.clear()
+        for novel_id, title in items:
+            self.add(novel_id, title)
+
+    def _candidates(self, low: str) -> Set[str]:
+        grams = trigrams(low)
+        if not grams:
+            # 1-2 символи: триграмами не покрити, переглядаємо назви в пам'яті
+            return set(self._titles)
+        # починаємо з найрідшої триграми, щоб перетин був дешевим
+        lists = sorted((self._postings.get(g, set()) for g in grams), key=len)
+        result = set(lists[0])
+        for ids in lists[1:]:
+            result &= ids
+            if not result:
+                break
+        return result
+
+    @staticmethod
+    def _score(low: str, title: str) -> Optional[Tuple[int, int, int]]:
+        pos = title.find(low)
+        if pos < 0:
+            return None
+        if title == low:
+            kind = 0
+        elif pos == 0:
+            kind = 1
+        elif not title[pos - 1].isalnum():
+            kind = 2  # збіг з початку слова
+        else:
+            kind = 3
+        return kind, pos, len(title)
+
+    def search(self, query: str, limit: int = 20) -> List[str]:
+        """
+        Ids of novels whose title contains `query`, best matches first:
+        exact title, then prefix, then word start, then any substring.
+        """
+        low = query.lower()
+        if not low:
+            return []
+        scored = []
+        for novel_id in self._candidates(low):
+            score = self._score(low, self._titles[novel_id])
+            if score is not None:
+                scored.append((score, novel_id))
+        scored.sort()
+        return [novel_id for _, novel_id in scored[:limit]]
+
+
+class GenreMaskIndex:
+    """
+    Compact columnar index of every novel's genre bitmask, public flag and
+    updated_at. "Has all of these genres" is a single bitwise AND per slot;
+    freed slots are reused so the arrays do not grow with deletions.
+    """
+
+    def __init__(self):
+        self._ids: List[Optional[str]] = []
+        self._masks   = array("L")  # 19 жанрів - вистачає 32 бітів
+        self._public  = array("B")
+        self._updated = array("q")  # updated_at у мікросекундах
+        self._pos:  Dict[str, int] = {}
+        self._free: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._pos)
+
+    def add(self, novel_id: str, mask: int, is_public: bool, updated_at: datetime) -> None:
+        pos = self._pos.get(novel_id)
+        if pos is None:
+            if self._free:
+                pos = self._free.pop()
+                self._ids[pos] = novel_id
+            else:
+                pos = len(self._ids)
+                self._ids.append(novel_id)
+                self._masks.append(0)
+                self._public.append(0)
+                self._updated.append(0)
+            self._pos[novel_id] = pos
+        self._masks[pos]   = mask
+        self._public[pos]  = 1 if is_public else 0
+        self._updated[pos] = to_micros(updated_at)
+
+    def remove(self, novel_id: str) -> None:
+        pos = self._pos.pop(novel_id, None)
+        if pos is None:
+            return
+        self._ids[pos]    = None
+        self._masks[pos]  = 0
+        self._public[pos] = 0
+        self._free.append(pos)
+
+    def clear(self) -> None:
+        self.__init__()
+
+    def query(
+        self,
+        want: int,
+        public_only: bool = False,
+        limit: int = 20,
+        after: Optional[Tuple[int, str]] = None,
+    ) -> Tuple[List[str], Optional[Tuple[int, str]]]:
+        """
+        Novels whose mask contains every bit of `want`, newest updated_at first.
+        `after` is the (updated_at_us, novel_id) key of the previous page's last
+        item; the second return value is that key for this page, or None.
+        """
+        ids, masks, public, updated = self._ids, self._masks, self._public, self._updated
+        hits = []
+        for pos, mask in enumerate(masks):
+            if mask & want != want or ids[pos] is None:
+                continue
+            if public_only and not public[pos]:
+                continue
+            key = (updated[pos], ids[pos])
+            if after is None or key < after:
+                hits.append(key)
+
+        top = heapq.nlargest(limit + 1, hits)
+        if len(top) <= limit:
+            return [nid for _, nid in top], None
+        top = top[:limit]
+        return [nid for _, nid in top], top[-1]
+
+
+title_index = TrigramIndex()
+genre_index = GenreMaskIndex()
+
+# Журнали локальних змін для перебудов, що зараз читають Firestore:
+# (novel_id, новела або None для видалення)
+_journals: List[List[Tuple[str, Optional[Novel]]]] = []
+
+
+def _apply(novel_id: str, novel: Optional[Novel]) -> None:
+    if novel is None:
+        title_index.remove(novel_id)
+        genre_index.remove(novel_id)
+    else:
+        title_index.add(novel_id, novel.title)
+        genre_index.add(novel_id, genre_mask(novel.genres), novel.is_public, novel.updated_at)
+
+
+def index_novel(novel: Novel) -> None:
+    """Оновлює всі in-memory індекси після запису новели."""
+    _apply(novel.novel_id, novel)
+    for journal in _journals:
+        journal.append((novel.novel_id, novel))
+
+
+def unindex_novel(novel_id: str) -> None:
+    _apply(novel_id, None)
+    for journal in _journals:
+        journal.append((novel_id, None))
+
+
+async def rebuild_novel_indexes(db: AsyncClient) -> None:
+    """
+    Rebuilds the title and genre indexes from Firestore, reading only the
+    fields they need.
+    """
+    fields = ["title", "genres", "is_public", "updated_at"]
+    journal: List[Tuple[str, Optional[Novel]]] = []
+    _journals.append(journal)
+    try:
+        rows = [
+            (doc.id, doc.to_dict())
+            async for doc in db.collection("novels").select(fields).stream()
+        ]
+    finally:
+        _journals.remove(journal)
+
+    # без await між clear() і add(), тож запити ніколи не бачать пів-індексу
+    title_index.reset([(nid, data.get("title") or "") for nid, data in rows])
+    genre_index.clear()
+    scanned: Dict[str, datetime] = {}
+    for nid, data in rows:
+        updated_at = data.get("updated_at") or _EPOCH
+        scanned[nid] = updated_at
+        genre_index.add(
+            nid,
+            genre_mask(data.get("genres") or []),
+            bool(data.get("is_public")),
+            updated_at,
+        )
+    # локальні записи, зроблені поки йшло читання, могли не потрапити у вибірку:
+    # відтворюємо їх, якщо скан не приніс новішої версії (від іншого воркера)
+    for nid, novel in journal:
+        if novel is not None and nid in scanned and to_micros(scanned[nid]) > to_micros(novel.updated_at):
+            continue
+        _apply(nid, novel)
+
+
+async def refresh_novel_indexes_forever(db: AsyncClient) -> None:
+    """
+    Background task: periodically rebuilds the indexes so that writes made by
+    other workers become visible too.
+    """
+    while True:
+        await asyncio.sleep(NOVEL_INDEX_REFRESH_SECONDS)
+        try:
+            await rebuild_novel_indexes(db)
+        except Exception:
+            logger.exception("Novel index refresh failed")
@@ -0,0 +1,290 @@
+import asyncio
+import logging
+import os
+import time
+import zlib
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from google.cloud.firestore import AsyncClient
+
+from models import ChatMessage, Choice, MultiplayerSession, now_utc
+from utils.firebase import FIRESTORE_BATCH_LIMIT, field_path
+from utils.session_events import session_hub
+from utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Живі сесії в пам'яті воркера (opt-in). Запити сесії мають приходити на той
+# самий воркер: балансувальник маршрутизує за sid так само, як owns() нижче.
+SESSION_ACTORS             = os.getenv("SESSION_ACTORS", "0").lower() in ("1", "true", "yes")
+SESSION_WORKER_COUNT       = int(os.getenv("SESSION_WORKER_COUNT", "1"))
+SESSION_WORKER_INDEX       = int(os.getenv("SESSION_WORKER_INDEX", "0"))
+# Затримка, за яку зміни сесії збираються в один batch
+SESSION_FLUSH_SECONDS      = float(os.getenv("SESSION_FLUSH_SECONDS", "0.25"))
+# Скільки неактивна сесія живе в пам'яті
+SESSION_ACTOR_IDLE_SECONDS = float(os.getenv("SESSION_ACTOR_IDLE_SECONDS", "600"))
+# Скільки разів повторювати невдалий запис, перш ніж відкинути зміни
+SESSION_FLUSH_RETRIES      = int(os.getenv("SESSION_FLUSH_RETRIES", "5"))
+
+CHAT_COLL    = "chat"
+CHOICES_COLL = "choices"
+
+def owns(sid: str) -> bool:
+    """Чи закріплена сесія за цим воркером."""
+    return zlib.crc32(sid.encode("utf-8")) % SESSION_WORKER_COUNT == SESSION_WORKER_INDEX
+
+
+class SessionActor:
+    """
+    The live state of one multiplayer session, owned by this worker.
+    Operations are plain synchronous methods: they validate, change the state,
+    queue the matching Firestore writes and publish the event without ever
+    awaiting, so on the event loop they apply one after another in arrival
+    order with no locks. Queued writes are flushed in one coalesced batch
+    SESSION_FLUSH_SECONDS after the first change (later values of a field
+    replace earlier ones).
+    """
+
+    def __init__(self, db: AsyncClient, sess: MultiplayerSession, choices: List[Choice]):
+        self.db = db
+        self.sid = sess.session_id
+        self.state = sess
+        self.choices: Dict[str, Choice] = {c.choice_id: c for c in choices}
+        self.touched = time.monotonic()
+        self._fields: Dict[str, Any] = {}             # шлях поля сесії -> значення
+        self._docs: Dict[Tuple[str, str], dict] = {}  # (підколекція, id) -> документ
+        self._flush_task: Optional[asyncio.Task] = None
+        # тримається навколо commit, щоб batch-і не обганяли один одного,
+        # і на час закриття раунду (див. closing_round)
+        self._commit_lock = asyncio.Lock()
+
+    @property
+    def ref(self):
+        return self.db.collection("sessions").document(self.sid)
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._fields or self._docs)
+
+    def _changed(self) -> None:
+        self.touched = time.monotonic()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    # ── операції ──
+
+    def check_member(self, user_id: str, host_ok: bool = True) -> None:
+        self.touched = time.monotonic()
+        allowed = (*self.state.players, self.state.host_id) if host_ok else self.state.players
+        if user_id not in allowed:
+            raise HTTPException(status.HTTP_403_FORBIDDEN, detail="Access denied" if host_ok else "Not in session")
+
+    def snapshot(self) -> MultiplayerSession:
+        return self.state.model_copy(deep=True)
+
+    def join(self, user_id: str, max_players: int) -> MultiplayerSession:
+        sess = self.state
+        if user_id not in (*sess.invited, sess.host_id):
+            raise HTTPException(status.HTTP_403_FORBIDDEN, detail="Not invited")
+        if len(sess.players) >= max_players:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Session is full")
+        sess.players[user_id] = None
+        self._fields[field_path("players", user_id)] = None
+        self._changed()
+        session_hub.publish(self.sid, "player_joined", {"user_id": user_id})
+        return self.snapshot()
+
+    def chat(self, user_id: Optional[str], msg: str) -> ChatMessage:
+        if user_id is not None:
+            self.check_member(user_id, host_ok=False)
+        message = ChatMessage(user_id=user_id, msg=msg)
+        self._docs[(CHAT_COLL, message.message_id)] = message.model_dump()
+        self._changed()
+        session_hub.publish(self.sid, "chat", message.model_dump(mode="json"))
+        return message
+
+    def vote(self, user_id: str, choice_id: str) -> bool:
+        """Records the vote; returns True once every player has voted."""
+        self.check_member(user_id, host_ok=False)
+        if choice_id not in self.choices:
+            raise HTTPException(status.HTTP_409_CONFLICT, detail="Choice is not open for voting")
+        sess = self.state
+        previous = sess.votes.get(user_id)
+        if previous != choice_id:
+            sess.votes[user_id] = choice_id
+            sess.tally[choice_id] = sess.tally.get(choice_id, 0) + 1
+            self._fields[field_path("votes", user_id)] = choice_id
+            self._fields[field_path("tally", choice_id)] = sess.tally[choice_id]
+            if previous is not None:
+                sess.tally[previous] = sess.tally.get(previous, 1) - 1
+                self._fields[field_path("tally", previous)] = sess.tally[previous]
+            self._changed()
+        session_hub.publish(self.sid, "vote_cast", {"user_id": user_id, "choice_id": choice_id})
+        return len(sess.votes) >= len(sess.players)
+
+    def propose(self, proposer_id: Optional[str], contents: List[str]) -> List[Choice]:
+        out = [Choice(proposer_id=proposer_id, content=text, created_at=now_utc()) for text in contents]
+        for c in out:
+            self.choices[c.choice_id] = c
+            self._docs[(CHOICES_COLL, c.choice_id)] = c.model_dump()
+        self._changed()
+        session_hub.publish(self.sid, "choice_proposed", {"choices": [c.model_dump(mode="json") for c in out]})
+        return out
+
+    def add_saved_choices(self, choices: List[Choice]) -> None:
+        """Варіанти, які вже записані в Firestore іншим шляхом (AI)."""
+        for c in choices:
+            self.choices[c.choice_id] = c
+
+    def list_choices(self) -> List[Choice]:
+        return list(self.choices.values())
+
+    def reset_round(self, next_round: int) -> None:
+        """After finalize: votes, tally and choices are already cleared in Firestore."""
+        self.state.round = next_round
+        self.state.votes = {}
+        self.state.tally = {}
+        self.choices = {}
+        self._fields = {k: v for k, v in self._fields.items() if not k.startswith(("votes.", "tally."))}
+        self._docs = {k: v for k, v in self._docs.items() if k[0] != CHOICES_COLL}
+
+    # ── запис у Firestore ──
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(SESSION_FLUSH_SECONDS)
+        delay = SESSION_FLUSH_SECONDS
+        for attempt in range(SESSION_FLUSH_RETRIES + 1):
+            try:
+                await self.flush()
+                return
+            except Exception:
+                if attempt == SESSION_FLUSH_RETRIES:
+                    logger.exception("Flush of session %s failed", self.sid)
+                    self._drop_queued()
+                    return
+                logger.exception("Flush of session %s failed, retrying in %.1fs", self.sid, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    def _drop_queued(self) -> None:
+        # пам'ять і Firestore тепер розходяться - лишаємо слід, що саме втрачено
+        logger.error(
+            "Giving up on session %s after %d retries, dropping fields %s and documents %s",
+            self.sid, SESSION_FLUSH_RETRIES, sorted(self._fields),
+            sorted(f"{coll}/{doc_id}" for coll, doc_id in self._docs),
+        )
+        self._fields, self._docs = {}, {}
+
+    async def flush(self) -> None:
+        """Writes every queued change; on failure the changes stay queued."""
+        async with self._commit_lock:
+            await self._commit()
+
+    @asynccontextmanager
+    async def closing_round(self):
+        """
+        Flushes the queued votes and keeps further flushes out until the
+        block ends. The caller closes the round in Firestore and calls
+        reset_round inside the block, so a vote that arrives meanwhile is
+        dropped by reset_round instead of being written into the next round.
+        """
+        async with self._commit_lock:
+            await self._commit()
+            yield
+
+    async def _commit(self) -> None:
+        if not self.dirty:
+            return
+        fields, docs = self._fields, self._docs
+        self._fields, self._docs = {}, {}
+        ops: List[Tuple[Any, Optional[dict]]] = [
+            (self.ref.collection(coll).document(doc_id), data)
+            for (coll, doc_id), data in docs.items()
+        ]
+        try:
+            for i in range(0, max(len(ops), 1), FIRESTORE_BATCH_LIMIT - 1):
+                batch = self.db.batch()
+                for doc_ref, data in ops[i:i + FIRESTORE_BATCH_LIMIT - 1]:
+                    batch.set(doc_ref, data)
+                if i == 0 and fields:
+                    batch.update(self.ref, fields)
+                await batch.commit()
+        except Exception:
+            # повертаємо в чергу; новіші значення, що встигли з'явитись, важливіші
+            self._fields = {**fields, **self._fields}
+            self._docs = {**docs, **self._docs}
+            raise
+
+
+class SessionActors:
+    """Registry of the session actors of this worker."""
+
+    def __init__(self):
+        self._actors: Dict[str, SessionActor] = {}
+        self._loading = SingleFlight()
+
+    def __len__(self) -> int:
+        return len(self._actors)
+
+    def enabled_for(self, sid: str) -> bool:
+        return SESSION_ACTORS and owns(sid)
+
+    def peek(self, sid: str) -> Optional[SessionActor]:
+        return self._actors.get(sid)
+
+    async def get(self, db: AsyncClient, sid: str) -> SessionActor:
+        actor = self._actors.get(sid)
+        if actor is not None:
+            return actor
+
+        async def load() -> SessionActor:
+            ref = db.collection("sessions").document(sid)
+            snap = await ref.get()
+            if not snap.exists:
+                raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Session not found")
+            sess = MultiplayerSession.model_validate(snap.to_dict())
+            choices = [Choice.model_validate(d.to_dict()) async for d in ref.collection(CHOICES_COLL).stream()]
+            return self._actors.setdefault(sid, SessionActor(db, sess, choices))
+
+        return await self._loading.do(sid, load)
+
+    def drop(self, sid: str) -> None:
+        """Forgets the actor without flushing (the session was deleted)."""
+        actor = self._actors.pop(sid, None)
+        if actor is not None and actor._flush_task is not None:
+            actor._flush_task.cancel()
+
+    async def flush_all(self) -> None:
+        for actor in list(self._actors.values()):
+            try:
+                await actor.flush()
+            except Exception:
+                logger.exception("Final flush of session %s failed", actor.sid)
+
+    async def evict_idle_forever(self) -> None:
+        """Background task: flushes and unloads sessions idle for too long."""
+        while True:
+            await asyncio.sleep(max(SESSION_ACTOR_IDLE_SECONDS / 4, 1))
+            cutoff = time.monotonic() - SESSION_ACTOR_IDLE_SECONDS
+            for sid, actor in list(self._actors.items()):
+                if actor.touched >= cutoff:
+                    continue
+                try:
+                    await actor.flush()
+                except Exception:
+                    logger.exception("Flush of idle session %s failed", sid)
+                    continue
+                if actor.touched < cutoff and not actor.dirty:
+                    self._actors.pop(sid, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "enabled": SESSION_ACTORS,
+            "actors":  len(self._actors),
+            "dirty":   sum(1 for a in self._actors.values() if a.dirty),
+        }
+
+
+session_actors = SessionActors()
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Set
+
+logger = logging.getLogger(__name__)
+
+# Скільки непрочитаних подій тримаємо для одного з'єднання; хто відстав більше - відключається
+SESSION_EVENT_QUEUE = 256
+
+
+class SessionHub:
+    """
+    In-process fan-out of multiplayer session events to the WebSocket
+    connections of this worker. Each connection gets its own bounded queue;
+    publish() never blocks, a subscriber whose queue is full is dropped
+    (it receives None and should reconnect and re-read the state).
+    """
+
+    def __init__(self, queue_size: int = SESSION_EVENT_QUEUE):
+        self.queue_size = queue_size
+        self._subs: Dict[str, Set[asyncio.Queue]] = {}
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, sid: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subs.setdefault(sid, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, sid: str, queue: asyncio.Queue) -> None:
+        subs = self._subs.get(sid)
+        if subs is None:
+            return
+        subs.discard(queue)
+        if not subs:
+            del self._subs[sid]
+
+    def publish(self, sid: str, event: str, data: Any) -> None:
+        subs = self._subs.get(sid)
+        if not subs:
+            return
+        message = {"event": event, "data": data, "ts": datetime.now(timezone.utc).isoformat()}
+        self.published += 1
+        for queue in list(subs):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # звільняємо місце під сигнал відключення
+                self.dropped += 1
+                self.unsubscribe(sid, queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+                logger.warning("Dropped slow subscriber of session %s", sid)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "sessions":    len(self._subs),
+            "connections": sum(len(s) for s in self._subs.values()),
+            "published":   self.published,
+            "dropped":     self.dropped,
+        }
+
+
+session_hub = SessionHub()
@@ -0,0 +1,34 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution: the
+    first caller starts `fn`, everyone arriving while it runs awaits the same
+    result (or exception). Once it finishes the key is forgotten, so later
+    calls start a fresh execution. Per process, event-loop only.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.coalesced += 1
+        else:
+            self.started += 1
+            fut = asyncio.ensure_future(fn())
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda _f: self._inflight.pop(key, None))
+        # shield: якщо один з клієнтів відключився, інші отримають результат
+        return await asyncio.shield(fut)
+
+    def stats(self) -> Dict[str, int]:
+        return {"inflight": len(self._inflight), "started": self.started, "coalesced": self.coalesced}
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import os
+from typing import Dict, Optional, Tuple
+
+from google.cloud.firestore import AsyncClient
+
+from utils.ai_utils import generate_continuation, load_novel_context
+from utils.cache import TTLCache
+from utils.story_summaries import summarized_context
+
+logger = logging.getLogger(__name__)
+
+# Спекулятивне продовження: після збереження сегмента одразу генеруємо наступний
+# у фоні, щоб /text/continue для тієї ж позиції відповів без очікування.
+AI_SPECULATION              = os.getenv("AI_SPECULATION", "0").lower() in ("1", "true", "yes")
+# Скільки спекуляцій може генеруватися одночасно: всього і від одного користувача
+AI_SPECULATION_MAX_INFLIGHT = int(os.getenv("AI_SPECULATION_MAX_INFLIGHT", "4"))
+AI_SPECULATION_PER_USER     = int(os.getenv("AI_SPECULATION_PER_USER", "1"))
+AI_SPECULATION_TTL          = float(os.getenv("AI_SPECULATION_TTL", "900"))
+AI_SPECULATION_CACHE_SIZE   = int(os.getenv("AI_SPECULATION_CACHE_SIZE", "512"))
+
+# novel_id -> (current_position, готовий текст)
+speculations = TTLCache(maxsize=AI_SPECULATION_CACHE_SIZE, ttl=AI_SPECULATION_TTL)
+# novel_id -> (current_position, задача, user_id)
+_inflight: Dict[str, Tuple[Optional[str], asyncio.Task, str]] = {}
+_user_inflight: Dict[str, int] = {}
+_counters = {"started": 0, "skipped": 0, "used": 0}
+
+
+async def continuation_inputs(db: AsyncClient, novel_id: str) -> dict:
+    """
+    Keyword arguments for generate_continuation / stream_continuation.
+    Raises ValueError if the novel does not exist.
+    """
+    ctx = await load_novel_context(novel_id, db)
+    novel = ctx["novel"]
+    # старіший текст - підсумками, новіший - як є
+    summary, own_text = await summarized_context(db, novel_id, ctx["own_segments"])
+    return dict(
+        full_text=own_text,
+        title=novel.title,
+        description=novel.description,
+        genres=novel.genres,
+        setting=novel.setting,
+        characters=ctx["characters"],
+        initial_context=ctx["original_context"],
+        summary=summary,
+    )
+
+
+def _release(novel_id: str, task: asyncio.Task) -> None:
+    entry = _inflight.get(novel_id)
+    if entry is None or entry[1] is not task:
+        return
+    del _inflight[novel_id]
+    user_id = entry[2]
+    left = _user_inflight.get(user_id, 1) - 1
+    if left > 0:
+        _user_inflight[user_id] = left
+    else:
+        _user_inflight.pop(user_id, None)
+
+
+def discard(novel_id: str) -> None:
+    """Drops the ready and the in-flight speculation of a novel (text changed)."""
+    speculations.invalidate(novel_id)
+    entry = _inflight.get(novel_id)
+    if entry is not None:
+        entry[1].cancel()
+        _release(novel_id, entry[1])
+
+
+def schedule(db: AsyncClient, novel_id: str, position: str, user_id: str) -> None:
+    """
+    Starts generating the continuation of `novel_id` at `position` in the
+    background, unless speculation is off or over its budget.
+    """
+    if not AI_SPECULATION:
+        return
+    discard(novel_id)
+    if len(_inflight) >= AI_SPECULATION_MAX_INFLIGHT \
+       or _user_inflight.get(user_id, 0) >= AI_SPECULATION_PER_USER:
+        _counters["skipped"] += 1
+        return
+
+    async def run():
+        try:
+            content = await generate_continuation(**await continuation_inputs(db, novel_id))
+            speculations.set(novel_id, (position, content))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Speculative continuation failed for novel %s", novel_id)
+        finally:
+            _release(novel_id, task)
+
+    _counters["started"] += 1
+    _user_inflight[user_id] = _user_inflight.get(user_id, 0) + 1
+    task = asyncio.create_task(run())
+    _inflight[novel_id] = (position, task, user_id)
+
+
+async def take(novel_id: str, position: Optional[str]) -> Optional[str]:
+    """
+    The speculated continuation for `position`, waiting for it if it is still
+    being generated, or None. A result is handed out only once, so asking
+    again produces a new variant.
+    """
+    entry = _inflight.get(novel_id)
+    if entry is not None and entry[0] == position:
+        # wait() не кидає помилок самої задачі і не скасовує її разом із запитом
+        await asyncio.wait({entry[1]})
+
+    ready = speculations.get(novel_id)
+    if ready is None or ready[0] != position:
+        return None
+    speculations.invalidate(novel_id)
+    _counters["used"] += 1
+    return ready[1]
+
+
+def stats() -> Dict[str, object]:
+    return {
+        "enabled":  AI_SPECULATION,
+        "inflight": len(_inflight),
+        **_counters,
+        "ready":    len(speculations),
+    }
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from google.cloud.firestore import AsyncClient
+
+from utils import text_snapshot
+from utils.ai_utils import generate_chapter_summary, generate_summary_of_summaries
+
+logger = logging.getLogger(__name__)
+
+# Ієрархія підсумків новели: novels/{id}/summaries/state
+#   overview - підсумок підсумків (усе, що старше за глави нижче),
+#   chapters - [{"summary", "segments"}] - підсумки окремих глав,
+#   covered  - скільки перших сегментів уже згорнуто в overview + chapters.
+SUMMARIES_COLL = "summaries"
+STATE_DOC      = "state"
+
+# Сегментів у главі
+SUMMARY_CHAPTER_SEGMENTS = int(os.getenv("SUMMARY_CHAPTER_SEGMENTS", "8"))
+# Останні сегменти, які завжди йдуть у промпт як є і не згортаються
+SUMMARY_KEEP_RECENT      = int(os.getenv("SUMMARY_KEEP_RECENT", "6"))
+# Скільки глав тримати окремо, перш ніж вливати найстаріші в overview
+SUMMARY_MAX_CHAPTERS     = int(os.getenv("SUMMARY_MAX_CHAPTERS", "6"))
+SUMMARY_FOLD_CHAPTERS    = int(os.getenv("SUMMARY_FOLD_CHAPTERS", "3"))
+
+_running: Dict[str, asyncio.Task] = {}
+
+
+def _empty_state() -> dict:
+    return {"overview": "", "chapters": [], "covered": 0}
+
+
+def _pending(total: int, covered: int) -> bool:
+    return total - covered - SUMMARY_KEEP_RECENT >= SUMMARY_CHAPTER_SEGMENTS
+
+
+async def refresh(db: AsyncClient, novel_id: str) -> None:
+    """
+    Folds every complete chapter older than the recent window into a chapter
+    summary, and the oldest chapter summaries into the overview. The state is
+    saved after every step, so an interrupted run resumes where it stopped.
+    """
+    novel_ref = db.collection("novels").document(novel_id)
+    novel_snap = await novel_ref.get()
+    if not novel_snap.exists:
+        return
+    texts = await text_snapshot.load_texts(db, novel_ref, novel_snap.to_dict())
+
+    state_ref = novel_ref.collection(SUMMARIES_COLL).document(STATE_DOC)
+    state_snap = await state_ref.get()
+    state = state_snap.to_dict() if state_snap.exists else _empty_state()
+    if state["covered"] > len(texts):
+        # сегменти видаляли - згортаємо заново
+        state = _empty_state()
+
+    while _pending(len(texts), state["covered"]):
+        start = state["covered"]
+        passages = texts[start:start + SUMMARY_CHAPTER_SEGMENTS]
+        previous = state["chapters"][-1]["summary"] if state["chapters"] else state["overview"]
+        summary = await generate_chapter_summary(passages, previous)
+        state["chapters"].append({"summary": summary, "segments": len(passages)})
+        state["covered"] = start + len(passages)
+
+        if len(state["chapters"]) > SUMMARY_MAX_CHAPTERS:
+            folded = state["chapters"][:SUMMARY_FOLD_CHAPTERS]
+            state["overview"] = await generate_summary_of_summaries(
+                state["overview"],
+                [c["summary"] for c in folded],
+            )
+            state["chapters"] = state["chapters"][SUMMARY_FOLD_CHAPTERS:]
+
+        await state_ref.set(state)
+
+
+def schedule_refresh(db: AsyncClient, novel_id: str) -> None:
+    """
+    Starts refresh() in the background unless one is already running for
+    this novel in this process.
+    """
+    task = _running.get(novel_id)
+    if task is not None and not task.done():
+        return
+
+    async def run():
+        try:
+            await refresh(db, novel_id)
+        except Exception:
+            logger.exception("Summary refresh failed for novel %s", novel_id)
+        finally:
+            if _running.get(novel_id) is task:
+                del _running[novel_id]
+
+    task = _running[novel_id] = asyncio.create_task(run())
+
+
+async def segment_changed(db: AsyncClient, novel_id: str, created_at: datetime) -> None:
+    """
+    Call after a segment created at `created_at` was edited or deleted. The
+    state tracks how many leading segments are folded, so a change inside
+    that range desyncs it: the summaries are dropped and rebuilt in the
+    background. Changes to the not yet folded segments cost one count query.
+    """
+    novel_ref = db.collection("novels").document(novel_id)
+    state_ref = novel_ref.collection(SUMMARIES_COLL).document(STATE_DOC)
+    state_snap = await state_ref.get()
+    if not state_snap.exists or not state_snap.get("covered"):
+        return
+    older = novel_ref.collection("text_segments").where("created_at", "<", created_at).count()
+    index = (await older.get())[0][0].value
+    if index >= state_snap.get("covered"):
+        return
+
+    # згортання, що вже йде, працює зі старим текстом - зупиняємо його
+    running = _running.pop(novel_id, None)
+    if running is not None:
+        running.cancel()
+    await state_ref.delete()
+    schedule_refresh(db, novel_id)
+
+
+async def summarized_context(
+    db: AsyncClient,
+    novel_id: str,
+    segments: List[str],
+) -> Tuple[Optional[str], str]:
+    """
+    Returns (summary of the already folded text or None, raw text of the
+    segments that are not covered by it). Schedules a refresh if there are
+    complete chapters left to fold.
+    """
+    state_snap = await (
+        db.collection("novels")
+          .document(novel_id)
+          .collection(SUMMARIES_COLL)
+          .document(STATE_DOC)
+          .get()
+    )
+    state = state_snap.to_dict() if state_snap.exists else _empty_state()
+    covered = state["covered"] if state["covered"] <= len(segments) else 0
+
+    if _pending(len(segments), covered):
+        schedule_refresh(db, novel_id)
+
+    if not covered:
+        return None, "\n\n".join(segments)
+
+    parts = [state["overview"]] if state["overview"] else []
+    parts.extend(c["summary"] for c in state["chapters"])
+    return "\n\n".join(parts), "\n\n".join(segments[covered:])
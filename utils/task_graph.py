@@ -0,0 +1,50 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Tuple
+
+# Вузол графа: (імена залежностей, fn(results_of_deps) -> результат)
+Node = Tuple[Iterable[str], Callable[[Dict[str, Any]], Awaitable[Any]]]
+
+
+def _check_acyclic(nodes: Dict[str, Node]) -> None:
+    pending = {name: {d for d in deps if d in nodes} for name, (deps, _) in nodes.items()}
+    while pending:
+        ready = [name for name, deps in pending.items() if not deps]
+        if not ready:
+            raise ValueError(f"Dependency cycle among: {', '.join(sorted(pending))}")
+        for name in ready:
+            del pending[name]
+        for deps in pending.values():
+            deps.difference_update(ready)
+
+
+async def run_graph(nodes: Dict[str, Node]) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """
+    Runs every node as soon as the nodes it depends on have finished, so
+    independent nodes run concurrently. A dependency that is not in `nodes`
+    is treated as already satisfied. Returns (results by name, wall-clock
+    milliseconds per node); the first failure cancels the rest and is raised.
+    """
+    results: Dict[str, Any] = {}
+    timings: Dict[str, float] = {}
+    tasks: Dict[str, asyncio.Task] = {}
+
+    async def run(name: str) -> None:
+        deps, fn = nodes[name]
+        deps = [d for d in deps if d in nodes]
+        if deps:
+            await asyncio.gather(*(tasks[d] for d in deps))
+        started = time.perf_counter()
+        results[name] = await fn({d: results[d] for d in deps})
+        timings[name] = (time.perf_counter() - started) * 1000
+
+    _check_acyclic(nodes)
+    for name in nodes:
+        tasks[name] = asyncio.ensure_future(run(name))
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        raise
+    return results, timings
@@ -0,0 +1,223 @@
+import logging
+import os
+from typing import List, Optional
+
+from firebase_admin import firestore
+from google.api_core.exceptions import FailedPrecondition, NotFound
+from google.cloud.firestore import (
+    AsyncClient,
+    AsyncDocumentReference,
+    AsyncTransaction,
+    async_transactional,
+)
+
+from utils.firebase import FIRESTORE_BATCH_LIMIT
+from utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Матеріалізований текст новели: novels/{id}/text_snapshot/{000000, 000001, ...}
+# Кожен чанк - {"segments": [{"segment_id", "content"}, ...]} у порядку created_at,
+# не більше TEXT_SNAPSHOT_CHUNK_KB (ліміт документа Firestore - 1 MiB).
+SNAPSHOT_COLL       = "text_snapshot"
+SNAPSHOT_CHUNK_SIZE = int(os.getenv("TEXT_SNAPSHOT_CHUNK_KB", "256")) * 1024
+
+# Поля в документі новели; знімок існує лише якщо є LAST_CHUNK_FIELD
+LAST_CHUNK_FIELD = "snapshot_last_chunk"
+LAST_SIZE_FIELD  = "snapshot_last_size"
+# Поле в документі сегмента: номер чанку, де лежить його текст
+SEGMENT_CHUNK_FIELD = "snapshot_chunk"
+
+_rebuilds = SingleFlight()
+
+
+def chunk_id(n: int) -> str:
+    return f"{n:06d}"
+
+
+def _size(content: str) -> int:
+    return len(content.encode("utf-8"))
+
+
+def has_snapshot(novel_data: dict) -> bool:
+    return LAST_CHUNK_FIELD in novel_data
+
+
+@async_transactional
+async def _append(
+    transaction: AsyncTransaction,
+    novel_ref: AsyncDocumentReference,
+    segment_ref: AsyncDocumentReference,
+    segment_doc: dict,
+    novel_fields: dict,
+) -> None:
+    # читання документа новели в транзакції серіалізує паралельні дописування:
+    # розмір і номер чанку не губляться, чанки заповнюються в порядку commit
+    snap = await novel_ref.get(transaction=transaction)
+    novel_data = snap.to_dict() or {}
+    segment_doc = dict(segment_doc)
+    snapshot_fields = {}
+    if has_snapshot(novel_data):
+        content = segment_doc["content"]
+        chunk = novel_data[LAST_CHUNK_FIELD]
+        size = novel_data.get(LAST_SIZE_FIELD, 0)
+        added = _size(content)
+        if size and size + added > SNAPSHOT_CHUNK_SIZE:
+            chunk, size = chunk + 1, 0
+        transaction.set(
+            novel_ref.collection(SNAPSHOT_COLL).document(chunk_id(chunk)),
+            {"segments": firestore.ArrayUnion([{"segment_id": segment_ref.id, "content": content}])},
+            merge=True,
+        )
+        segment_doc[SEGMENT_CHUNK_FIELD] = chunk
+        snapshot_fields = {LAST_CHUNK_FIELD: chunk, LAST_SIZE_FIELD: size + added}
+    transaction.set(segment_ref, segment_doc)
+    transaction.update(novel_ref, {**novel_fields, **snapshot_fields})
+
+
+async def append_segment(
+    db: AsyncClient,
+    novel_ref: AsyncDocumentReference,
+    segment_id: str,
+    segment_doc: dict,
+    novel_fields: dict,
+) -> None:
+    """
+    Writes a new text segment, appends it to the snapshot and applies
+    `novel_fields` to the novel - in one transaction on the novel document.
+    Without a snapshot only the segment and the novel are written; the
+    snapshot is built from scratch on the next load.
+    """
+    segment_ref = novel_ref.collection("text_segments").document(segment_id)
+    await _append(db.transaction(), novel_ref, segment_ref, segment_doc, novel_fields)
+
+
+@async_transactional
+async def _rewrite_chunk(
+    transaction: AsyncTransaction,
+    chunk_ref: AsyncDocumentReference,
+    segment_id: str,
+    content: Optional[str],
+) -> None:
+    snap = await chunk_ref.get(transaction=transaction)
+    if not snap.exists:
+        return
+    segments = []
+    for entry in snap.to_dict().get("segments", []):
+        if entry["segment_id"] != segment_id:
+            segments.append(entry)
+        elif content is not None:
+            segments.append({"segment_id": segment_id, "content": content})
+    transaction.update(chunk_ref, {"segments": segments})
+
+
+async def patch_segment(
+    db: AsyncClient,
+    novel_ref: AsyncDocumentReference,
+    segment_data: dict,
+    content: Optional[str],
+) -> None:
+    """
+    Replaces (or with content=None removes) one segment's text in its chunk.
+    A segment written before the snapshot existed has no chunk number; then
+    the snapshot is dropped and rebuilt on the next load.
+    """
+    chunk = segment_data.get(SEGMENT_CHUNK_FIELD)
+    if chunk is None:
+        await invalidate(novel_ref)
+        return
+    chunk_ref = novel_ref.collection(SNAPSHOT_COLL).document(chunk_id(chunk))
+    await _rewrite_chunk(db.transaction(), chunk_ref, segment_data["segment_id"], content)
+
+
+async def invalidate(novel_ref: AsyncDocumentReference) -> None:
+    await novel_ref.update({
+        LAST_CHUNK_FIELD: firestore.DELETE_FIELD,
+        LAST_SIZE_FIELD:  firestore.DELETE_FIELD,
+    })
+
+
+async def rebuild(db: AsyncClient, novel_ref: AsyncDocumentReference) -> List[str]:
+    """
+    Builds the snapshot from the text_segments subcollection (one full scan)
+    and returns the texts in order. Concurrent rebuilds of one novel share
+    one scan.
+    """
+    return await _rebuilds.do(novel_ref.path, lambda: _rebuild(db, novel_ref))
+
+
+async def _rebuild(db: AsyncClient, novel_ref: AsyncDocumentReference) -> List[str]:
+    # з цього моменту будь-яка зміна новели (новий сегмент, правка, видалення)
+    # оновлює її документ, і фінальний запис знімка нижче не пройде
+    novel_snap = await novel_ref.get()
+    snaps = (
+        novel_ref.collection("text_segments")
+                 .order_by("created_at")
+                 .stream()
+    )
+    chunks: List[List[dict]] = [[]]
+    size = 0
+    ops = []
+    async for doc in snaps:
+        content = doc.to_dict()["content"]
+        added = _size(content)
+        if size and size + added > SNAPSHOT_CHUNK_SIZE:
+            chunks.append([])
+            size = 0
+        chunks[-1].append({"segment_id": doc.id, "content": content})
+        size += added
+        ops.append(("update", doc.reference, {SEGMENT_CHUNK_FIELD: len(chunks) - 1}))
+
+    coll = novel_ref.collection(SNAPSHOT_COLL)
+    for n, segments in enumerate(chunks):
+        ops.append(("set", coll.document(chunk_id(n)), {"segments": segments}))
+    # хвіст від попереднього, довшого знімка
+    async for doc in coll.where("__name__", ">", coll.document(chunk_id(len(chunks) - 1))).stream():
+        ops.append(("delete", doc.reference, None))
+
+    texts = [entry["content"] for segments in chunks for entry in segments]
+    try:
+        for i in range(0, len(ops), FIRESTORE_BATCH_LIMIT):
+            batch = db.batch()
+            for op, ref, data in ops[i:i + FIRESTORE_BATCH_LIMIT]:
+                if op == "set":
+                    batch.set(ref, data)
+                elif op == "update":
+                    batch.update(ref, data)
+                else:
+                    batch.delete(ref)
+            await batch.commit()
+    except NotFound:
+        # сегмент видалили під час сканування: знімок лишається вимкненим
+        logger.info("Segment of novel %s deleted during snapshot rebuild, not enabling it", novel_ref.id)
+        return texts
+
+    if not novel_snap.exists:
+        return texts
+    # Знімок вмикається лише якщо новела не змінилась під час сканування;
+    # інакше він лишається вимкненим і наступне завантаження збудує його знову
+    try:
+        await novel_ref.update(
+            {LAST_CHUNK_FIELD: len(chunks) - 1, LAST_SIZE_FIELD: size},
+            option=db.write_option(last_update_time=novel_snap.update_time),
+        )
+    except (FailedPrecondition, NotFound):
+        logger.info("Novel %s changed during snapshot rebuild, not enabling it", novel_ref.id)
+    return texts
+
+
+async def load_texts(
+    db: AsyncClient,
+    novel_ref: AsyncDocumentReference,
+    novel_data: dict,
+) -> List[str]:
+    """
+    Story texts in created_at order: one read per chunk instead of one per
+    segment. Builds the snapshot first if the novel does not have one yet.
+    """
+    if not has_snapshot(novel_data):
+        return await rebuild(db, novel_ref)
+    texts: List[str] = []
+    async for doc in novel_ref.collection(SNAPSHOT_COLL).stream():
+        texts.extend(entry["content"] for entry in doc.to_dict().get("segments", []))
+    return texts
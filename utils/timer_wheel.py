@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import math
+import time
+from typing import Awaitable, Callable, Dict, Hashable, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+Callback = Callable[[], Awaitable[None]]
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel: one asyncio task ticks every `tick` seconds over
+    `slots` buckets, so thousands of pending deadlines cost one sleeping task
+    and O(1) schedule/cancel. A deadline fires on the first tick at or after
+    it (resolution = `tick`). Timers are keyed: scheduling a key again
+    replaces its previous timer. Callbacks run as separate tasks.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 512):
+        self.tick = tick
+        self._slots: List[Dict[Hashable, Tuple[int, Callback]]] = [{} for _ in range(slots)]
+        self._where: Dict[Hashable, int] = {}  # key -> номер слота
+        self._cursor = 0
+        self._running: Set[asyncio.Task] = set()
+        self.fired = 0
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._where
+
+    def schedule(self, key: Hashable, delay: float, callback: Callback) -> None:
+        self.cancel(key)
+        n = len(self._slots)
+        ticks = max(1, math.ceil(delay / self.tick))
+        slot = (self._cursor + ticks) % n
+        # скільки повних обертів колеса пропустити, перш ніж спрацювати
+        self._slots[slot][key] = ((ticks - 1) // n, callback)
+        self._where[key] = slot
+
+    def cancel(self, key: Hashable) -> bool:
+        slot = self._where.pop(key, None)
+        if slot is None:
+            return False
+        del self._slots[slot][key]
+        return True
+
+    def _advance(self) -> None:
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        bucket = self._slots[self._cursor]
+        for key, (rounds, callback) in list(bucket.items()):
+            if rounds > 0:
+                bucket[key] = (rounds - 1, callback)
+                continue
+            del bucket[key]
+            del self._where[key]
+            self.fired += 1
+            task = asyncio.create_task(self._fire(key, callback))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    @staticmethod
+    async def _fire(key: Hashable, callback: Callback) -> None:
+        try:
+            await callback()
+        except Exception:
+            logger.exception("Timer %r failed", key)
+
+    async def run(self) -> None:
+        """Background task driving the wheel; sleeps are drift-corrected."""
+        next_tick = time.monotonic() + self.tick
+        while True:
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+            next_tick += self.tick
+            self._advance()
+
+    def stats(self) -> Dict[str, int]:
+        return {"pending": len(self._where), "running": len(self._running), "fired": self.fired}